@@ -1,10 +1,18 @@
 # app/config.py
 import os, json
+from functools import lru_cache
+
+
+def _flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "y")
+
 
 class Settings:
     def __init__(self):
         # variabili generali
         self.JWT_SECRET = os.getenv("JWT_SECRET", "change-me")
+        # chiave per gli endpoint /api/admin/* (header X-Admin-Key); vuota = endpoint chiusi
+        self.ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
         self.GOOGLE_SHEET_ID = os.getenv("GOOGLE_SHEET_ID", "")
 
         # service account JSON su UNA riga nel .env
@@ -30,5 +38,64 @@ class Settings:
             host_emails = os.getenv("HOST_NOTIFICATION_EMAIL", "")
         self.HOST_NOTIFICATION_EMAILS = [email.strip() for email in host_emails.split(",") if email.strip()]
 
+        # --- Prenotazioni ---
+        # backend forzato ("excel", "google" o "sqlite"); vuoto = scelta automatica
+        self.BOOKINGS_BACKEND = os.getenv("BOOKINGS_BACKEND", "").strip().lower()
+        # vuoto = Bookings.sqlite3 accanto al file Excel
+        self.BOOKINGS_SQLITE_PATH = os.getenv("BOOKINGS_SQLITE_PATH", "")
+        # journal delle modifiche Excel: percorso (vuoto = <file Excel>.journal), secondi tra
+        # due compattazioni e numero di modifiche che ne anticipa una
+        self.BOOKINGS_EXCEL_JOURNAL = _flag("BOOKINGS_EXCEL_JOURNAL", "false")
+        self.BOOKINGS_EXCEL_JOURNAL_PATH = os.getenv("BOOKINGS_EXCEL_JOURNAL_PATH", "")
+        self.BOOKINGS_EXCEL_JOURNAL_INTERVAL = float(os.getenv("BOOKINGS_EXCEL_JOURNAL_INTERVAL", "5"))
+        self.BOOKINGS_EXCEL_JOURNAL_MAX_PENDING = int(os.getenv("BOOKINGS_EXCEL_JOURNAL_MAX_PENDING", "200"))
+        # massimo numero di modifiche scritte insieme dallo scrittore unico
+        self.BOOKINGS_WRITE_BATCH_MAX = int(os.getenv("BOOKINGS_WRITE_BATCH_MAX", "500"))
+
+        # --- Google Sheets ---
+        # secondi tra due riallineamenti del mirror locale
+        self.GOOGLE_MIRROR_INTERVAL = float(os.getenv("GOOGLE_MIRROR_INTERVAL", "30"))
+        # scritture: finestra di raccolta, quota al minuto e tentativi sui 429
+        self.GOOGLE_WRITE_TICK = float(os.getenv("GOOGLE_WRITE_TICK", "1"))
+        self.GOOGLE_WRITE_QUOTA_PER_MINUTE = float(os.getenv("GOOGLE_WRITE_QUOTA_PER_MINUTE", "60"))
+        self.GOOGLE_WRITE_MAX_RETRIES = int(os.getenv("GOOGLE_WRITE_MAX_RETRIES", "6"))
+        self.GOOGLE_WRITE_BACKOFF_MAX = float(os.getenv("GOOGLE_WRITE_BACKOFF_MAX", "32"))
+
+        # --- Log della chat ---
+        # cartella dei log (vuoto = ./logs) e dimensione oltre la quale chat.ndjson viene ruotato
+        self.CHAT_LOG_DIR = os.getenv("CHAT_LOG_DIR", "")
+        self.CHAT_LOG_ROTATE_BYTES = int(os.getenv("CHAT_LOG_ROTATE_BYTES", str(10 * 1024 * 1024)))
+        # coda in memoria: capacità e comportamento quando è piena ("drop" oppure "block")
+        self.CHAT_LOG_QUEUE_MAX = int(os.getenv("CHAT_LOG_QUEUE_MAX", "1000"))
+        self.CHAT_LOG_FULL_POLICY = os.getenv("CHAT_LOG_FULL_POLICY", "drop").strip().lower()
+        self.CHAT_LOG_BLOCK_TIMEOUT = float(os.getenv("CHAT_LOG_BLOCK_TIMEOUT", "0.5"))
+        # secondi tra due scritture su file e massimo numero di righe per blocco
+        self.CHAT_LOG_FLUSH_INTERVAL = float(os.getenv("CHAT_LOG_FLUSH_INTERVAL", "1"))
+        self.CHAT_LOG_BATCH_MAX = int(os.getenv("CHAT_LOG_BATCH_MAX", "500"))
+        # esportazione periodica nel tab Logs (secondi; 0 = disattivata)
+        self.CHAT_LOG_EXPORT_INTERVAL = float(os.getenv("CHAT_LOG_EXPORT_INTERVAL", "60"))
+        # archivio a colonne per le statistiche (vuoto = <CHAT_LOG_DIR>/store) e domande
+        # distinte tenute in memoria per la classifica di quelle senza risposta
+        self.CHAT_STORE_DIR = os.getenv("CHAT_STORE_DIR", "")
+        self.CHAT_STATS_TOP_CAPACITY = int(os.getenv("CHAT_STATS_TOP_CAPACITY", "5000"))
+
+        # --- Knowledge base ---
+        # cartella con un file per struttura (vuoto = ./conoscenza) e strutture tenute in memoria
+        self.KB_DIR = os.getenv("KB_DIR", "")
+        self.KB_SHARD_CACHE_SIZE = int(os.getenv("KB_SHARD_CACHE_SIZE", "32"))
+        # secondi tra due controlli dei file per la ricarica a caldo (0 = mai)
+        self.KB_RELOAD_INTERVAL = float(os.getenv("KB_RELOAD_INTERVAL", "2"))
+        # snapshot compilati .kbsnap accanto ai sorgenti
+        self.KB_COMPILED = _flag("KB_COMPILED", "1")
+        # ricerca: "bm25" oppure "hybrid" (BM25 + TF-IDF su n-grammi, richiede numpy)
+        self.KB_RETRIEVAL = os.getenv("KB_RETRIEVAL", "bm25").strip().lower()
+        self.KB_HYBRID_WEIGHT = float(os.getenv("KB_HYBRID_WEIGHT", "0.5"))
+        self.KB_VECTOR_MIN_SCORE = float(os.getenv("KB_VECTOR_MIN_SCORE", "0.15"))
+        # cache delle ricerche: voci massime e durata in secondi (0 = senza scadenza)
+        self.KB_QUERY_CACHE_SIZE = int(os.getenv("KB_QUERY_CACHE_SIZE", "1024"))
+        self.KB_QUERY_CACHE_TTL = float(os.getenv("KB_QUERY_CACHE_TTL", "600"))
+
+@lru_cache(maxsize=None)
 def get_settings() -> Settings:
+    """Settings letti una volta sola: dopo aver caricato il .env chiamare get_settings.cache_clear()."""
     return Settings()
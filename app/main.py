@@ -4,11 +4,14 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 
-from app.routers import booking, chat, ical as ical_router, notify
+from app.config import get_settings
+from app.routers import admin, booking, chat, ical as ical_router, notify
+from app.services import kb, logger, sheets
 
 
 def create_app() -> FastAPI:
     load_dotenv()
+    get_settings.cache_clear()
     app = FastAPI(title="Concierge AI Agent", version="0.0.1")
 
     # CORS per permettere al widget di chiamare l’API da fuori
@@ -25,10 +28,24 @@ def create_app() -> FastAPI:
     app.include_router(chat.router, prefix="/api")
     app.include_router(ical_router.router, prefix="/api")
     app.include_router(notify.router, prefix="/api")
+    app.include_router(admin.router, prefix="/api")
 
     # statici: /static/... leggerà dalla cartella public
     app.mount("/static", StaticFiles(directory="public"), name="static")
 
+    # scrittore prenotazioni e journal (backend Excel): recupero all'avvio, flush all'uscita
+    @app.on_event("startup")
+    def start_bookings_writer():
+        sheets.start_background_tasks()
+        kb.start_kb_watcher()
+
+    @app.on_event("shutdown")
+    def stop_bookings_writer():
+        # prima i log: la loro ultima esportazione passa dallo scrittore prenotazioni
+        logger.stop_chat_log()
+        sheets.stop_background_tasks()
+        kb.stop_kb_watcher()
+
     @app.get("/")
     def root():
         return {"ok": True, "msg": "Concierge backend up"}
@@ -0,0 +1,80 @@
+# app/routers/admin.py
+import hmac
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from pydantic import BaseModel
+from typing import Dict, List, Optional
+
+from app.config import get_settings
+from app.services import chat_store, kb
+
+
+def require_admin_key(x_admin_key: Optional[str] = Header(None)) -> None:
+    """
+    Accesso agli endpoint di amministrazione: header X-Admin-Key uguale ad ADMIN_API_KEY.
+    Senza ADMIN_API_KEY nel .env gli endpoint restano chiusi.
+    """
+    expected = get_settings().ADMIN_API_KEY
+    if not expected or not x_admin_key or not hmac.compare_digest(x_admin_key.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Chiave di amministrazione mancante o non valida")
+
+
+router = APIRouter(tags=["admin"], dependencies=[Depends(require_admin_key)])
+
+
+class LatencyPercentiles(BaseModel):
+    p50: Optional[float] = None
+    p90: Optional[float] = None
+    p99: Optional[float] = None
+
+class LocaleStats(BaseModel):
+    count: int
+    latency_ms: LatencyPercentiles
+
+class UnansweredQuestion(BaseModel):
+    question: str
+    count: int
+
+class StatsRes(BaseModel):
+    status: str
+    days: int
+    total: int
+    ai_ratio: Optional[float] = None
+    unanswered: int
+    top_unanswered: List[UnansweredQuestion]
+    top_unanswered_approximate: bool
+    locales: Dict[str, LocaleStats]
+
+@router.get("/admin/stats", response_model=StatsRes)
+def admin_stats(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    property_id: Optional[str] = None,
+    top: int = 10,
+):
+    """
+    Statistiche sulle conversazioni (date YYYY-MM-DD, estremi inclusi):
+    quota di risposte AI, domande più frequenti senza risposta dal KB,
+    volume e percentili di latenza per lingua.
+    """
+    top = min(max(top, 1), 100)
+    stats = chat_store.chat_stats(date_from, date_to, property_id, top)
+    return StatsRes(status="ok", **stats)
+
+class KbCacheRes(BaseModel):
+    status: str
+    size: int
+    capacity: int
+    ttl: float
+    hits: int
+    misses: int
+    hit_ratio: Optional[float] = None
+    expired: int
+    evictions: int
+
+@router.get("/admin/kb-cache", response_model=KbCacheRes)
+def admin_kb_cache():
+    """
+    Contatori della cache delle ricerche nel knowledge base (hit, miss, scadute, espulse).
+    """
+    return KbCacheRes(status="ok", **kb.kb_cache_stats())
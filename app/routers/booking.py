@@ -1,4 +1,9 @@
-from fastapi import APIRouter
+import csv
+import json
+
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 router = APIRouter(tags=["booking"])
 
 @router.get("/health")
@@ -11,13 +16,25 @@ def debug_sheet():
     """
     Legge tutte le righe del foglio Bookings.
     Solo per test: rimuovere in produzione.
+    Le righe vengono serializzate una alla volta man mano che il foglio è letto.
     """
     try:
         from app.services import sheets
-        rows = sheets._ws().get_all_records()
-        return {"rows": rows}
+        rows = sheets.iter_rows()
+        # leggiamo subito la prima riga: gli errori di backend arrivano qui
+        first = next(rows, None)
     except Exception as e:
         return {"error": str(e)}
+
+    def _stream():
+        yield '{"rows": ['
+        if first is not None:
+            yield json.dumps(first, ensure_ascii=False, default=str)
+            for row in rows:
+                yield "," + json.dumps(row, ensure_ascii=False, default=str)
+        yield "]}"
+
+    return StreamingResponse(_stream(), media_type="application/json")
     
 @router.get("/_debug/env")
 def debug_env():
@@ -60,7 +77,7 @@ def debug_append_sample():
     return {"ok": True, "inserted": sample}
 
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 class MatchGuestReq(BaseModel):
     arrival_date: str = Field(..., description="Data arrivo, es. 2025-12-10 o 10/12/2025")
@@ -253,3 +270,247 @@ def host_authorize(req: HostAuthorizeReq):
         out.message = (out.message + " | " if out.message else "") + ("Email inviata a " + guest_email if guest_email else "Nessuna email guest disponibile")
     return out
 
+
+# --- OPERAZIONI MASSIVE ---
+
+class BulkRes(BaseModel):
+    status: str
+    count: int
+    ok: int
+    results: List[Dict[str, Any]]
+
+async def _bulk_lines(request: Request):
+    """Righe del corpo della richiesta, lette man mano che arrivano."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8-sig") + "\n"
+    if buffer:
+        yield buffer.decode("utf-8-sig")
+
+async def _bulk_csv_rows(request: Request):
+    """Righe CSV (dict per intestazione) analizzate man mano che arrivano.
+
+    Una riga fisica con un numero dispari di virgolette apre un campo su più
+    righe: si accumula finché le virgolette non tornano pari.
+    """
+    headers: Optional[List[str]] = None
+    pending = ""
+    async for line in _bulk_lines(request):
+        pending += line
+        if pending.count('"') % 2:
+            continue
+        record, pending = pending, ""
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]), [])
+        if headers is None:
+            headers = values
+            continue
+        yield {k: v for k, v in zip(headers, values) if k}
+    if pending.strip() and headers is not None:
+        values = next(csv.reader([pending]), [])
+        yield {k: v for k, v in zip(headers, values) if k}
+
+async def _bulk_ndjson_items(request: Request):
+    """Elementi NDJSON, uno per riga (None per le righe non valide)."""
+    async for line in _bulk_lines(request):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+async def _bulk_list_items(items: List[Any]):
+    for item in items:
+        yield item
+
+@router.post("/bookings/bulk", response_model=BulkRes)
+async def bookings_bulk(request: Request):
+    """
+    Import massivo di prenotazioni: righe con le colonne del tab 'Bookings'
+    (almeno checkin_date e guest_last_name). Il corpo può essere CSV
+    (text/csv, con intestazione), NDJSON (application/x-ndjson) oppure una
+    lista JSON. Ogni riga aggiorna la prenotazione esistente o ne crea una
+    nuova; le righe vengono scritte a blocchi di BOOKINGS_WRITE_BATCH_MAX
+    man mano che arrivano, una scrittura per blocco.
+    """
+    from app.config import get_settings
+    from app.services import sheets
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        items = _bulk_csv_rows(request)
+    elif content_type in ("application/x-ndjson", "application/jsonl", "application/json-seq"):
+        items = _bulk_ndjson_items(request)
+    else:
+        try:
+            body = json.loads(await request.body() or b"[]")
+        except ValueError:
+            return BulkRes(status="invalid_body", count=0, ok=0, results=[])
+        body = body.get("bookings", []) if isinstance(body, dict) else body
+        if not isinstance(body, list):
+            return BulkRes(status="invalid_body", count=0, ok=0, results=[])
+        items = _bulk_list_items(body)
+
+    chunk_size = max(1, get_settings().BOOKINGS_WRITE_BATCH_MAX)
+    results: List[dict] = []
+    chunk: List[Any] = []
+    async for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            results += await run_in_threadpool(sheets.bulk_upsert_bookings, chunk)
+            chunk = []
+    if chunk:
+        results += await run_in_threadpool(sheets.bulk_upsert_bookings, chunk)
+    ok = sum(1 for r in results if r["status"] == "ok")
+    return BulkRes(status="ok", count=len(results), ok=ok, results=results)
+
+class HostAuthorizeBulkReq(BaseModel):
+    items: List[HostAuthorizeReq]
+
+@router.post("/host/authorize/bulk", response_model=BulkRes)
+def host_authorize_bulk(req: HostAuthorizeBulkReq):
+    """
+    Autorizza più ospiti con una sola scrittura sul foglio, poi invia le
+    email di attivazione in blocco (una sola connessione SMTP).
+    """
+    from app.services import sheets
+    results = sheets.bulk_authorize_guests([item.dict() for item in req.items])
+
+    from app.services.templates import activation_email
+
+    emails = []
+    targets = []
+    for result in results:
+        row = result.get("data") or {}
+        guest_email = (row.get("guest_email") or "").strip()
+        if result.get("status") != "ok":
+            continue
+        if not guest_email:
+            result["message"] = "Nessuna email guest disponibile"
+            continue
+        subject, html = activation_email(row, (row.get("locale") or "it").lower())
+        emails.append((guest_email, subject, html))
+        targets.append((result, guest_email))
+
+    if emails:
+        from app.services.mail import send_emails
+        for (result, guest_email), error in zip(targets, send_emails(emails)):
+            result["message"] = f"Email non inviata: {error}" if error else "Email inviata a " + guest_email
+
+    ok = sum(1 for r in results if r["status"] == "ok")
+    return BulkRes(status="ok", count=len(results), ok=ok, results=results)
+
+# --- SOGGIORNI (housekeeping / concierge) ---
+
+# campi restituiti dagli elenchi: niente email, codici di accesso, coupon o note
+_STAY_FIELDS = (
+    "property_id",
+    "booking_ref",
+    "checkin_date",
+    "checkin_time",
+    "checkout_date",
+    "checkout_time",
+    "guest_first_name",
+    "guest_last_name",
+    "locale",
+    "status",
+)
+
+class StayBooking(BaseModel):
+    row_index: int
+    data: Dict[str, Any]
+
+def _stay_booking(row_index: int, rec: Dict[str, Any]) -> StayBooking:
+    return StayBooking(row_index=row_index, data={k: rec.get(k, "") for k in _STAY_FIELDS})
+
+class StayListRes(BaseModel):
+    status: str
+    message: Optional[str] = None
+    count: int = 0
+    bookings: List[StayBooking] = []
+
+def _stay_list(query, *args) -> StayListRes:
+    try:
+        hits = query(*args)
+    except ValueError as e:
+        return StayListRes(status="invalid_date", message=str(e))
+    bookings = [_stay_booking(idx, rec) for idx, rec in hits]
+    return StayListRes(status="ok", count=len(bookings), bookings=bookings)
+
+@router.get("/bookings/in-house", response_model=StayListRes)
+def bookings_in_house(date: str, property_id: Optional[str] = None):
+    """
+    Ospiti in casa nella notte di `date` (arrivo <= date < partenza).
+    """
+    from app.services import sheets
+    return _stay_list(sheets.bookings_in_house, date, property_id)
+
+@router.get("/bookings/staying", response_model=StayListRes)
+def bookings_staying(date_from: str, date_to: Optional[str] = None, property_id: Optional[str] = None):
+    """
+    Prenotazioni con almeno una notte tra `date_from` e `date_to` (inclusi).
+    """
+    from app.services import sheets
+    return _stay_list(sheets.bookings_overlapping, date_from, date_to, property_id)
+
+@router.get("/bookings/arrivals", response_model=StayListRes)
+def bookings_arrivals(date_from: str, date_to: Optional[str] = None, property_id: Optional[str] = None):
+    """
+    Arrivi tra `date_from` e `date_to` (inclusi), in ordine di data.
+    """
+    from app.services import sheets
+    return _stay_list(sheets.bookings_arriving, date_from, date_to, property_id)
+
+@router.get("/bookings/departures", response_model=StayListRes)
+def bookings_departures(date_from: str, date_to: Optional[str] = None, property_id: Optional[str] = None):
+    """
+    Partenze tra `date_from` e `date_to` (inclusi), in ordine di data.
+    """
+    from app.services import sheets
+    return _stay_list(sheets.bookings_departing, date_from, date_to, property_id)
+
+class PendingRes(BaseModel):
+    status: str
+    total: int
+    offset: int
+    bookings: List[StayBooking]
+
+@router.get("/bookings/pending", response_model=PendingRes)
+def bookings_pending(property_id: Optional[str] = None, offset: int = 0, limit: int = 50):
+    """
+    Registrazioni in sospeso: prenotazioni senza nome, cognome o email,
+    in ordine di riga, a pagine di `limit` elementi.
+    """
+    from app.services import sheets
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), 500)
+    total = sheets.count_incomplete_bookings(property_id)
+    rows = sheets.incomplete_booking_rows(property_id, offset, limit)
+    bookings = [_stay_booking(idx, rec) for idx, rec in rows]
+    return PendingRes(status="ok", total=total, offset=offset, bookings=bookings)
+
+class OverlapPair(BaseModel):
+    property_id: str
+    row_indexes: List[int]
+
+class OverlapRes(BaseModel):
+    status: str
+    count: int
+    overlaps: List[OverlapPair]
+
+@router.get("/bookings/overlaps", response_model=OverlapRes)
+def bookings_overlaps(property_id: Optional[str] = None):
+    """
+    Doppie prenotazioni: coppie di soggiorni sovrapposti nella stessa struttura.
+    """
+    from app.services import sheets
+    overlaps = [
+        OverlapPair(property_id=pid, row_indexes=[first, second])
+        for pid, first, second in sheets.find_double_bookings(property_id)
+    ]
+    return OverlapRes(status="ok", count=len(overlaps), overlaps=overlaps)
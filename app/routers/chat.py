@@ -4,6 +4,7 @@ from __future__ import annotations
 from fastapi import APIRouter
 from pydantic import BaseModel
 from typing import Optional, Dict, Any
+import time
 from datetime import datetime, date
 
 from app.services.kb import kb_snippets_for, season, daypart, get_initial_info
@@ -33,6 +34,10 @@ async def chat(payload: ChatReq) -> Dict[str, Any]:
     user_msg = payload.message
     property_id = payload.propertyId or "CT-01"
     locale = payload.locale or "it"
+    started = time.monotonic()
+
+    def _elapsed_ms() -> float:
+        return (time.monotonic() - started) * 1000
 
     def _log_and_return(text: str, used_ai: bool, extra: Optional[Dict[str, Any]] = None):
         try:
@@ -43,6 +48,7 @@ async def chat(payload: ChatReq) -> Dict[str, Any]:
                 bot_msg=text,
                 used_ai=used_ai,
                 extra=extra or {},
+                latency_ms=_elapsed_ms(),
             )
         except Exception:
             pass
@@ -56,8 +62,7 @@ async def chat(payload: ChatReq) -> Dict[str, Any]:
 
 # 0) FLUSSO REGISTRAZIONE RAPIDA PER PRENOTAZIONI SENZA DATI
     if payload.first_access:
-        incomplete = sheets.list_incomplete_bookings(property_id=property_id)
-        if incomplete:
+        if sheets.has_incomplete_bookings(property_id=property_id):
             text = (
                 "Ciao! Hai una prenotazione presso la nostra struttura? "
                 "Se sì, indicami data di arrivo e di partenza (formato YYYY-MM-DD) "
@@ -247,7 +252,8 @@ async def chat(payload: ChatReq) -> Dict[str, Any]:
                     guest_msg=user_msg,
                     bot_msg=translated,
                     used_ai=True,
-                    extra={"booking_found": bool(booking_row)},
+                    extra={"booking_found": bool(booking_row), "kb_hits": len(snippets)},
+                    latency_ms=_elapsed_ms(),
                 )
             except Exception:
                 pass
@@ -261,7 +267,8 @@ async def chat(payload: ChatReq) -> Dict[str, Any]:
                 guest_msg=user_msg,
                 bot_msg=local_answer,
                 used_ai=False,
-                extra={"booking_found": bool(booking_row)},
+                extra={"booking_found": bool(booking_row), "kb_hits": len(snippets)},
+                latency_ms=_elapsed_ms(),
             )
         except Exception:
             pass
@@ -286,7 +293,8 @@ async def chat(payload: ChatReq) -> Dict[str, Any]:
             guest_msg=user_msg,
             bot_msg=ai_answer,
             used_ai=True,
-            extra={"booking_found": bool(booking_row)},
+            extra={"booking_found": bool(booking_row), "kb_hits": len(snippets)},
+            latency_ms=_elapsed_ms(),
         )
     except Exception:
         pass
@@ -0,0 +1,52 @@
+# app/services/bookings_io.py
+"""Import/export delle prenotazioni tra `Bookings.xlsx` e il database SQLite.
+
+Uso:
+    python -m app.services.bookings_io import [Bookings.xlsx]
+    python -m app.services.bookings_io export Export.xlsx [--force]
+
+Il database usato è quello di `BOOKINGS_SQLITE_PATH`. L'export parte da una
+copia del Bookings.xlsx in uso (stili e fogli restano) e non sovrascrive file
+esistenti, a meno di `--force`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from app.config import get_settings
+from app.services import sheets
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Importa/esporta le prenotazioni tra Excel e SQLite")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument(
+        "path", nargs="?", help=f"file Excel (import: default {sheets.BOOKINGS_EXCEL_PATH}; export: obbligatorio)"
+    )
+    parser.add_argument("--force", action="store_true", help="export: sovrascrive il file se esiste già")
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        args.path = args.path or sheets.BOOKINGS_EXCEL_PATH
+    elif not args.path:
+        parser.error("export: indicare il file Excel da creare")
+    elif os.path.exists(args.path) and not args.force:
+        parser.error(f"{args.path} esiste già: usare --force per sovrascriverlo")
+    load_dotenv()
+    get_settings.cache_clear()
+
+    if args.command == "import":
+        count = sheets.import_excel_to_sqlite(args.path)
+        print(f"[BOOKINGS] importate {count} righe da {args.path} in {sheets.bookings_sqlite_path()}")
+    else:
+        count = sheets.export_sqlite_to_excel(args.path, overwrite=args.force)
+        print(f"[BOOKINGS] esportate {count} righe da {sheets.bookings_sqlite_path()} in {args.path}")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
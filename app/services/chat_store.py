@@ -0,0 +1,381 @@
+# app/services/chat_store.py
+"""Archivio a colonne dei log della chat e statistiche per l'amministrazione.
+
+I log vengono accodati in partizioni giorno/struttura:
+
+    <CHAT_STORE_DIR>/<YYYY-MM-DD>/<property_id>/
+        ts.i64          secondi epoch (array 'q')
+        used_ai.u8      1 se la risposta viene dall'AI (array 'B')
+        latency.f32     millisecondi di risposta, NaN se sconosciuti (array 'f')
+        kb_hits.i16     snippet trovati nel KB, -1 per i flussi guidati (array 'h')
+        locale.u8       codice della lingua (array 'B') + locale.dict (una per riga)
+        guest_msg.off   offset di fine di ogni messaggio (array 'Q') + guest_msg.bin
+
+Ogni colonna è un file binario a larghezza fissa in cui si aggiunge in coda;
+le statistiche leggono una partizione alla volta, quindi la memoria usata non
+dipende dalla lunghezza dello storico.
+"""
+
+import heapq
+import math
+import os
+import re
+import struct
+import urllib.parse
+from array import array
+from collections import Counter
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.config import get_settings
+
+try:  # pragma: no cover - import opzionale
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover - statistiche con gli array della libreria standard
+    np = None  # type: ignore
+
+# colonna -> typecode dell'array
+_COLUMNS = {
+    "ts.i64": "q",
+    "used_ai.u8": "B",
+    "latency.f32": "f",
+    "kb_hits.i16": "h",
+    "locale.u8": "B",
+    "guest_msg.off": "Q",
+}
+
+# istogramma delle latenze: 40 bucket per decade (~6% di risoluzione) da 1 ms a 1000 s
+_LAT_STEPS = 40
+_LAT_BUCKETS = 6 * _LAT_STEPS + 1
+
+
+def store_dir() -> str:
+    """Cartella dell'archivio: CHAT_STORE_DIR, altrimenti <cartella dei log>/store."""
+
+    from app.services.logger import log_dir  # il logger importa questo modulo
+
+    return get_settings().CHAT_STORE_DIR or os.path.join(log_dir(), "store")
+
+
+# ---------------------------------------------------------------------------
+# Scrittura
+# ---------------------------------------------------------------------------
+
+def _partition_dir(root: str, day: str, property_id: str) -> str:
+    return os.path.join(root, day, urllib.parse.quote(property_id or "-", safe=""))
+
+
+def _read_array(path: str, typecode: str, limit: Optional[int] = None) -> array:
+    values = array(typecode)
+    try:
+        with open(path, "rb") as f:
+            data = f.read() if limit is None else f.read(limit * values.itemsize)
+    except FileNotFoundError:
+        return values
+    usable = len(data) - len(data) % values.itemsize
+    values.frombytes(data[:usable])
+    return values
+
+
+def _row_count(pdir: str) -> int:
+    """Righe complete della partizione: la colonna più corta (una scrittura interrotta
+    può aver lasciato le altre più avanti)."""
+
+    counts = []
+    for name, typecode in _COLUMNS.items():
+        try:
+            size = os.path.getsize(os.path.join(pdir, name))
+        except FileNotFoundError:
+            size = 0
+        counts.append(size // array(typecode).itemsize)
+    return min(counts)
+
+
+def _locale_dict(pdir: str) -> List[str]:
+    try:
+        with open(os.path.join(pdir, "locale.dict"), encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f]
+    except FileNotFoundError:
+        return []
+
+
+def _append_partition(pdir: str, records: List[Dict[str, Any]]) -> None:
+    os.makedirs(pdir, exist_ok=True)
+
+    # allinea le colonne all'ultima riga completa prima di aggiungere
+    rows = _row_count(pdir)
+    offsets = _read_array(os.path.join(pdir, "guest_msg.off"), "Q", rows)
+    blob_end = offsets[-1] if offsets else 0
+    for name, typecode in _COLUMNS.items():
+        path = os.path.join(pdir, name)
+        if os.path.exists(path):
+            os.truncate(path, rows * array(typecode).itemsize)
+    blob_path = os.path.join(pdir, "guest_msg.bin")
+    if os.path.exists(blob_path):
+        os.truncate(blob_path, blob_end)
+
+    locales = _locale_dict(pdir)
+    codes = {name: i for i, name in enumerate(locales)}
+    new_locales: List[str] = []
+
+    ts = array("q")
+    used_ai = array("B")
+    latency = array("f")
+    kb_hits = array("h")
+    locale = array("B")
+    ends = array("Q")
+    blob = bytearray()
+    for record in records:
+        try:
+            ts.append(int(datetime.fromisoformat(record["ts"]).timestamp()))
+        except (KeyError, TypeError, ValueError):
+            ts.append(0)
+        used_ai.append(1 if record.get("used_ai") else 0)
+        value = record.get("latency_ms")
+        latency.append(float(value) if value is not None else math.nan)
+        hits = (record.get("extra") or {}).get("kb_hits")
+        kb_hits.append(max(-1, min(int(hits), 32767)) if isinstance(hits, int) else -1)
+        name = (record.get("locale") or "").replace("\n", " ")
+        if name not in codes and len(codes) < 255:
+            codes[name] = len(codes)
+            new_locales.append(name)
+        locale.append(codes.get(name, 255))
+        blob += (record.get("guest_msg") or "").encode("utf-8")
+        ends.append(blob_end + len(blob))
+
+    if new_locales:
+        with open(os.path.join(pdir, "locale.dict"), "a", encoding="utf-8") as f:
+            f.write("".join(name + "\n" for name in new_locales))
+    with open(blob_path, "ab") as f:
+        f.write(blob)
+    # la colonna degli offset per ultima: finché non è scritta le righe non "esistono"
+    for name, values in (
+        ("ts.i64", ts),
+        ("used_ai.u8", used_ai),
+        ("latency.f32", latency),
+        ("kb_hits.i16", kb_hits),
+        ("locale.u8", locale),
+        ("guest_msg.off", ends),
+    ):
+        with open(os.path.join(pdir, name), "ab") as f:
+            values.tofile(f)
+
+
+def append_records(records: Iterable[Dict[str, Any]]) -> None:
+    """Aggiunge un blocco di log (stesso formato del file NDJSON) alle partizioni.
+    Va chiamata da un solo thread alla volta (il thread del logger)."""
+
+    root = store_dir()
+    partitions: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for record in records:
+        day = str(record.get("ts") or "")[:10] or date.today().isoformat()
+        partitions.setdefault((day, record.get("property_id") or ""), []).append(record)
+    for (day, property_id), batch in partitions.items():
+        _append_partition(_partition_dir(root, day, property_id), batch)
+
+
+# ---------------------------------------------------------------------------
+# Statistiche
+# ---------------------------------------------------------------------------
+
+def _partitions(
+    date_from: Optional[str], date_to: Optional[str], property_id: Optional[str]
+) -> Iterator[Tuple[str, str, str]]:
+    """(giorno, property_id, cartella) delle partizioni nell'intervallo, in ordine di giorno."""
+
+    root = store_dir()
+    try:
+        days = sorted(os.listdir(root))
+    except FileNotFoundError:
+        return
+    for day in days:
+        if len(day) != 10 or (date_from and day < date_from) or (date_to and day > date_to):
+            continue
+        day_dir = os.path.join(root, day)
+        if property_id is not None:
+            names = [urllib.parse.quote(property_id or "-", safe="")]
+        else:
+            try:
+                names = sorted(os.listdir(day_dir))
+            except NotADirectoryError:
+                continue
+        for name in names:
+            pdir = os.path.join(day_dir, name)
+            if os.path.isdir(pdir):
+                yield day, urllib.parse.unquote(name), pdir
+
+
+_SPACES = re.compile(r"\s+")
+
+
+def _question_key(text: str) -> str:
+    return _SPACES.sub(" ", text).strip().strip("?!.").strip().casefold()
+
+
+class _TopCounter:
+    """Conteggio delle domande più frequenti con memoria limitata (Misra-Gries):
+    oltre `capacity` domande distinte i conteggi diventano stime per difetto."""
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(capacity, 1)
+        self.counts: Counter = Counter()
+        self.samples: Dict[str, str] = {}
+        self.approximate = False
+
+    def add(self, key: str, sample: str) -> None:
+        if key in self.counts or len(self.counts) < self.capacity:
+            self.counts[key] += 1
+            self.samples.setdefault(key, sample)
+            return
+        self.approximate = True
+        for other in list(self.counts):
+            self.counts[other] -= 1
+            if self.counts[other] <= 0:
+                del self.counts[other]
+                del self.samples[other]
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        return [(self.samples[key], count) for key, count in heapq.nlargest(n, self.counts.items(), key=lambda kv: kv[1])]
+
+
+def _lat_bucket(ms: float) -> int:
+    if ms <= 1.0:
+        return 0
+    return min(int(math.log10(ms) * _LAT_STEPS) + 1, _LAT_BUCKETS - 1)
+
+
+_F32 = struct.Struct("=f")
+_U32 = struct.Struct("=I")
+
+
+def _latency_counts(codes: array, latency: array) -> Iterator[Tuple[int, int, int]]:
+    """(codice lingua, bucket, conteggio) delle latenze note, calcolati sulle colonne intere."""
+
+    if np is not None:
+        ms = np.frombuffer(latency, dtype=np.float32).astype(np.float64)
+        lang = np.frombuffer(codes, dtype=np.uint8).astype(np.int64)
+        known = ~np.isnan(ms)  # NaN = latenza sconosciuta
+        ms, lang = ms[known], lang[known]
+        steps = np.floor(np.log10(np.maximum(ms, 1.0)) * _LAT_STEPS) + 1
+        buckets = np.where(ms <= 1.0, 0, np.minimum(steps, _LAT_BUCKETS - 1)).astype(np.int64)
+        counts = np.bincount(lang * _LAT_BUCKETS + buckets, minlength=256 * _LAT_BUCKETS)
+        for key in np.flatnonzero(counts).tolist():
+            yield key // _LAT_BUCKETS, key % _LAT_BUCKETS, int(counts[key])
+        return
+    # senza numpy: le latenze sono arrotondate a 0,1 ms, quindi le coppie (lingua, latenza)
+    # distinte sono poche; Counter le conta senza passare dal bucket riga per riga
+    # (i bit del float32 come chiave: tutti i NaN hanno la stessa)
+    bits = array("I", latency.tobytes())
+    for (code, raw), count in Counter(zip(codes, bits)).items():
+        ms = _F32.unpack(_U32.pack(raw))[0]
+        if ms == ms:
+            yield code, _lat_bucket(ms), count
+
+
+def _zero_rows(values: array) -> List[int]:
+    """Posizioni dei valori nulli di una colonna 'h' (le domande senza snippet dal KB)."""
+
+    if np is not None:
+        return np.flatnonzero(np.frombuffer(values, dtype=np.int16) == 0).tolist()
+    raw = values.tobytes()
+    rows: List[int] = []
+    i = raw.find(b"\0\0")
+    while i >= 0:
+        if i % 2:  # a cavallo tra due valori
+            i = raw.find(b"\0\0", i + 1)
+            continue
+        rows.append(i // 2)
+        i = raw.find(b"\0\0", i + 2)
+    return rows
+
+
+def _percentile(hist: List[int], total: int, q: float) -> Optional[float]:
+    """Valore (limite superiore del bucket, in ms) sotto cui cade la frazione q delle latenze."""
+
+    if not total:
+        return None
+    rank = max(1, math.ceil(q * total))
+    seen = 0
+    for i, count in enumerate(hist):
+        seen += count
+        if seen >= rank:
+            return round(10 ** (i / _LAT_STEPS), 1)
+    return None
+
+
+def chat_stats(
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    property_id: Optional[str] = None,
+    top: int = 10,
+) -> Dict[str, Any]:
+    """
+    Statistiche sui log nell'intervallo [date_from, date_to] (YYYY-MM-DD, estremi inclusi):
+    quota di risposte AI, domande senza risposta più frequenti (nessuno snippet dal KB),
+    volume e percentili di latenza per lingua. Le partizioni sono lette una alla volta.
+    """
+
+    total = 0
+    ai_total = 0
+    unanswered_total = 0
+    per_locale: Dict[str, Dict[str, Any]] = {}
+    questions = _TopCounter(get_settings().CHAT_STATS_TOP_CAPACITY)
+    days = set()
+
+    for day, _pid, pdir in _partitions(date_from, date_to, property_id):
+        rows = _row_count(pdir)
+        if not rows:
+            continue
+        days.add(day)
+        total += rows
+        used_ai = _read_array(os.path.join(pdir, "used_ai.u8"), "B", rows)
+        ai_total += used_ai.tobytes().count(1)
+
+        locales = _locale_dict(pdir)
+        codes = _read_array(os.path.join(pdir, "locale.u8"), "B", rows)
+        latency = _read_array(os.path.join(pdir, "latency.f32"), "f", rows)
+        code_bytes = codes.tobytes()
+        for code in set(code_bytes):
+            name = locales[code] if code < len(locales) else ""
+            stats = per_locale.setdefault(name, {"count": 0, "latency_count": 0, "hist": [0] * _LAT_BUCKETS})
+            stats["count"] += code_bytes.count(code)
+        for code, bucket, count in _latency_counts(codes, latency):
+            stats = per_locale[locales[code] if code < len(locales) else ""]
+            stats["hist"][bucket] += count
+            stats["latency_count"] += count
+
+        kb_hits = _read_array(os.path.join(pdir, "kb_hits.i16"), "h", rows)
+        missing = _zero_rows(kb_hits)
+        if not missing:
+            continue
+        unanswered_total += len(missing)
+        ends = _read_array(os.path.join(pdir, "guest_msg.off"), "Q", rows)
+        with open(os.path.join(pdir, "guest_msg.bin"), "rb") as f:
+            for i in missing:
+                start = ends[i - 1] if i else 0
+                f.seek(start)
+                text = f.read(ends[i] - start).decode("utf-8", errors="replace")
+                key = _question_key(text)
+                if key:
+                    questions.add(key, text.strip())
+
+    locales_out = {
+        name: {
+            "count": stats["count"],
+            "latency_ms": {
+                "p50": _percentile(stats["hist"], stats["latency_count"], 0.50),
+                "p90": _percentile(stats["hist"], stats["latency_count"], 0.90),
+                "p99": _percentile(stats["hist"], stats["latency_count"], 0.99),
+            },
+        }
+        for name, stats in sorted(per_locale.items())
+    }
+    return {
+        "days": len(days),
+        "total": total,
+        "ai_ratio": round(ai_total / total, 4) if total else None,
+        "unanswered": unanswered_total,
+        "top_unanswered": [{"question": text, "count": count} for text, count in questions.top(top)],
+        "top_unanswered_approximate": questions.approximate,
+        "locales": locales_out,
+    }
@@ -1,68 +1,88 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, NamedTuple
+import hashlib
+import heapq
+import itertools
+import marshal
+import math
+import os
 import re
+import tempfile
+import threading
+import time as _time
+import unicodedata
 from datetime import date, datetime, time
 
+from app.config import get_settings
+
+try:  # pragma: no cover - import opzionale
+    import numpy as np  # type: ignore
+except Exception:  # pragma: no cover - ricerca ibrida non disponibile
+    np = None  # type: ignore
+
 # percorso del file di conoscenza
 KB_PATH = Path(__file__).resolve().parents[2] / "conoscenza.txt"
+# Opzioni (KB_DIR, cache, ricarica, ricerca ibrida, snapshot compilati): KB_* in
+# app.config.Settings, lette al primo uso e non all'import del modulo.
+
+
+def kb_dir() -> Path:
+    """Cartella con un file per struttura (<property_id>.txt); le strutture senza file usano conoscenza.txt."""
+    return Path(get_settings().KB_DIR or Path(__file__).resolve().parents[2] / "conoscenza")
+
 
 # -------------------------------------------------
 # 1. FUNZIONE VECCHIA (wifi diretto) – la lascio
 # -------------------------------------------------
 def get_wifi(property_id: str, lang: str = "it") -> Optional[dict]:
     """
-    Versione semplice: cerca nel file una sezione con 'WI-FI' e tag property/lang.
+    Versione semplice: cerca una sezione con 'WI-FI' e tag property/lang.
     La teniamo per retrocompatibilità.
     """
-    try:
-        text = KB_PATH.read_text(encoding="utf-8", errors="ignore")
-    except FileNotFoundError:
+    snapshot = _snapshot_for(property_id)
+    if property_id not in snapshot.lookup.props or lang not in snapshot.lookup.langs:
         return None
+    key = ("get_wifi", property_id, lang)
+    if key not in snapshot.memo:
+        snapshot.memo[key] = next(
+            (
+                {"ssid": s["kv"].get("SSID"), "password": s["kv"].get("PASSWORD"), "note": s["kv"].get("NOTE")}
+                for s in snapshot.sections
+                if "WI-FI" in s["name"] and s["property"] == property_id and s["lang"] == lang
+            ),
+            None,
+        )
+    return snapshot.memo[key]
 
-    blocks = text.split("#")
-    for b in blocks:
-        b = b.strip()
-        if not b:
-            continue
-        header = b.splitlines()[0:1]
-        body = "\n".join(b.splitlines()[1:])
-        if "WI-FI" in "".join(header).upper():
-            if f"@property:{property_id}" in body and f"@lang:{lang}" in body:
-                ssid = _pull(body, "SSID:")
-                pwd = _pull(body, "PASSWORD:")
-                note = _pull(body, "NOTE:")
-                return {"ssid": ssid, "password": pwd, "note": note}
-    return None
-
-
-def _pull(block: str, key: str) -> Optional[str]:
-    for line in block.splitlines():
-        if line.strip().startswith(key):
-            return line.split(":", 1)[1].strip()
-    return None
 
 # -------------------------------------------------
 # 2. NUOVO PARSER A SEZIONI
 # -------------------------------------------------
 
-def _read_kb() -> str:
+def _read_kb(path: Path = KB_PATH) -> bytes:
     try:
-        return KB_PATH.read_text(encoding="utf-8")
+        return path.read_bytes()
     except FileNotFoundError:
-        return ""
+        return b""
 
 
-def _parse_sections() -> list[dict]:
+def _decode_kb(data: bytes) -> str:
+    # come read_text: a capo universali
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _parse_sections(raw: str, default_property: Optional[str] = None) -> list[dict]:
     """
-    Legge conoscenza.txt e lo trasforma in una lista di sezioni strutturate.
+    Trasforma il testo di conoscenza.txt in una lista di sezioni strutturate.
+    Nei file di una singola struttura le sezioni senza @property valgono per `default_property`.
     Formato atteso:
     # WIFI
     @property:CT-01 @lang:it
     SSID: ...
     PASSWORD: ...
     """
-    raw = _read_kb()
     if not raw:
         return []
 
@@ -78,7 +98,7 @@ def _parse_sections() -> list[dict]:
 
         # tag
         mprop = re.search(r"@property:([A-Za-z0-9\-_\.]+)", rest)
-        prop = mprop.group(1) if mprop else None
+        prop = mprop.group(1) if mprop else default_property
 
         mlang = re.search(r"@lang:([a-z]{2})", rest, re.I)
         lang = mlang.group(1).lower() if mlang else "it"
@@ -110,9 +130,6 @@ def _parse_sections() -> list[dict]:
 
     return out
 
-# 👇👇 QUI mancava la riga che ti dava errore
-_SECTIONS = _parse_sections()
-
 def _clean_kb_value(value: str) -> str:
     if not value:
         return ""
@@ -125,64 +142,102 @@ def _clean_kb_value(value: str) -> str:
 # -------------------------------------------------
 # 3. HELPER PER TROVARE SEZIONI
 # -------------------------------------------------
+# property/lingua che non compaiono nel KB: possono cadere solo sul fallback per nome
+_ANY = object()
+
+
+class _SectionLookup:
+    """
+    Tabella (nome, property, lingua) -> sezione con la catena di fallback
+    (match perfetto, poi solo property, poi solo nome) già risolta al caricamento.
+    """
+
+    def __init__(self, sections: list[dict]) -> None:
+        exact: Dict[tuple, dict] = {}
+        by_prop: Dict[tuple, dict] = {}
+        by_name: Dict[str, dict] = {}
+        for s in sections:
+            exact.setdefault((s["name"], s["property"], s["lang"]), s)
+            by_prop.setdefault((s["name"], s["property"]), s)
+            by_name.setdefault(s["name"], s)
+        self.props = {s["property"] for s in sections}
+        self.langs = {s["lang"] for s in sections}
+        self.table: Dict[tuple, dict] = {}
+        for name, fallback in by_name.items():
+            for prop in (*self.props, _ANY):
+                for lang in (*self.langs, _ANY):
+                    self.table[(name, prop, lang)] = (
+                        exact.get((name, prop, lang)) or by_prop.get((name, prop)) or fallback
+                    )
+
+    def key(self, name: str, property_id: str, lang: str) -> tuple:
+        return (
+            name.upper(),
+            property_id if property_id in self.props else _ANY,
+            lang if lang in self.langs else _ANY,
+        )
+
+
 def _find_section(name: str, property_id: str, lang: str = "it") -> Optional[dict]:
-    name = name.upper()
-    # prima: match perfetto
-    for s in _SECTIONS:
-        if s["name"] == name and s["property"] == property_id and s["lang"] == lang:
-            return s
-    # fallback: solo property
-    for s in _SECTIONS:
-        if s["name"] == name and s["property"] == property_id:
-            return s
-    # fallback: solo nome
-    for s in _SECTIONS:
-        if s["name"] == name:
-            return s
-    return None
+    lookup = _snapshot_for(property_id).lookup
+    return lookup.table.get(lookup.key(name, property_id, lang))
+
+
+def _memoized(name: str, property_id: str, lang: str, build) -> Any:
+    """
+    Valore derivato dalla sezione `name` (build(sezione)), calcolato una volta
+    per snapshot: con una nuova versione del KB si ricalcola da solo.
+    Il valore è condiviso tra le richieste: non va modificato.
+    """
+    snapshot = _snapshot_for(property_id)
+    key = (build.__name__, *snapshot.lookup.key(name, property_id, lang))
+    try:
+        return snapshot.memo[key]
+    except KeyError:
+        pass
+    section = snapshot.lookup.table.get(key[1:])
+    value = build(section) if section else None
+    snapshot.memo[key] = value
+    return value
 
 # -------------------------------------------------
 # 4. API SPECIFICHE (checkin, checkout, ecc.)
 # -------------------------------------------------
-def get_checkin(property_id: str, lang: str = "it") -> Optional[dict]:
-    s = _find_section("CHECKIN", property_id, lang)
-    if not s:
-        return None
+def _checkin(s: dict) -> dict:
     return {
         "start": s["kv"].get("START", "12:00"),
         "end": s["kv"].get("END", "22:00"),
         "text": s["kv"].get("TEXT") or s["text"]
     }
 
-def get_checkout(property_id: str, lang: str = "it") -> Optional[dict]:
-    s = _find_section("CHECKOUT", property_id, lang)
-    if not s:
-        return None
+def get_checkin(property_id: str, lang: str = "it") -> Optional[dict]:
+    return _memoized("CHECKIN", property_id, lang, _checkin)
+
+def _checkout(s: dict) -> dict:
     return {
         "time": s["kv"].get("TIME", "10:00"),
         "text": s["kv"].get("TEXT") or s["text"]
     }
 
-def get_emergency(property_id: str, lang: str = "it") -> Optional[dict]:
-    s = _find_section("EMERGENCY", property_id, lang)
-    if not s:
-        return None
+def get_checkout(property_id: str, lang: str = "it") -> Optional[dict]:
+    return _memoized("CHECKOUT", property_id, lang, _checkout)
+
+def _emergency(s: dict) -> dict:
     return {
         "host_phone": s["kv"].get("HOST_PHONE"),
         "text": s["kv"].get("TEXT") or s["text"]
     }
 
-def get_parking(property_id: str, lang: str = "it") -> Optional[str]:
-    s = _find_section("PARKING", property_id, lang)
-    if not s:
-        return None
+def get_emergency(property_id: str, lang: str = "it") -> Optional[dict]:
+    return _memoized("EMERGENCY", property_id, lang, _emergency)
+
+def _parking(s: dict) -> str:
     return s["kv"].get("TEXT") or s["text"]
 
-def get_initial_info(property_id: str, lang: str = "it") -> Optional[dict]:
-    section = _find_section("INFO_INIZIALI", property_id, lang)
-    if not section:
-        return None
+def get_parking(property_id: str, lang: str = "it") -> Optional[str]:
+    return _memoized("PARKING", property_id, lang, _parking)
 
+def _initial_info(section: dict) -> dict:
     parts: list[str] = []
 
     primary_text = _clean_kb_value(section["kv"].get("TEXT", ""))
@@ -224,12 +279,15 @@ def get_initial_info(property_id: str, lang: str = "it") -> Optional[dict]:
         "checkout_time": checkout_time,
     }
 
-def get_restaurants(property_id: str, lang: str = "it") -> Optional[list[str]]:
-    s = _find_section("RESTAURANTS", property_id, lang)
-    if not s:
-        return None
+def get_initial_info(property_id: str, lang: str = "it") -> Optional[dict]:
+    return _memoized("INFO_INIZIALI", property_id, lang, _initial_info)
+
+def _restaurants(s: dict) -> list[str]:
     return s["items"]
 
+def get_restaurants(property_id: str, lang: str = "it") -> Optional[list[str]]:
+    return _memoized("RESTAURANTS", property_id, lang, _restaurants)
+
 def get_sea(property_id: str, lang: str = "it", today: date | None = None) -> Optional[str]:
     s = _find_section("SEA", property_id, lang)
     if not s:
@@ -281,32 +339,319 @@ def time_gate_for_code(now: datetime, row: Dict[str,str]) -> Optional[str]:
 # -------------------------------------------------
 # 7. SNIPPET PER L’AI
 # -------------------------------------------------
-def kb_snippets_for(query: str, property_id: str, lang: str, top_k: int = 6) -> list[str]:
-    q = query.lower()
-    candidates: list[tuple[float, str]] = []
-    for s in _SECTIONS:
-        if s["property"] not in (None, property_id):
-            continue
-        if s["lang"] not in (lang,):
-            continue
-        body = "\n".join([
-            s["name"],
-            "\n".join(f"{k}: {v}" for k, v in s["kv"].items()),
-            s["text"],
-            "\n".join(s["items"]),
-        ]).strip()
-        if not body:
-            continue
-        score = 0.0
-        for token in set(re.findall(r"[a-zà-ù0-9]+", q)):
-            if token and token in body.lower():
-                score += 1.0
-        score -= 0.05 * len(s["items"])
-        if score > 0:
-            candidates.append((score, body))
+# parametri BM25
+_BM25_K1 = 1.2
+_BM25_B = 0.75
+
+
+def _fold(text: str) -> str:
+    """Minuscolo e senza accenti: "Attività" -> "attivita"."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def _tokens(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", _fold(text))
+
+
+def _section_body(s: dict) -> str:
+    return "\n".join([
+        s["name"],
+        "\n".join(f"{k}: {v}" for k, v in s["kv"].items()),
+        s["text"],
+        "\n".join(s["items"]),
+    ]).strip()
+
+
+class _SnippetIndex:
+    """
+    Indice invertito delle sezioni per kb_snippets_for: per ogni termine
+    (minuscolo, senza accenti) le sezioni che lo contengono con il peso BM25
+    già calcolato, così una ricerca costa quanto i termini della domanda.
+    """
+
+    def __init__(self, sections: list[dict]) -> None:
+        self.bodies: list[str] = []
+        self.props: list[Optional[str]] = []
+        self.langs: list[str] = []
+        counts: list[Dict[str, int]] = []
+        for s in sections:
+            body = _section_body(s)
+            if not body:
+                continue
+            tf: Dict[str, int] = {}
+            for term in _tokens(body):
+                tf[term] = tf.get(term, 0) + 1
+            self.bodies.append(body)
+            self.props.append(s["property"])
+            self.langs.append(s["lang"])
+            counts.append(tf)
+
+        n_docs = len(counts)
+        lengths = [sum(tf.values()) for tf in counts]
+        avgdl = (sum(lengths) / n_docs) if n_docs else 1.0
+        df: Dict[str, int] = {}
+        for tf in counts:
+            for term in tf:
+                df[term] = df.get(term, 0) + 1
+
+        self.postings: Dict[str, list[tuple[int, float]]] = {}
+        for doc, tf in enumerate(counts):
+            norm = _BM25_K1 * (1 - _BM25_B + _BM25_B * lengths[doc] / (avgdl or 1.0))
+            for term, freq in tf.items():
+                idf = math.log(1 + (n_docs - df[term] + 0.5) / (df[term] + 0.5))
+                weight = idf * freq * (_BM25_K1 + 1) / (freq + norm)
+                self.postings.setdefault(term, []).append((doc, weight))
+
+    def state(self) -> tuple:
+        return (self.bodies, self.props, self.langs, self.postings)
+
+    @classmethod
+    def from_state(cls, state: tuple) -> "_SnippetIndex":
+        index = cls.__new__(cls)
+        index.bodies, index.props, index.langs, index.postings = state
+        return index
+
+    def scores(self, query: str, property_id: str, lang: str) -> Dict[int, float]:
+        scores: Dict[int, float] = {}
+        for term in set(_tokens(query)):
+            for doc, weight in self.postings.get(term, ()):
+                if self.langs[doc] != lang or self.props[doc] not in (None, property_id):
+                    continue
+                scores[doc] = scores.get(doc, 0.0) + weight
+        return scores
+
+    def top(self, scores: Dict[int, float], top_k: int) -> list[str]:
+        best = heapq.nsmallest(top_k, scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [self.bodies[doc] for doc, _ in best]
+
+    def search(self, query: str, property_id: str, lang: str, top_k: int) -> list[str]:
+        return self.top(self.scores(query, property_id, lang), top_k)
+
+
+_NGRAM_SIZES = (3, 4)
+
+
+def _char_ngrams(text: str) -> Dict[str, int]:
+    """n-grammi di caratteri delle parole (con uno spazio ai bordi): "parcheggiare" e
+    "parcheggio" ne condividono molti anche se le parole sono diverse."""
+    counts: Dict[str, int] = {}
+    for word in _tokens(text):
+        padded = f" {word} "
+        for n in _NGRAM_SIZES:
+            for i in range(len(padded) - n + 1):
+                gram = padded[i:i + n]
+                counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def _row_sums(values, indptr):
+    """Somma per riga dei valori di una matrice CSR (righe vuote = 0)."""
+    totals = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    return totals[indptr[1:]] - totals[indptr[:-1]]
+
+
+class _VectorIndex:
+    """
+    Matrice TF-IDF sparsa (sezioni x n-grammi, righe normalizzate, formato CSR:
+    `indptr`, `indices`, `data`) costruita sulle stesse sezioni di _SnippetIndex:
+    la similarità del coseno con la domanda è un prodotto sparso sui soli
+    n-grammi presenti, senza allocare la matrice densa.
+    """
+
+    def __init__(self, index: _SnippetIndex) -> None:
+        docs = [_char_ngrams(body) for body in index.bodies]
+        vocab: Dict[str, int] = {}
+        df: list[int] = []
+        indptr: list[int] = [0]
+        indices: list[int] = []
+        tf: list[float] = []
+        for grams in docs:
+            for gram, count in grams.items():
+                col = vocab.setdefault(gram, len(vocab))
+                if col == len(df):
+                    df.append(0)
+                df[col] += 1
+                indices.append(col)
+                tf.append(1 + math.log(count))
+            indptr.append(len(indices))
+        n_docs = len(docs)
+        idf = (np.log((1 + n_docs) / (1 + np.asarray(df, dtype=np.float32))) + 1).astype(np.float32)
+        indptr_arr = np.asarray(indptr, dtype=np.int64)
+        indices_arr = np.asarray(indices, dtype=np.int32)
+        data = np.asarray(tf, dtype=np.float32) * idf[indices_arr]
+        norms = np.sqrt(_row_sums(data.astype(np.float64) ** 2, indptr_arr))
+        data /= np.repeat(np.where(norms > 0, norms, 1), np.diff(indptr_arr)).astype(np.float32)
+        self._init(vocab, idf, indptr_arr, indices_arr, data, index)
+
+    def _init(self, vocab: Dict[str, int], idf, indptr, indices, data, index: _SnippetIndex) -> None:
+        self.vocab = vocab
+        self.idf = idf
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.props = np.asarray(index.props, dtype=object)
+        self.langs = np.asarray(index.langs, dtype=object)
+
+    def state(self) -> tuple:
+        return (self.vocab, self.idf.tobytes(), self.indptr.tobytes(), self.indices.tobytes(), self.data.tobytes())
+
+    @classmethod
+    def from_state(cls, state: tuple, index: _SnippetIndex) -> "_VectorIndex":
+        vocab, idf, indptr, indices, data = state
+        vectors = cls.__new__(cls)
+        vectors._init(
+            vocab,
+            np.frombuffer(idf, dtype=np.float32),
+            np.frombuffer(indptr, dtype=np.int64),
+            np.frombuffer(indices, dtype=np.int32),
+            np.frombuffer(data, dtype=np.float32),
+            index,
+        )
+        return vectors
+
+    def scores(self, query: str, property_id: str, lang: str):
+        """Similarità del coseno di ogni sezione con la domanda (0 fuori da struttura/lingua)."""
+        cols: list[int] = []
+        weights: list[float] = []
+        for gram, count in _char_ngrams(query).items():
+            col = self.vocab.get(gram)
+            if col is not None:
+                cols.append(col)
+                weights.append(1 + math.log(count))
+        if not cols:
+            return None
+        vector = np.zeros(len(self.idf), dtype=np.float32)
+        vector[cols] = np.asarray(weights, dtype=np.float32) * self.idf[cols]
+        vector /= np.linalg.norm(vector)
+        sims = _row_sums(self.data * vector[self.indices], self.indptr)
+        mask = (self.langs == lang) & ((self.props == property_id) | (self.props == None))  # noqa: E711
+        return np.where(mask, sims, 0.0)
+
+
+_numpy_warned = False
+
+
+def _vectors_enabled() -> bool:
+    global _numpy_warned
+    if get_settings().KB_RETRIEVAL != "hybrid":
+        return False
+    if np is None and not _numpy_warned:
+        _numpy_warned = True
+        print("[KB] KB_RETRIEVAL=hybrid richiede numpy (pip install numpy): uso solo BM25")
+    return np is not None
+
+
+def _hybrid_search(index: _SnippetIndex, vectors: _VectorIndex, query: str, property_id: str, lang: str, top_k: int) -> list[str]:
+    """BM25 (normalizzato sul migliore) e coseno TF-IDF combinati con peso KB_HYBRID_WEIGHT."""
+    bm25 = index.scores(query, property_id, lang)
+    sims = vectors.scores(query, property_id, lang)
+    if sims is None:
+        return index.top(bm25, top_k)
+    settings = get_settings()
+    weight = settings.KB_HYBRID_WEIGHT
+    best_bm25 = max(bm25.values(), default=0.0)
+    candidates = set(bm25) | set(np.flatnonzero(sims >= settings.KB_VECTOR_MIN_SCORE).tolist())
+    combined = {
+        doc: (1 - weight) * (bm25.get(doc, 0.0) / best_bm25 if best_bm25 else 0.0)
+        + weight * float(sims[doc])
+        for doc in candidates
+    }
+    return index.top(combined, top_k)
+
+
+class _QueryCache:
+    """
+    LRU con scadenza dei risultati di kb_snippets_for. La chiave contiene la
+    versione dello snapshot, quindi dopo una ricarica del KB le voci vecchie
+    non vengono più trovate e escono dalla LRU da sole.
+    """
+
+    def __init__(self, capacity: int, ttl: float) -> None:
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple[float, list[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[list[str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl > 0 and _time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, value: list[str]) -> None:
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (_time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+_query_cache_instance: Optional[_QueryCache] = None
+_query_cache_lock = threading.Lock()
+
+
+def _query_cache() -> _QueryCache:
+    global _query_cache_instance
+    with _query_cache_lock:
+        if _query_cache_instance is None:
+            settings = get_settings()
+            _query_cache_instance = _QueryCache(settings.KB_QUERY_CACHE_SIZE, settings.KB_QUERY_CACHE_TTL)
+        return _query_cache_instance
 
-    candidates.sort(key=lambda x: x[0], reverse=True)
-    return [body for _, body in candidates[:top_k]]
+
+def kb_snippets_for(query: str, property_id: str, lang: str, top_k: int = 6) -> list[str]:
+    """Le `top_k` sezioni più pertinenti (BM25 o ibrida, vedi KB_RETRIEVAL) per la struttura e la lingua."""
+    snapshot = _snapshot_for(property_id)
+    terms = sorted(set(_tokens(query)))
+    key = (tuple(terms), property_id, lang, top_k, snapshot.version)
+    cache = _query_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    # si cerca la forma normalizzata: il risultato dipende solo dalla chiave
+    normalized = " ".join(terms)
+    if snapshot.vectors is not None:
+        result = _hybrid_search(snapshot.index, snapshot.vectors, normalized, property_id, lang, top_k)
+    else:
+        result = snapshot.index.search(normalized, property_id, lang, top_k)
+    cache.put(key, result)
+    return list(result)
+
+
+def kb_cache_stats() -> Dict[str, Any]:
+    """Contatori della cache delle ricerche (per il monitoraggio)."""
+    return _query_cache().stats()
 
 # -------------------------------------------------
 # 8. RENDER PLACEHOLDER
@@ -316,3 +661,277 @@ def render(text: str, ctx: Dict[str, Any]) -> str:
         key = m.group(1)
         return str(ctx.get(key, m.group(0)))
     return re.sub(r"\{([A-Za-z0-9_\.]+)\}", repl, text)
+
+# -------------------------------------------------
+# 9. SNAPSHOT E RICARICA A CALDO
+# -------------------------------------------------
+class _KbSnapshot(NamedTuple):
+    """Vista immutabile del KB: sezioni e indice costruiti dallo stesso testo."""
+    version: int
+    stamp: Optional[tuple[int, int]]  # (mtime_ns, size) del file letto
+    sections: tuple[dict, ...]
+    index: _SnippetIndex
+    vectors: Optional[_VectorIndex]  # solo con KB_RETRIEVAL=hybrid e numpy installato
+    lookup: _SectionLookup
+    memo: Dict[tuple, Any]  # valori derivati calcolati al primo uso (vedi _memoized)
+
+
+_VERSIONS = itertools.count(1)
+
+
+def _file_stamp(path: Path) -> Optional[tuple[int, int]]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+# formato degli snapshot compilati: da incrementare se cambiano sezioni o indice
+_COMPILED_FORMAT = 3
+_COMPILED_MAGIC = "concierge-kb"
+
+
+def compiled_path(path: Path) -> Path:
+    return path.with_suffix(".kbsnap")
+
+
+def _load_compiled(path: Path, digest: str, default_property: Optional[str]) -> Optional[tuple]:
+    """(sezioni, stato dell'indice, stato dei vettori o None) dallo snapshot compilato, se è di questo sorgente."""
+    try:
+        with open(compiled_path(path), "rb") as f:
+            header, payload = marshal.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"[KB] Snapshot {compiled_path(path).name} illeggibile, lo ricostruisco: {e}")
+        return None
+    if header != (_COMPILED_MAGIC, _COMPILED_FORMAT, marshal.version, digest, default_property):
+        return None
+    return payload
+
+
+def _write_compiled(
+    path: Path,
+    digest: str,
+    default_property: Optional[str],
+    sections: tuple,
+    index: _SnippetIndex,
+    vectors: Optional[_VectorIndex] = None,
+) -> None:
+    target = compiled_path(path)
+    header = (_COMPILED_MAGIC, _COMPILED_FORMAT, marshal.version, digest, default_property)
+    payload = (list(sections), index.state(), vectors.state() if vectors is not None else None)
+    # file temporaneo univoco: due processi che compilano lo stesso KB non si sovrascrivono
+    fd, tmp_path = tempfile.mkstemp(suffix=".kbsnap", dir=target.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            marshal.dump((header, payload), f)
+        os.replace(tmp_path, target)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def _build_snapshot(path: Path, default_property: Optional[str] = None, *, compiled: Optional[bool] = None) -> _KbSnapshot:
+    """
+    Snapshot del file: se c'è uno snapshot compilato con lo stesso hash del
+    sorgente si carica quello, altrimenti si parsa e lo si (ri)scrive.
+    `compiled` None = secondo KB_COMPILED.
+    """
+    if compiled is None:
+        compiled = get_settings().KB_COMPILED
+    # stamp letto prima del testo: se il file cambia nel frattempo il prossimo controllo lo ricarica
+    stamp = _file_stamp(path)
+    data = _read_kb(path)
+    digest = hashlib.sha256(data).hexdigest()
+
+    payload = _load_compiled(path, digest, default_property) if compiled and data else None
+    vectors: Optional[_VectorIndex] = None
+    stale = payload is None
+    if payload is not None:
+        sections = tuple(payload[0])
+        index = _SnippetIndex.from_state(tuple(payload[1]))
+        if _vectors_enabled():
+            if payload[2] is not None:
+                vectors = _VectorIndex.from_state(tuple(payload[2]), index)
+            else:
+                stale = True  # compilato senza vettori: li aggiungiamo
+    else:
+        sections = tuple(_parse_sections(_decode_kb(data), default_property))
+        index = _SnippetIndex(list(sections))
+    if _vectors_enabled() and vectors is None:
+        vectors = _VectorIndex(index)
+    if compiled and data and stale:
+        try:
+            _write_compiled(path, digest, default_property, sections, index, vectors)
+        except OSError as e:
+            print(f"[KB] Impossibile scrivere lo snapshot di {path.name}: {e}")
+    return _KbSnapshot(next(_VERSIONS), stamp, sections, index, vectors, _SectionLookup(list(sections)), {})
+
+
+def compile_kb(path: Path = KB_PATH, default_property: Optional[str] = None) -> Path:
+    """Ricompila lo snapshot di un file del KB e restituisce il percorso scritto."""
+    data = _read_kb(path)
+    sections = tuple(_parse_sections(_decode_kb(data), default_property))
+    index = _SnippetIndex(list(sections))
+    vectors = _VectorIndex(index) if _vectors_enabled() else None
+    _write_compiled(path, hashlib.sha256(data).hexdigest(), default_property, sections, index, vectors)
+    return compiled_path(path)
+
+
+class _KbManager:
+    """
+    Tiene lo snapshot corrente di un file del KB. Quando il file cambia,
+    `reload_if_changed` (chiamata dal thread di controllo) riparsa e
+    sostituisce lo snapshot con una sola assegnazione: le richieste leggono
+    `snapshot` una volta e restano coerenti anche se nel frattempo arriva
+    una nuova versione.
+    """
+
+    def __init__(self, path: Path, default_property: Optional[str] = None) -> None:
+        self.path = path
+        self.default_property = default_property
+        self.snapshot = _build_snapshot(path, default_property)
+
+    def reload_if_changed(self) -> bool:
+        if _file_stamp(self.path) == self.snapshot.stamp:
+            return False
+        try:
+            snapshot = _build_snapshot(self.path, self.default_property)
+        except Exception as e:
+            print(f"[KB] Errore nel ricaricare {self.path.name}: {e}")
+            return False
+        self.snapshot = snapshot
+        print(f"[KB] {self.path.name} ricaricato: versione {snapshot.version}, {len(snapshot.sections)} sezioni")
+        return True
+
+
+_SHARD_ID = re.compile(r"[A-Za-z0-9\-_][A-Za-z0-9\-_\.]*")
+
+
+class _ShardCache:
+    """
+    KB per struttura: KB_DIR/<property_id>.txt viene caricato al primo uso in
+    un suo snapshot indicizzato e tenuto in una LRU di `capacity`
+    strutture. Le strutture senza file vengono ricordate a parte, in un
+    insieme limitato a `miss_capacity` voci, così non costano una stat a
+    richiesta e id inesistenti non possono scaricare i KB caricati.
+    """
+
+    def __init__(self, directory: Path, capacity: int, miss_capacity: int = 256) -> None:
+        self.directory = directory
+        self.capacity = max(capacity, 1)
+        self.miss_capacity = max(miss_capacity, 0)
+        self._shards: "OrderedDict[str, _KbManager]" = OrderedDict()
+        self._missing: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, property_id: str) -> Optional[_KbManager]:
+        with self._lock:
+            if property_id in self._shards:
+                self._shards.move_to_end(property_id)
+                return self._shards[property_id]
+            if property_id in self._missing:
+                self._missing.move_to_end(property_id)
+                return None
+        path = self.directory / f"{property_id}.txt"
+        if not path.is_file():
+            with self._lock:
+                if property_id not in self._shards and self.miss_capacity:
+                    self._missing[property_id] = None
+                    self._missing.move_to_end(property_id)
+                    while len(self._missing) > self.miss_capacity:
+                        self._missing.popitem(last=False)
+            return None
+        manager = _KbManager(path, property_id)
+        with self._lock:
+            manager = self._shards.setdefault(property_id, manager)
+            self._shards.move_to_end(property_id)
+            self._missing.pop(property_id, None)
+            while len(self._shards) > self.capacity:
+                self._shards.popitem(last=False)
+        return manager
+
+    def refresh(self) -> None:
+        """Ricarica i file modificati e dimentica quelli creati o cancellati da allora."""
+        with self._lock:
+            shards = list(self._shards.items())
+            missing = list(self._missing)
+        for property_id, manager in shards:
+            if not (self.directory / f"{property_id}.txt").is_file():
+                with self._lock:
+                    if self._shards.get(property_id) is manager:
+                        del self._shards[property_id]
+            else:
+                manager.reload_if_changed()
+        for property_id in missing:
+            if (self.directory / f"{property_id}.txt").is_file():
+                with self._lock:
+                    self._missing.pop(property_id, None)
+
+
+# creati al primo uso, dopo il caricamento del .env (vedi app.config)
+_KB: Optional[_KbManager] = None
+_SHARDS: Optional[_ShardCache] = None
+_init_lock = threading.Lock()
+
+
+def _main_kb() -> _KbManager:
+    global _KB
+    if _KB is None:
+        with _init_lock:
+            if _KB is None:
+                _KB = _KbManager(KB_PATH)
+    return _KB
+
+
+def _shards() -> _ShardCache:
+    global _SHARDS
+    if _SHARDS is None:
+        with _init_lock:
+            if _SHARDS is None:
+                _SHARDS = _ShardCache(kb_dir(), get_settings().KB_SHARD_CACHE_SIZE)
+    return _SHARDS
+
+
+def _snapshot_for(property_id: Optional[str]) -> _KbSnapshot:
+    """Snapshot del file della struttura, se esiste, altrimenti di conoscenza.txt."""
+    if property_id and _SHARD_ID.fullmatch(property_id):
+        shard = _shards().get(property_id)
+        if shard is not None:
+            return shard.snapshot
+    return _main_kb().snapshot
+
+
+_watch_thread: Optional[threading.Thread] = None
+_watch_stop = threading.Event()
+
+
+def _watch(interval: float) -> None:
+    while not _watch_stop.wait(interval):
+        _main_kb().reload_if_changed()
+        _shards().refresh()
+
+
+def start_kb_watcher() -> None:
+    """Avvio dell'app: carica il KB e ricarica conoscenza.txt e i file per struttura quando vengono modificati."""
+    global _watch_thread
+    _vectors_enabled()  # con KB_RETRIEVAL=hybrid senza numpy l'avviso compare all'avvio
+    # KB caricato qui, anche senza ricarica: la prima richiesta non aspetta il parsing
+    _main_kb()
+    _shards()
+    interval = get_settings().KB_RELOAD_INTERVAL
+    if interval <= 0 or (_watch_thread and _watch_thread.is_alive()):
+        return
+    _watch_stop.clear()
+    _watch_thread = threading.Thread(target=_watch, args=(interval,), name="kb-reload", daemon=True)
+    _watch_thread.start()
+
+
+def stop_kb_watcher() -> None:
+    global _watch_thread
+    _watch_stop.set()
+    if _watch_thread:
+        _watch_thread.join()
+        _watch_thread = None
@@ -0,0 +1,47 @@
+# app/services/kb_build.py
+"""Compila gli snapshot del knowledge base (`<file>.kbsnap`).
+
+Uso:
+    python -m app.services.kb_build            # conoscenza.txt + tutti i file in KB_DIR
+    python -m app.services.kb_build FILE...    # solo i file indicati
+
+Gli snapshot vengono comunque ricostruiti in automatico quando il sorgente
+cambia; questo comando serve a prepararli prima dell'avvio (es. nel deploy).
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+from app.config import get_settings
+from app.services import kb
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compila gli snapshot del knowledge base")
+    parser.add_argument("files", nargs="*", type=Path, help="file del KB (default: conoscenza.txt e KB_DIR/*.txt)")
+    args = parser.parse_args(argv)
+    load_dotenv()
+    get_settings.cache_clear()
+
+    kb_dir = kb.kb_dir()
+    targets = [(path, path.stem if path.parent.resolve() == kb_dir.resolve() else None) for path in args.files]
+    if not targets:
+        targets = [(kb.KB_PATH, None)]
+        if kb_dir.is_dir():
+            targets += [(path, path.stem) for path in sorted(kb_dir.glob("*.txt"))]
+
+    for path, property_id in targets:
+        if not path.is_file():
+            print(f"[KB] {path} non trovato")
+            continue
+        print(f"[KB] {path} -> {kb.compile_kb(path, property_id)}")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -1,11 +1,177 @@
 # app/services/logger.py
+"""Log delle conversazioni della chat.
+
+Le richieste si limitano ad accodare il log: un thread in background scrive
+le righe a blocchi su un file NDJSON (ruotato e compresso oltre una certa
+dimensione) e nell'archivio a colonne per le statistiche (vedi chat_store),
+e ogni tanto le esporta in blocco nel tab "Logs".
+"""
+
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
 from datetime import datetime
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
-from app.services.sheets import append_row  # usa la funzione che hai già per scrivere sullo Sheet
+from app.config import Settings, get_settings
+from app.services import chat_store, sheets
 
 LOG_SHEET_NAME = "Logs"  # assicurati che questa tab esista nel tuo Google Sheet
 
+# Opzioni (cartella, rotazione, coda, esportazione): CHAT_LOG_* in app.config.Settings,
+# lette all'avvio del thread dei log, quindi dopo il caricamento del .env.
+
+
+def log_dir() -> str:
+    """Cartella dei file di log (chat.ndjson + file ruotati chat-<timestamp>.ndjson.gz)."""
+
+    return get_settings().CHAT_LOG_DIR or str(Path(__file__).resolve().parents[2] / "logs")
+
+
+def _sheet_row(record: Dict[str, Any]) -> List[str]:
+    """Riga del tab Logs: timestamp | property_id | locale | guest_msg | bot_msg | used_ai | extra"""
+
+    extra = record.get("extra") or {}
+    return [
+        record["ts"],
+        record["property_id"],
+        record["locale"],
+        record["guest_msg"],
+        record["bot_msg"],
+        "yes" if record["used_ai"] else "no",
+        "; ".join(f"{k}={v}" for k, v in extra.items()),
+    ]
+
+
+class _ChatLogSink:
+    """Coda limitata + thread che scrive i log a blocchi e li esporta nel foglio."""
+
+    def __init__(self) -> None:
+        self._queue: "Optional[queue.Queue[Optional[Dict[str, Any]]]]" = None
+        self.settings: Optional[Settings] = None
+        self.dir = ""
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._to_export: List[List[str]] = []
+        self._last_export = time.monotonic()
+        self.dropped = 0
+
+    def put(self, record: Dict[str, Any]) -> bool:
+        """Accoda un log; restituisce False se è stato scartato perché la coda è piena."""
+
+        settings, log_queue = self._ensure_started()
+        try:
+            if settings.CHAT_LOG_FULL_POLICY == "block":
+                log_queue.put(record, timeout=settings.CHAT_LOG_BLOCK_TIMEOUT)
+            else:
+                log_queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 100 == 0:
+                print(f"[LOGGER] coda log piena: {self.dropped} log scartati")
+            return False
+
+    def _ensure_started(self) -> "Tuple[Settings, queue.Queue[Optional[Dict[str, Any]]]]":
+        with self._start_lock:
+            if self.settings is None or self._queue is None:
+                self.settings = get_settings()
+                self.dir = log_dir()
+                self._queue = queue.Queue(maxsize=self.settings.CHAT_LOG_QUEUE_MAX)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="chat-log", daemon=True)
+                self._thread.start()
+            return self.settings, self._queue
+
+    def stop(self) -> None:
+        """Scrive e esporta ciò che è ancora in coda e ferma il thread."""
+
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is None or self._queue is None:
+            return
+        self._queue.put(None)
+        thread.join()
+
+    def _run(self) -> None:
+        settings, log_queue = self.settings, self._queue
+        assert settings is not None and log_queue is not None
+        stopping = False
+        while not stopping:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + settings.CHAT_LOG_FLUSH_INTERVAL
+            while len(batch) < settings.CHAT_LOG_BATCH_MAX:
+                try:
+                    item = log_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                if batch:
+                    self._write(batch)
+                if self._to_export and (
+                    stopping
+                    or (
+                        settings.CHAT_LOG_EXPORT_INTERVAL > 0
+                        and time.monotonic() - self._last_export >= settings.CHAT_LOG_EXPORT_INTERVAL
+                    )
+                ):
+                    self._export()
+            except Exception as e:
+                print(f"[LOGGER] Errore nella scrittura dei log: {e}")
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        settings = self.settings
+        assert settings is not None
+        os.makedirs(self.dir, exist_ok=True)
+        path = os.path.join(self.dir, "chat.ndjson")
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in batch)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        try:
+            chat_store.append_records(batch)
+        except Exception as e:
+            # l'NDJSON resta la fonte completa: si perdono solo le statistiche di questo blocco
+            print(f"[LOGGER] Errore nell'archivio a colonne dei log: {e}")
+        if settings.CHAT_LOG_EXPORT_INTERVAL > 0:
+            self._to_export.extend(_sheet_row(record) for record in batch)
+        if os.path.getsize(path) >= settings.CHAT_LOG_ROTATE_BYTES:
+            self._rotate(path)
+
+    def _rotate(self, path: str) -> None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        rotated = os.path.join(self.dir, f"chat-{stamp}.ndjson")
+        os.replace(path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+
+    def _export(self) -> None:
+        rows, self._to_export = self._to_export, []
+        self._last_export = time.monotonic()
+        try:
+            sheets.append_rows(LOG_SHEET_NAME, rows)
+        except Exception as e:
+            # le righe restano comunque nel file NDJSON
+            print(f"[LOGGER] Esportazione di {len(rows)} log nel foglio fallita: {e}")
+
+
+_SINK = _ChatLogSink()
+
+
+def stop_chat_log() -> None:
+    """Arresto dell'app: scrive ed esporta i log ancora in coda."""
+
+    _SINK.stop()
+
 
 def log_chat(
     *,
@@ -15,28 +181,26 @@ def log_chat(
     bot_msg: str,
     used_ai: bool,
     extra: Optional[Dict[str, Any]] = None,
+    latency_ms: Optional[float] = None,
 ) -> None:
     """
-    Scrive una riga nel foglio Logs.
-    Colonne suggerite:
+    Accoda una riga di log; la scrittura su file e nel foglio Logs avviene in background.
+    Colonne del foglio:
     timestamp | property_id | locale | guest_msg | bot_msg | used_ai | extra
+    `latency_ms` (tempo di risposta) finisce solo nel file e nelle statistiche.
     """
     try:
-        ts = datetime.now().isoformat(timespec="seconds")
-        extra_str = ""
-        if extra:
-            extra_str = "; ".join(f"{k}={v}" for k, v in extra.items())
-
-        row = [
-            ts,
-            property_id,
-            locale,
-            guest_msg,
-            bot_msg,
-            "yes" if used_ai else "no",
-            extra_str,
-        ]
-        append_row(LOG_SHEET_NAME, row)
-
+        _SINK.put(
+            {
+                "ts": datetime.now().isoformat(timespec="seconds"),
+                "property_id": property_id,
+                "locale": locale,
+                "guest_msg": guest_msg,
+                "bot_msg": bot_msg,
+                "used_ai": bool(used_ai),
+                "extra": extra or {},
+                "latency_ms": round(latency_ms, 1) if latency_ms is not None else None,
+            }
+        )
     except Exception as e:
         print(f"[LOGGER] Errore nel log_chat: {e}")
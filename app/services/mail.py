@@ -1,7 +1,7 @@
 # app/services/mail.py
 import smtplib, ssl
 from email.message import EmailMessage
-from typing import Optional
+from typing import Iterable, List, Optional, Tuple
 from app.config import get_settings
 
 def _build_client():
@@ -17,7 +17,7 @@ def _build_client():
         server.login(s.SMTP_USERNAME, s.SMTP_PASSWORD)
     return server
 
-def send_email(to: str, subject: str, html: str, text_fallback: Optional[str] = None) -> None:
+def _build_message(to: str, subject: str, html: str, text_fallback: Optional[str] = None) -> EmailMessage:
     s = get_settings()
     msg = EmailMessage()
     msg["From"] = s.SMTP_FROM
@@ -30,10 +30,36 @@ def send_email(to: str, subject: str, html: str, text_fallback: Optional[str] =
 
     msg.set_content(text_fallback)
     msg.add_alternative(html, subtype="html")
+    return msg
 
+def send_email(to: str, subject: str, html: str, text_fallback: Optional[str] = None) -> None:
+    msg = _build_message(to, subject, html, text_fallback)
     with _build_client() as client:
         client.send_message(msg)
 
+def send_emails(messages: Iterable[Tuple[str, str, str]]) -> List[Optional[str]]:
+    """
+    Invia più email (to, subject, html) con una sola connessione SMTP.
+    Ritorna, per ogni email, None se inviata oppure il messaggio d'errore.
+    """
+    messages = list(messages)
+    if not messages:
+        return []
+    try:
+        client = _build_client()
+    except Exception as e:
+        return [str(e)] * len(messages)
+
+    results: List[Optional[str]] = []
+    with client:
+        for to, subject, html in messages:
+            try:
+                client.send_message(_build_message(to, subject, html))
+                results.append(None)
+            except Exception as e:
+                results.append(str(e))
+    return results
+
 def _html_to_text(html: str) -> str:
     # super-semplice: rimuove i tag principali
     import re
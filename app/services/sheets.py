@@ -3,12 +3,30 @@
 
 from __future__ import annotations
 
+import bisect
+import copy
+import functools
+import hashlib
+import heapq
+import json
 import os
+import queue
+import random
+import re
+import sqlite3
+import struct
+import sys
 import tempfile
+import threading
+import time
+import unicodedata
 import zipfile
-from datetime import datetime, timedelta
+from concurrent.futures import Future
+from collections.abc import Mapping
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+from typing import IO, TYPE_CHECKING, Any, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from xml.etree import ElementTree as ET
 
 try:  # pragma: no cover - import opzionale
@@ -23,8 +41,12 @@ else:  # pragma: no cover - a runtime non abbiamo bisogno del tipo
     GSpreadClient = Any
 from app.config import get_settings
 
-# Scope minimo per leggere/scrivere Google Sheets
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+# Scope minimo per leggere/scrivere Google Sheets e leggere la versione del file su Drive
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.metadata.readonly",
+]
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files/"
 
 def _default_excel_path() -> str:
     """Determina un percorso predefinito affidabile per `Bookings.xlsx`."""
@@ -56,8 +78,17 @@ def _default_excel_path() -> str:
 
 BOOKINGS_EXCEL_PATH = _default_excel_path()
 BOOKINGS_SHEET_NAME = os.getenv("BOOKINGS_SHEET_NAME", "Bookings")
+# Le altre opzioni (backend, journal, scrittori, Google) sono in app.config.Settings
+# e vengono lette quando servono, dopo il caricamento del .env.
 
-_BACKEND: Optional[str] = None  # "google" oppure "excel"
+
+def bookings_sqlite_path() -> str:
+    """Database SQLite delle prenotazioni (default: Bookings.sqlite3 accanto al file Excel)."""
+
+    return get_settings().BOOKINGS_SQLITE_PATH or str(Path(BOOKINGS_EXCEL_PATH).with_suffix(".sqlite3"))
+
+
+_BACKEND: Optional[str] = None  # "google", "excel" oppure "sqlite"
 
 
 # ---------------------------------------------------------------------------
@@ -66,14 +97,20 @@ _BACKEND: Optional[str] = None  # "google" oppure "excel"
 
 
 def _determine_backend() -> str:
-    """Determina se usare Google Sheets o il file Excel locale."""
+    """Determina se usare Google Sheets, il file Excel locale o il database SQLite."""
 
     global _BACKEND
     if _BACKEND:
         return _BACKEND
 
-    excel_available = os.path.exists(BOOKINGS_EXCEL_PATH)
     settings = get_settings()
+    if settings.BOOKINGS_BACKEND:
+        if settings.BOOKINGS_BACKEND not in ("excel", "google", "sqlite"):
+            raise RuntimeError(f"BOOKINGS_BACKEND non valido: {settings.BOOKINGS_BACKEND}")
+        _BACKEND = settings.BOOKINGS_BACKEND
+        return _BACKEND
+
+    excel_available = os.path.exists(BOOKINGS_EXCEL_PATH)
     google_ready = bool(gspread and Credentials and settings.GOOGLE_SHEET_ID)
 
     # Preferiamo il file Excel se disponibile (richiesta progetto)
@@ -89,51 +126,659 @@ def _determine_backend() -> str:
         "Nessun backend prenotazioni disponibile: fornisci GOOGLE_SHEET_ID oppure il file Bookings.xlsx"
     )
 
-    # ---------------------------------------------------------------------------
+
+# ---------------------------------------------------------------------------
+# Indici secondari sulle prenotazioni (comuni ai backend)
+# ---------------------------------------------------------------------------
+
+
+# Colonne con pochi valori distinti: le stringhe vengono internate, così ogni
+# valore ("confirmed", "yes", "it", un property_id...) esiste una volta sola.
+_INTERNED_COLUMNS = frozenset({
+    "property_id", "source_portal", "status", "locale", "authorized", "allow_web",
+    "checkin_date", "checkout_date", "checkin_time", "checkout_time",
+})
+
+
+class _BookingTable:
+    """Righe del foglio Bookings in forma colonnare.
+
+    Un elenco di valori per colonna, con gli header condivisi da tutte le righe;
+    `_BookingRow` è una vista leggera su una riga, che diventa un dict solo
+    quando esce dall'API pubblica (`to_dict`).
+    """
+
+    def __init__(self, headers: Iterable[str] = ()) -> None:
+        self.headers: List[str] = list(headers)
+        self.col: Dict[str, int] = {h: i for i, h in enumerate(self.headers)}
+        self.columns: List[List[str]] = [[] for _ in self.headers]
+        self.row_indexes: List[int] = []
+        self.pos: Dict[int, int] = {}
+        self._intern = [h in _INTERNED_COLUMNS for h in self.headers]
+
+    def __len__(self) -> int:
+        return len(self.row_indexes)
+
+    def __contains__(self, row_index: object) -> bool:
+        return row_index in self.pos
+
+    def __iter__(self) -> Iterator["_BookingRow"]:
+        return (_BookingRow(self, pos) for pos in range(len(self.row_indexes)))
+
+    def _value(self, i: int, value: Any) -> str:
+        text = "" if value is None else str(value)
+        return sys.intern(text) if self._intern[i] else text
+
+    def add(self, row_index: int, data: Dict[str, Any]) -> "_BookingRow":
+        """Aggiunge una riga (o sovrascrive quella con lo stesso numero)."""
+
+        pos = self.pos.get(row_index)
+        if pos is not None:
+            for i, h in enumerate(self.headers):
+                self.columns[i][pos] = self._value(i, data.get(h, ""))
+            return _BookingRow(self, pos)
+        for i, h in enumerate(self.headers):
+            self.columns[i].append(self._value(i, data.get(h, "")))
+        pos = len(self.row_indexes)
+        self.row_indexes.append(row_index)
+        self.pos[row_index] = pos
+        return _BookingRow(self, pos)
+
+    def add_values(self, row_index: int, values: List[str]) -> "_BookingRow":
+        """Aggiunge una riga già allineata agli header (valori mancanti = "")."""
+
+        pos = len(self.row_indexes)
+        for i, column in enumerate(self.columns):
+            column.append(self._value(i, values[i] if i < len(values) else ""))
+        self.row_indexes.append(row_index)
+        self.pos[row_index] = pos
+        return _BookingRow(self, pos)
+
+    def row(self, row_index: int) -> Optional["_BookingRow"]:
+        pos = self.pos.get(row_index)
+        return None if pos is None else _BookingRow(self, pos)
+
+    def last_row(self) -> int:
+        return max(self.pos, default=1)
+
+
+class _BookingRow(Mapping):
+    """Vista su una riga di `_BookingTable`; si legge come il dict di una riga.
+
+    Come i record dict usati prima, espone anche `_row_index` tra le chiavi.
+    """
+
+    __slots__ = ("table", "pos")
+
+    def __init__(self, table: _BookingTable, pos: int) -> None:
+        self.table = table
+        self.pos = pos
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "_row_index":
+            return self.table.row_indexes[self.pos]
+        return self.table.columns[self.table.col[key]][self.pos]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        i = self.table.col[key]
+        self.table.columns[i][self.pos] = self.table._value(i, value)
+
+    def __iter__(self) -> Iterator[str]:
+        yield "_row_index"
+        yield from self.table.headers
+
+    def __len__(self) -> int:
+        return len(self.table.headers) + 1
+
+    def __contains__(self, key: object) -> bool:
+        return key == "_row_index" or key in self.table.col
+
+    def to_dict(self) -> Dict[str, Any]:
+        """La riga come dict, senza `_row_index`."""
+
+        pos = self.pos
+        return {h: column[pos] for h, column in zip(self.table.headers, self.table.columns)}
+
+
+class _RowKeys(NamedTuple):
+    """Chiavi di ricerca di una riga, calcolate una volta quando la riga viene caricata."""
+
+    arrival: Optional[int]  # ordinale del giorno (date.toordinal), None se mancante
+    departure: Optional[int]
+    last_name: str  # casefold senza accenti, internata
+    first_name: str
+    property_id: str
+
+    @classmethod
+    def of(cls, rec: Dict[str, Any]) -> "_RowKeys":
+        return cls(
+            _date_ordinal(rec.get("checkin_date")),
+            _date_ordinal(rec.get("checkout_date")),
+            _name_key(rec.get("guest_last_name")),
+            _name_key(rec.get("guest_first_name")),
+            sys.intern(str(rec.get("property_id") or "").strip()),
+        )
+
+
+class _StayTree:
+    """Albero di intervalli centrato sui soggiorni [arrivo, partenza) di una struttura.
+
+    Le interrogazioni (chi è in casa in un giorno, chi soggiorna in un periodo)
+    costano O(log n + k); arrivi e partenze in un intervallo di date sono
+    bisezioni sugli estremi ordinati. Gli interi sono ordinali di giorno.
+    """
+
+    __slots__ = ("center", "by_start", "by_end", "left", "right")
+
+    def __init__(self, stays: List[Tuple[int, int, int]]) -> None:
+        starts = sorted(s for s, _, _ in stays)
+        self.center = starts[len(starts) // 2]
+        here = [t for t in stays if t[0] <= self.center < t[1]]
+        left = [t for t in stays if t[1] <= self.center]
+        right = [t for t in stays if t[0] > self.center]
+        self.by_start = sorted(here)
+        self.by_end = sorted(here, key=lambda t: t[1], reverse=True)
+        self.left = _StayTree(left) if left else None
+        self.right = _StayTree(right) if right else None
+
+    def overlapping(self, start: int, end: int, out: List[int]) -> None:
+        """Aggiunge a `out` le righe dei soggiorni che intersecano [start, end)."""
+
+        node: Optional[_StayTree] = self
+        while node is not None:
+            if end <= node.center:
+                for s, _, row in node.by_start:
+                    if s >= end:
+                        break
+                    out.append(row)
+                node = node.left
+            elif start > node.center:
+                for _, e, row in node.by_end:
+                    if e <= start:
+                        break
+                    out.append(row)
+                node = node.right
+            else:
+                out.extend(row for _, _, row in node.by_start)
+                if node.left is not None:
+                    node.left.overlapping(start, end, out)
+                node = node.right
+
+
+class _StayIndex:
+    """Indici sulle date dei soggiorni di una struttura (o di tutte).
+
+    Costruito alla prima interrogazione dopo una modifica, con le stesse chiavi
+    (`_RowKeys`) degli altri indici. Le righe in `no_checkout` (senza data di
+    partenza) occupano una notte per sovrapposizioni e conflitti ma non
+    compaiono tra le partenze.
+    """
+
+    def __init__(self, stays: List[Tuple[int, int, int]], no_checkout: Iterable[int] = ()) -> None:
+        skip = set(no_checkout)
+        self.tree = _StayTree(stays) if stays else None
+        self.arrivals = sorted((s, row) for s, _, row in stays)
+        self.departures = sorted((e, row) for _, e, row in stays if row not in skip)
+        self.stays = sorted(stays)
+
+    def overlapping(self, start: int, end: int) -> List[int]:
+        out: List[int] = []
+        if self.tree is not None and start < end:
+            self.tree.overlapping(start, end, out)
+        return sorted(out)
+
+    @staticmethod
+    def _between(points: List[Tuple[int, int]], start: int, end: int) -> List[int]:
+        lo = bisect.bisect_left(points, (start, -1))
+        hi = bisect.bisect_left(points, (end, -1))
+        return [row for _, row in points[lo:hi]]
+
+    def arriving(self, start: int, end: int) -> List[int]:
+        return self._between(self.arrivals, start, end)
+
+    def departing(self, start: int, end: int) -> List[int]:
+        return self._between(self.departures, start, end)
+
+    def conflicts(self) -> List[Tuple[int, int]]:
+        """Coppie di soggiorni sovrapposti (doppie prenotazioni), in un solo passaggio."""
+
+        pairs: List[Tuple[int, int]] = []
+        active: List[Tuple[int, int]] = []  # heap (partenza, riga)
+        for s, e, row in self.stays:
+            while active and active[0][0] <= s:
+                heapq.heappop(active)
+            pairs.extend((min(other, row), max(other, row)) for _, other in active)
+            heapq.heappush(active, (e, row))
+        return pairs
+
+
+def _stay_of(keys: "_RowKeys") -> Optional[Tuple[int, int]]:
+    """Soggiorno [arrivo, partenza) di una riga; senza partenza vale una notte.
+
+    La notte presunta serve solo per sovrapposizioni e conflitti: se la fine
+    restituita è diversa da `keys.departure` la riga non ha una partenza reale.
+    """
+
+    if keys.arrival is None:
+        return None
+    end = keys.departure if keys.departure is not None and keys.departure > keys.arrival else keys.arrival + 1
+    return keys.arrival, end
+
+
+class _BookingIndex:
+    """Indici secondari in memoria sulle righe del foglio Bookings.
+
+    Ogni bucket è un dict `row_index -> record` (ordine di inserimento = ordine
+    delle righe), così aggiornare o spostare una riga costa O(1). Le chiavi
+    (`_RowKeys`) sono normalizzate una volta per riga: le ricerche confrontano
+    interi e stringhe internate senza rileggere il testo dei record.
+    """
+
+    def __init__(self, records: Iterable[Dict[str, Any]] = ()) -> None:
+        self.by_arrival_last: Dict[Tuple[Optional[int], str], Dict[int, Dict[str, Any]]] = {}
+        self.by_arrival: Dict[Optional[int], Dict[int, Dict[str, Any]]] = {}
+        self.by_dates: Dict[Tuple[Optional[int], Optional[int]], Dict[int, Dict[str, Any]]] = {}
+        self.by_property: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        self.keys: Dict[int, _RowKeys] = {}
+        # righe senza nome, cognome o email, per struttura (aggiornate a ogni modifica)
+        self.incomplete: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        # indici dei soggiorni per struttura (None = tutte), ricostruiti dopo le modifiche
+        self._stays: Dict[Optional[str], _StayIndex] = {}
+        for rec in records:
+            self.add(rec)
+
+    def _buckets(self, keys: _RowKeys):
+        return (
+            (self.by_arrival_last, (keys.arrival, keys.last_name)),
+            (self.by_arrival, keys.arrival),
+            (self.by_dates, (keys.arrival, keys.departure)),
+            (self.by_property, keys.property_id),
+        )
+
+    def add(self, rec: Dict[str, Any]) -> None:
+        row_index = rec["_row_index"]
+        keys = _RowKeys.of(rec)
+        self.keys[row_index] = keys
+        self._stays.pop(keys.property_id, None)
+        self._stays.pop(None, None)
+        for table, key in self._buckets(keys):
+            table.setdefault(key, {})[row_index] = rec
+        if _missing_details(rec):
+            self.incomplete.setdefault(keys.property_id, {})[row_index] = rec
+
+    def remove(self, row_index: int) -> None:
+        keys = self.keys.pop(row_index, None)
+        if keys is None:
+            return
+        self._stays.pop(keys.property_id, None)
+        self._stays.pop(None, None)
+        for table, key in self._buckets(keys) + ((self.incomplete, keys.property_id),):
+            bucket = table.get(key)
+            if bucket is None:
+                continue
+            bucket.pop(row_index, None)
+            if not bucket:
+                del table[key]
+
+    def update(self, rec: Dict[str, Any]) -> None:
+        """Riallinea gli indici dopo una modifica in place del record."""
+
+        row_index = rec["_row_index"]
+        keys = _RowKeys.of(rec)
+        missing = row_index in self.incomplete.get(keys.property_id, {})
+        if self.keys.get(row_index) == keys and missing == _missing_details(rec):
+            return
+        self.remove(row_index)
+        self.add(rec)
+
+    def by_name(self, arrival: Optional[int], last_name: str) -> Iterable[Tuple[int, Dict[str, Any]]]:
+        return self.by_arrival_last.get((arrival, last_name), {}).items()
+
+    def by_stay(self, arrival: Optional[int], departure: Optional[int]) -> Iterable[Tuple[int, Dict[str, Any]]]:
+        if departure is not None:
+            return self.by_dates.get((arrival, departure), {}).items()
+        return self.by_arrival.get(arrival, {}).items()
+
+    def for_property(self, property_id: Optional[str]) -> Iterable[Dict[str, Any]]:
+        pid = (property_id or "").strip()
+        return self.by_property.get(pid, {}).values()
+
+    def properties(self) -> List[str]:
+        return list(self.by_property)
+
+    def incomplete_count(self, property_id: Optional[str] = None) -> int:
+        if property_id:
+            return len(self.incomplete.get(property_id.strip(), {}))
+        return sum(len(bucket) for bucket in self.incomplete.values())
+
+    def incomplete_rows(
+        self, property_id: Optional[str] = None, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Tuple[int, Dict[str, Any]]]:
+        if property_id:
+            rows = sorted(self.incomplete.get(property_id.strip(), {}).items())
+        else:
+            rows = sorted(item for bucket in self.incomplete.values() for item in bucket.items())
+        end = None if limit is None else offset + limit
+        return rows[offset:end]
+
+    def stays(self, property_id: Optional[str] = None) -> _StayIndex:
+        """Indice dei soggiorni di una struttura (di tutte se `property_id` è vuoto)."""
+
+        pid = (property_id or "").strip() or None
+        stay_index = self._stays.get(pid)
+        if stay_index is None:
+            rows = self.keys if pid is None else self.by_property.get(pid, {})
+            stays = []
+            no_checkout = []
+            for row_index in rows:
+                keys = self.keys[row_index]
+                stay = _stay_of(keys)
+                if stay is not None:
+                    stays.append((stay[0], stay[1], row_index))
+                    if stay[1] != keys.departure:
+                        no_checkout.append(row_index)
+            stay_index = self._stays[pid] = _StayIndex(stays, no_checkout)
+        return stay_index
+
+    def record(self, row_index: int) -> Dict[str, Any]:
+        keys = self.keys[row_index]
+        return self.by_property[keys.property_id][row_index]
+
+
+# ---------------------------------------------------------------------------
 # Backend Google Sheets (utilizzato solo se configurato)
 # ---------------------------------------------------------------------------
 
 
+# Client e handle Google condivisi da tutto il processo: autenticazione,
+# `open_by_key` e `worksheet` costano ciascuno una chiamata HTTP, quindi li
+# facciamo una volta sola. Le credenziali del service account rinnovano il
+# token da sole e il client riusa la stessa sessione HTTP (pool di connessioni).
+_GOOGLE_LOCK = threading.RLock()
+_GOOGLE_CLIENT: Optional[GSpreadClient] = None
+_GOOGLE_SPREADSHEET: Any = None
+_GOOGLE_WORKSHEETS: Dict[str, Any] = {}
+_GOOGLE_HEADERS: Dict[str, List[str]] = {}
+
+
 def _google_client() -> GSpreadClient:  # pragma: no cover - dipende da Google
+    global _GOOGLE_CLIENT
     if not gspread or not Credentials:
         raise RuntimeError("gspread non disponibile")
 
-    settings = get_settings()
+    with _GOOGLE_LOCK:
+        if _GOOGLE_CLIENT is not None:
+            return _GOOGLE_CLIENT
+
+        settings = get_settings()
 
-    sa = dict(settings.GOOGLE_SERVICE_ACCOUNT_JSON)
-    pk = sa.get("private_key", "")
-    if "\\n" in pk:
-        sa["private_key"] = pk.replace("\\n", "\n")
+        sa = dict(settings.GOOGLE_SERVICE_ACCOUNT_JSON)
+        pk = sa.get("private_key", "")
+        if "\\n" in pk:
+            sa["private_key"] = pk.replace("\\n", "\n")
 
-    creds = Credentials.from_service_account_info(sa, scopes=SCOPES)
-    return gspread.authorize(creds)
+        creds = Credentials.from_service_account_info(sa, scopes=SCOPES)
+        _GOOGLE_CLIENT = gspread.authorize(creds)
+        return _GOOGLE_CLIENT
 
 def _google_ws(sheet_name: str = BOOKINGS_SHEET_NAME):  # pragma: no cover - dipende da Google
-    settings = get_settings()
-    gc = _google_client()
-    sh = gc.open_by_key(settings.GOOGLE_SHEET_ID)
-    return sh.worksheet(sheet_name)
+    global _GOOGLE_SPREADSHEET
+    with _GOOGLE_LOCK:
+        ws = _GOOGLE_WORKSHEETS.get(sheet_name)
+        if ws is not None:
+            return ws
+        if _GOOGLE_SPREADSHEET is None:
+            settings = get_settings()
+            _GOOGLE_SPREADSHEET = _google_client().open_by_key(settings.GOOGLE_SHEET_ID)
+        ws = _GOOGLE_SPREADSHEET.worksheet(sheet_name)
+        _GOOGLE_WORKSHEETS[sheet_name] = ws
+        return ws
+
+
+def _google_reset() -> None:
+    """Dimentica client e handle: verranno ricreati alla prossima chiamata."""
+
+    global _GOOGLE_CLIENT, _GOOGLE_SPREADSHEET
+    with _GOOGLE_LOCK:
+        _GOOGLE_CLIENT = None
+        _GOOGLE_SPREADSHEET = None
+        _GOOGLE_WORKSHEETS.clear()
+        _GOOGLE_HEADERS.clear()
+
+
+def _google_stale(exc: Exception) -> bool:  # pragma: no cover
+    """True se l'errore indica handle non più validi (token revocato, foglio rinominato...)."""
+
+    if gspread is None:
+        return False
+    if isinstance(exc, (gspread.exceptions.WorksheetNotFound, gspread.exceptions.SpreadsheetNotFound)):
+        return True
+    if isinstance(exc, gspread.exceptions.APIError):
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+        return status in (401, 404)
+    return False
+
+
+def _google_retry(fn):
+    """Riprova una volta l'operazione con handle nuovi se quelli in cache sono scaduti."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:  # pragma: no cover - dipende da Google
+            if not _google_stale(e):
+                raise
+            _google_reset()
+            return fn(*args, **kwargs)
+
+    return wrapper
 
 
 def _google_headers(ws):  # pragma: no cover
-    return ws.row_values(1)
+    with _GOOGLE_LOCK:
+        headers = _GOOGLE_HEADERS.get(ws.title)
+    if headers is None:
+        headers = ws.row_values(1)
+        with _GOOGLE_LOCK:
+            _GOOGLE_HEADERS[ws.title] = headers
+    return headers
 
 
-def _google_list_rows() -> List[Dict[str, Any]]:  # pragma: no cover
-    ws = _google_ws()
-    return ws.get_all_records()
+# ---------------------------------------------------------------------------
+# Mirror locale del foglio Google
+# ---------------------------------------------------------------------------
 
 
-def _google_append_row_dict(data: dict) -> None:  # pragma: no cover
-    ws = _google_ws()
-    headers = ws.row_values(1)
-    if not headers:
-        raise RuntimeError("Il worksheet 'Bookings' non ha header nella riga 1.")
+class _GoogleMirror:
+    """Copia in memoria del foglio Bookings su Google, riallineata in background.
+
+    Un thread controlla ogni `GOOGLE_MIRROR_INTERVAL` secondi la versione del
+    file su Drive (una chiamata di metadati) e riscarica il foglio solo se è
+    cambiata; righe e indici si ricostruiscono solo se cambia l'hash del
+    contenuto. Le letture usano sempre la copia locale; le nostre scritture
+    vanno su Google e vengono riportate subito anche qui.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.RLock()
+        self.table = _BookingTable()
+        self.index = _BookingIndex()
+        self.digest: Optional[str] = None
+        # versione Drive (modifiedTime, version) del foglio all'ultimo download
+        self.revision: Optional[Tuple[str, str]] = None
+        # False se Drive non risponde ai metadati (API disattivata, scope mancante)
+        self.revision_checks = True
+        # incrementato a ogni scrittura riportata: un download iniziato prima è vecchio
+        self.generation = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sync(self, attempts: int = 3) -> bool:  # pragma: no cover - dipende da Google
+        """Scarica il foglio; restituisce True se il contenuto era cambiato.
+
+        Se una nostra scrittura viene riportata nel mirror mentre il download è
+        in corso, i valori scaricati potrebbero non contenerla: si riscarica
+        (fino a `attempts` volte) e altrimenti si salta il giro, tenendo il
+        mirror attuale. Solo al primo caricamento, senza alternative, si
+        accetta comunque l'ultimo download.
+        """
+
+        # letta prima del download: se il foglio cambia nel frattempo, il giro dopo riscarica
+        revision = self._revision()
+        with self.lock:
+            if revision is not None and revision == self.revision and self.digest is not None:
+                return False
+        for attempt in range(attempts):
+            with self.lock:
+                generation = self.generation
+            values = _google_fetch_values()
+            with self.lock:
+                if self.generation != generation and (self.digest is not None or attempt < attempts - 1):
+                    continue
+                changed = self._load(values)
+                self.revision = revision
+                return changed
+        print("[SHEETS] sync del mirror Google saltato: scritture in corso durante il download")
+        return False
+
+    def _revision(self) -> Optional[Tuple[str, str]]:  # pragma: no cover - dipende da Google
+        if not self.revision_checks:
+            return None
+        try:
+            return _google_revision()
+        except Exception as e:
+            if not _google_throttled(e):
+                self.revision_checks = False
+                print(f"[SHEETS] versione del foglio non leggibile da Drive, scarico sempre tutto: {e}")
+            return None
+
+    def _load(self, values: List[List[str]]) -> bool:
+        digest = hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+        with self.lock:
+            if digest == self.digest:
+                return False
+            headers = list(values[0]) if values else []
+            table = _BookingTable(headers)
+            for row_index, row in enumerate(values[1:], start=2):
+                table.add_values(row_index, row)
+            self.table = table
+            self.index = _BookingIndex(table)
+            self.digest = digest
+        with _GOOGLE_LOCK:
+            _GOOGLE_HEADERS[BOOKINGS_SHEET_NAME] = headers
+        return True
+
+    def ensure(self) -> None:  # pragma: no cover - dipende da Google
+        """Primo caricamento sincrono, poi avvia il riallineamento periodico."""
+
+        with self.lock:
+            if self.digest is None:
+                self.sync()
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="google-mirror", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:  # pragma: no cover - dipende da Google
+        while not self._stop.wait(get_settings().GOOGLE_MIRROR_INTERVAL):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[SHEETS] sync del mirror Google fallito: {e}")
+
+    def apply_update(self, row_index: int, data: Dict[str, Any]) -> None:
+        with self.lock:
+            self.generation += 1
+            rec = self.table.row(row_index)
+            if rec is None:
+                return
+            for header, value in data.items():
+                if header in self.table.col:
+                    rec[header] = value
+            self.index.update(rec)
+
+    def apply_append(self, row_index: int, data: Dict[str, Any]) -> None:
+        """Riporta una riga aggiunta, con il numero che Google le ha dato davvero."""
+
+        with self.lock:
+            self.generation += 1
+            if self.digest is None:
+                return
+            rec = self.table.add(row_index, data)
+            self.index.update(rec)
+
+    def invalidate(self) -> None:
+        """Dimentica il contenuto: la prossima lettura riscarica il foglio."""
+
+        with self.lock:
+            self.generation += 1
+            self.digest = None
+            self.revision = None
+            self.table = _BookingTable()
+            self.index = _BookingIndex()
+
+
+_GOOGLE_MIRROR = _GoogleMirror()
+
+
+def _google_appended_row(response: Any) -> Optional[int]:
+    """Prima riga scritta da `values.append`, letta da `updates.updatedRange` (es. "Bookings!A12:H14")."""
+
+    try:
+        updated = response["updates"]["updatedRange"]
+        first_cell = updated.rsplit("!", 1)[-1].split(":", 1)[0]
+        return int(re.fullmatch(r"\$?[A-Za-z]+\$?(\d+)", first_cell).group(1))
+    except Exception:
+        return None
+
+
+@_google_retry
+def _google_fetch_values() -> List[List[str]]:  # pragma: no cover
+    return _google_ws().get_all_values()
+
+
+@_google_retry
+def _google_revision() -> Tuple[str, str]:  # pragma: no cover - dipende da Google
+    """(modifiedTime, version) del foglio da Drive: cambia a ogni modifica, costa una chiamata di metadati."""
+
+    settings = get_settings()
+    client = _google_client()
+    # gspread 6 espone le chiamate HTTP su `http_client`, le versioni precedenti sul client
+    http = getattr(client, "http_client", client)
+    meta = http.request(
+        "get",
+        DRIVE_FILES_URL + settings.GOOGLE_SHEET_ID,
+        params={"fields": "modifiedTime,version", "supportsAllDrives": True},
+    ).json()
+    return (meta.get("modifiedTime", ""), str(meta.get("version", "")))
+
+
+def _google_list_rows() -> List[Dict[str, Any]]:  # pragma: no cover
+    _GOOGLE_MIRROR.ensure()
+    with _GOOGLE_MIRROR.lock:
+        return [rec.to_dict() for rec in _GOOGLE_MIRROR.table]
 
-    row = [str(data.get(h, "")) if data.get(h) is not None else "" for h in headers]
-    ws.append_row(row, value_input_option="RAW")
 
 def _google_row_by_index(row_index: int) -> Dict[str, Any]:  # pragma: no cover
+    _GOOGLE_MIRROR.ensure()
+    with _GOOGLE_MIRROR.lock:
+        rec = _GOOGLE_MIRROR.table.row(row_index)
+        if rec is not None:
+            return rec.to_dict()
+    return _google_live_row(row_index)
+
+
+@_google_retry
+def _google_live_row(row_index: int) -> Dict[str, Any]:  # pragma: no cover
+    """Legge una riga direttamente da Google (riga non ancora presente nel mirror)."""
+
     ws = _google_ws()
     headers = _google_headers(ws)
     values = ws.row_values(row_index)
@@ -141,23 +786,6 @@ def _google_row_by_index(row_index: int) -> Dict[str, Any]:  # pragma: no cover
     return {h: values[i] if i < len(values) else "" for i, h in enumerate(headers)}
 
 
-def _google_update_row_dict(row_index: int, data: dict) -> None:  # pragma: no cover
-    ws = _google_ws()
-    headers = ws.row_values(1)
-    row = ws.row_values(row_index)
-    row += [""] * (len(headers) - len(row))
-
-    for i, h in enumerate(headers):
-        if h in data:
-            row[i] = str(data[h]) if data[h] is not None else ""
-
-    ws.update(
-        f"A{row_index}:{chr(64 + len(headers))}{row_index}",
-        [row],
-        value_input_option="RAW",
-    )
-
-
 # ---------------------------------------------------------------------------
 # Backend Excel
 # ---------------------------------------------------------------------------
@@ -165,11 +793,16 @@ def _google_update_row_dict(row_index: int, data: dict) -> None:  # pragma: no c
 
 EXCEL_NS = {"main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main"}
 
+# Header locale di un membro zip (PKWARE APPNOTE 4.3.7) e flag "data descriptor".
+_ZIP_LOCAL_HEADER_SIZE = 30
+_ZIP_DATA_DESCRIPTOR_FLAG = 0x08
+_ZIP_COPY_CHUNK = 1 << 20
+
 
-def _excel_zip() -> zipfile.ZipFile:
-    if not os.path.exists(BOOKINGS_EXCEL_PATH):
-        raise RuntimeError(f"File Excel non trovato: {BOOKINGS_EXCEL_PATH}")
-    return zipfile.ZipFile(BOOKINGS_EXCEL_PATH, "r")
+def _excel_zip(path: str = BOOKINGS_EXCEL_PATH) -> zipfile.ZipFile:
+    if not os.path.exists(path):
+        raise RuntimeError(f"File Excel non trovato: {path}")
+    return zipfile.ZipFile(path, "r")
 
 
 def _excel_sheet_path(zf: zipfile.ZipFile, sheet_name: str = BOOKINGS_SHEET_NAME) -> str:
@@ -196,117 +829,381 @@ def _excel_sheet_path(zf: zipfile.ZipFile, sheet_name: str = BOOKINGS_SHEET_NAME
     return target
 
 
+_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
 def _excel_shared_strings(zf: zipfile.ZipFile) -> List[str]:
     try:
-        xml = zf.read("xl/sharedStrings.xml")
+        stream = zf.open("xl/sharedStrings.xml")
     except KeyError:
         return []
-    root = ET.fromstring(xml)
     strings: List[str] = []
-    for si in root.findall("main:si", EXCEL_NS):
-        parts = [t.text or "" for t in si.findall(".//main:t", EXCEL_NS)]
-        strings.append("".join(parts))
+    with stream:
+        for _, si in ET.iterparse(stream):
+            if si.tag != f"{_MAIN}si":
+                continue
+            strings.append("".join(t.text or "" for t in si.iter(f"{_MAIN}t")))
+            si.clear()
     return strings
 
 
-def _excel_extract_rows() -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
-    with _excel_zip() as zf:
+def _excel_iter_cells(
+    zf: zipfile.ZipFile, sheet_path: str, shared: List[str]
+) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Scorre in streaming le righe del foglio come coppie (indice, {colonna: valore}).
+
+    Usa `iterparse` sullo stream del membro zip e svuota `sheetData` dopo ogni
+    riga, così in memoria resta al massimo una riga di elementi XML.
+    """
+
+    with zf.open(sheet_path) as stream:
+        sheet_data: Optional[ET.Element] = None
+        for event, elem in ET.iterparse(stream, events=("start", "end")):
+            if event == "start":
+                if elem.tag == f"{_MAIN}sheetData":
+                    sheet_data = elem
+                continue
+            if elem.tag != f"{_MAIN}row":
+                continue
+
+            row_index = int(elem.get("r"))
+            cells: Dict[str, str] = {}
+            for cell in elem.findall("main:c", EXCEL_NS):
+                ref = cell.get("r", "")
+                col = "".join(ch for ch in ref if ch.isalpha())
+                value = ""
+                c_type = cell.get("t")
+                if c_type == "s":
+                    v = cell.find("main:v", EXCEL_NS)
+                    if v is not None and v.text:
+                        value = shared[int(v.text)]
+                elif c_type == "inlineStr":
+                    value = "".join(
+                        (t_el.text or "") for t_el in cell.findall("main:is/main:t", EXCEL_NS)
+                    )
+                else:
+                    v = cell.find("main:v", EXCEL_NS)
+                    if v is not None and v.text is not None:
+                        value = v.text
+
+                cells[col] = value
+
+            if sheet_data is not None:
+                sheet_data.clear()
+            else:
+                elem.clear()
+            yield row_index, cells
+
+
+def _excel_stream_last_row(zf: zipfile.ZipFile, sheet_path: str) -> int:
+    """Indice dell'ultima riga del foglio, letto in streaming senza risolvere le celle."""
+
+    last_index = 0
+    with zf.open(sheet_path) as stream:
+        for _, elem in ET.iterparse(stream):
+            if elem.tag == f"{_MAIN}row":
+                try:
+                    last_index = max(last_index, int(elem.get("r", "0")))
+                except ValueError:
+                    pass
+                elem.clear()
+    return last_index
+
+
+def _excel_stream_records(
+    header_map: Optional[Dict[str, str]] = None,
+    path: str = BOOKINGS_EXCEL_PATH,
+) -> Iterator[Dict[str, Any]]:
+    """Legge dal disco le righe del foglio Bookings una alla volta.
+
+    Se passato, `header_map` viene riempito con l'intestazione (riga 1).
+    """
+
+    if header_map is None:
+        header_map = {}
+
+    with _excel_zip(path) as zf:
         sheet_path = _excel_sheet_path(zf, BOOKINGS_SHEET_NAME)
         shared = _excel_shared_strings(zf)
-        sheet_root = ET.fromstring(zf.read(sheet_path))
 
-    header_map: Dict[str, str] = {}
-    records: List[Dict[str, Any]] = []
+        for row_index, cells in _excel_iter_cells(zf, sheet_path, shared):
+            if row_index == 1:
+                header_map.clear()
+                header_map.update(
+                    (col, cells[col])
+                    for col in sorted(cells.keys(), key=lambda x: (len(x), x))
+                )
+                continue
 
-    sheet_data = sheet_root.find("main:sheetData", EXCEL_NS)
-    if sheet_data is None:
-        return header_map, records
+            if not header_map:
+                continue
 
-    for row in sheet_data.findall("main:row", EXCEL_NS):
-        row_index = int(row.get("r"))
-        cells: Dict[str, str] = {}
-        for cell in row.findall("main:c", EXCEL_NS):
-            ref = cell.get("r", "")
-            col = "".join(ch for ch in ref if ch.isalpha())
-            value = ""
-            c_type = cell.get("t")
-            if c_type == "s":
-                v = cell.find("main:v", EXCEL_NS)
-                if v is not None and v.text:
-                    value = shared[int(v.text)]
-            elif c_type == "inlineStr":
-                value = "".join(
-                    (t_el.text or "") for t_el in cell.findall("main:is/main:t", EXCEL_NS)
-                )
-            else:
-                v = cell.find("main:v", EXCEL_NS)
-                if v is not None and v.text is not None:
-                    value = v.text
+            record: Dict[str, Any] = {"_row_index": row_index}
+            for col, header in header_map.items():
+                record[header] = cells.get(col, "")
+            yield _excel_post_process_record(record)
 
-            cells[col] = value
 
-        if row_index == 1:
-            header_map = {
-                col: cells[col]
-                for col in sorted(cells.keys(), key=lambda x: (len(x), x))
-            }
-            continue
+def _excel_parse_rows() -> Tuple[Dict[str, str], _BookingTable]:
+    """Legge dal disco header e righe del foglio Bookings (parsing completo)."""
 
-        if not header_map:
-            continue
+    header_map: Dict[str, str] = {}
+    table: Optional[_BookingTable] = None
+    for rec in _excel_stream_records(header_map):
+        if table is None:
+            table = _BookingTable(header_map.values())
+        table.add(rec["_row_index"], rec)
+    return header_map, table if table is not None else _BookingTable(header_map.values())
 
-        record: Dict[str, Any] = {"_row_index": row_index}
-        for col, header in header_map.items():
-            record[header] = cells.get(col, "")
-        records.append(_excel_post_process_record(record))
 
-    return header_map, records
+_DATE_COLUMNS = ("checkin_date", "checkout_date")
 
 
 def _excel_post_process_record(record: Dict[str, Any]) -> Dict[str, Any]:
-    for key in ("checkin_date", "checkout_date"):
+    for key in _DATE_COLUMNS:
         record[key] = _normalize_date_value(record.get(key, ""))
     return record
 
 
-def _excel_list_rows() -> List[Dict[str, Any]]:
-    _, records = _excel_extract_rows()
-    cleaned: List[Dict[str, Any]] = []
-    for rec in records:
-        rec = dict(rec)
+# ---------------------------------------------------------------------------
+# Cache in memoria del foglio Bookings (backend Excel)
+# ---------------------------------------------------------------------------
+
+
+FileKey = Tuple[int, int, int]
+
+
+class _ExcelCache:
+    """Ultimo parsing del foglio Bookings, valido finché il file non cambia.
+
+    La chiave è la tupla (mtime_ns, size, inode) del file: le nostre scritture
+    aggiornano righe e chiave in place, mentre una modifica esterna (es. l'host
+    che salva il file da Excel) cambia la chiave e forza un nuovo parsing.
+    Con il journal attivo le righe includono anche le modifiche non ancora
+    compattate nel file.
+    """
+
+    def __init__(self) -> None:
+        self.key: Optional[FileKey] = None
+        self.header_map: Dict[str, str] = {}
+        self.table = _BookingTable()
+        self.index = _BookingIndex()
+        # ultima riga occupata per foglio, calcolata solo quando serve
+        self.last_rows: Dict[str, int] = {}
+
+    def load(self, key: FileKey, header_map: Dict[str, str], table: _BookingTable) -> None:
+        self.key = key
+        self.header_map = header_map
+        self.table = table
+        self.index = _BookingIndex(table)
+        self.last_rows = {}
+
+    def invalidate(self) -> None:
+        self.key = None
+        self.header_map = {}
+        self.table = _BookingTable()
+        self.index = _BookingIndex()
+        self.last_rows = {}
+
+
+_EXCEL_CACHE = _ExcelCache()
+# Serializza parsing e scritture del file all'interno del processo.
+_EXCEL_LOCK = threading.RLock()
+
+
+def _excel_file_key(path: str = BOOKINGS_EXCEL_PATH) -> FileKey:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _excel_extract_rows() -> Tuple[Dict[str, str], _BookingTable]:
+    """Header e righe del foglio Bookings, dalla cache se il file non è cambiato.
+
+    Le righe restituite sono condivise con la cache: i chiamanti devono copiarle
+    prima di modificarle.
+    """
+
+    with _EXCEL_LOCK:
+        if not os.path.exists(BOOKINGS_EXCEL_PATH):
+            raise RuntimeError(f"File Excel non trovato: {BOOKINGS_EXCEL_PATH}")
+        journal = _excel_journal()
+        # La chiave va letta prima del parsing: se il file cambia nel frattempo
+        # la chiamata successiva vedrà una chiave diversa e rileggerà il file.
+        key = _excel_file_key()
+        if _EXCEL_CACHE.key != key:
+            header_map, table = _excel_parse_rows()
+            _EXCEL_CACHE.load(key, header_map, table)
+            if journal is not None:
+                for entry in journal.pending:
+                    _excel_cache_apply(entry)
+        return _EXCEL_CACHE.header_map, _EXCEL_CACHE.table
+
+
+def _excel_record_from(row_index: int, data: Dict[str, Any]) -> Dict[str, Any]:
+    record: Dict[str, Any] = {"_row_index": row_index}
+    for header in _EXCEL_CACHE.header_map.values():
+        value = data.get(header, "")
+        record[header] = "" if value in (None, "") else str(value)
+    return _excel_post_process_record(record)
+
+
+def _excel_cache_apply(entry: Dict[str, Any]) -> bool:
+    """Riporta una modifica (vedi `_excel_entry`) sulle righe in cache.
+
+    Restituisce False se la modifica riguarda una riga che la cache non conosce.
+    """
+
+    sheet = entry["sheet"]
+    row_index = entry.get("row")
+    if row_index is not None and sheet in _EXCEL_CACHE.last_rows:
+        _EXCEL_CACHE.last_rows[sheet] = max(_EXCEL_CACHE.last_rows[sheet], row_index)
+    if sheet != BOOKINGS_SHEET_NAME:
+        return True
+
+    table = _EXCEL_CACHE.table
+    if entry["op"] == "update":
+        rec = table.row(row_index)
+        if rec is None:
+            return False
+        for header, value in entry["data"].items():
+            if header not in table.col:
+                continue
+            value = "" if value in (None, "") else str(value)
+            rec[header] = _normalize_date_value(value) if header in _DATE_COLUMNS else value
+        _EXCEL_CACHE.index.update(rec)
+        return True
+
+    if row_index is None:
+        return False
+    if entry["op"] == "append":
+        header_map = _EXCEL_CACHE.header_map
+        data = {}
+        for offset, value in enumerate(entry["values"], start=1):
+            column = _excel_column_from_index(offset)
+            if column in header_map:
+                data[header_map[column]] = value
+    else:
+        data = entry["data"]
+    # riapplicazione di un'aggiunta già presente: la riga viene sovrascritta
+    existing = row_index in table
+    rec = table.add(row_index, _excel_record_from(row_index, data))
+    if existing:
+        _EXCEL_CACHE.index.update(rec)
+    else:
+        _EXCEL_CACHE.index.add(rec)
+    return True
+
+
+def _excel_cache_after_write(before: FileKey, after: FileKey, entries: Iterable[Dict[str, Any]] = ()) -> None:
+    """Riporta nella cache una nostra scrittura senza rileggere il file.
+
+    Se la cache non corrispondeva al file su cui abbiamo scritto (`before`) non
+    possiamo fidarci del suo contenuto e la invalidiamo.
+    """
+
+    if _EXCEL_CACHE.key != before:
+        _EXCEL_CACHE.invalidate()
+        return
+    for entry in entries:
+        if not _excel_cache_apply(entry):
+            _EXCEL_CACHE.invalidate()
+            return
+    _EXCEL_CACHE.key = after
+
+
+def _excel_iter_rows() -> Iterator[Dict[str, Any]]:
+    """Righe del foglio Bookings una alla volta, senza `_row_index`.
+
+    Se la cache è allineata al file la usiamo; altrimenti leggiamo il file in
+    streaming senza costruire l'elenco completo in memoria.
+    """
+
+    with _EXCEL_LOCK:
+        cached: Optional[_BookingTable] = None
+        journal = _excel_journal()
+        if journal is not None and journal.pending:
+            # il file non contiene ancora tutto: serve la vista file + journal
+            cached = _excel_extract_rows()[1]
+        elif (
+            _EXCEL_CACHE.key is not None
+            and os.path.exists(BOOKINGS_EXCEL_PATH)
+            and _EXCEL_CACHE.key == _excel_file_key()
+        ):
+            cached = _EXCEL_CACHE.table
+        count = len(cached) if cached is not None else 0
+
+    if cached is not None:
+        # le righe già presenti non vengono mai tolte dalla tabella: basta fissarne il numero
+        for pos in range(count):
+            yield _BookingRow(cached, pos).to_dict()
+        return
+    for rec in _excel_stream_records():
         rec.pop("_row_index", None)
-        cleaned.append(rec)
-    return cleaned
+        yield rec
 
 
 def _excel_row_by_index(row_index: int) -> Dict[str, Any]:
-    _, records = _excel_extract_rows()
-    for rec in records:
-        if rec.get("_row_index") == row_index:
-            rec = dict(rec)
-            rec.pop("_row_index", None)
-            return rec
+    with _EXCEL_LOCK:
+        _excel_extract_rows()
+        rec = _EXCEL_CACHE.table.row(row_index)
+        if rec is not None:
+            return rec.to_dict()
     raise IndexError(f"Riga {row_index} non trovata nel file Excel")
 
 
-def _excel_update_row_dict(row_index: int, data: dict) -> None:
-    with _excel_zip() as zf:
-        sheet_path = _excel_sheet_path(zf, BOOKINGS_SHEET_NAME)
-        sheet_root = ET.fromstring(zf.read(sheet_path))
-        header_map, _ = _excel_extract_rows()
+def _excel_find_row(sheet_data: ET.Element, row_index: int) -> Optional[ET.Element]:
+    for row in sheet_data.findall("main:row", EXCEL_NS):
+        if int(row.get("r")) == row_index:
+            return row
+    return None
+
+
+def _excel_new_row(sheet_data: ET.Element, row_index: int) -> ET.Element:
+    """Crea la riga `row_index` (vuota) rispettando l'ordine delle righe.
+
+    Se la riga esiste già viene sostituita: riapplicare un'aggiunta non la duplica.
+    """
+
+    position = len(sheet_data)
+    for i, row in enumerate(list(sheet_data)):
+        r = int(row.get("r", "0"))
+        if r == row_index:
+            sheet_data.remove(row)
+            position = i
+            break
+        if r > row_index:
+            position = i
+            break
+    row_elem = ET.Element(f"{_MAIN}row", {"r": str(row_index)})
+    sheet_data.insert(position, row_elem)
+    return row_elem
 
-    if not header_map:
-        raise RuntimeError("Header del foglio non trovato")
 
+def _excel_set_inline(cell: ET.Element, value: str) -> None:
+    cell.set("t", "inlineStr")
+    is_elem = ET.SubElement(cell, f"{_MAIN}is")
+    t_elem = ET.SubElement(is_elem, f"{_MAIN}t")
+    t_elem.text = value
+
+
+def _excel_last_row(sheet_data: ET.Element) -> int:
+    last_index = 0
+    for row_elem in sheet_data.findall("main:row", EXCEL_NS):
+        try:
+            last_index = max(last_index, int(row_elem.get("r", "0")))
+        except ValueError:
+            continue
+    return last_index
+
+
+def _excel_apply_update(
+    sheet_root: ET.Element, header_map: Dict[str, str], row_index: int, data: Dict[str, Any]
+) -> None:
     sheet_data = sheet_root.find("main:sheetData", EXCEL_NS)
     if sheet_data is None:
         raise RuntimeError("sheetData non presente nel foglio Excel")
 
-    row_elem = None
-    for row in sheet_data.findall("main:row", EXCEL_NS):
-        if int(row.get("r")) == row_index:
-            row_elem = row
-            break
+    row_elem = _excel_find_row(sheet_data, row_index)
     if row_elem is None:
         raise IndexError(f"Riga {row_index} non trovata")
 
@@ -315,77 +1212,298 @@ def _excel_update_row_dict(row_index: int, data: dict) -> None:
         for cell in row_elem.findall("main:c", EXCEL_NS):
             if cell.get("r") == cell_ref:
                 return cell
-        cell = ET.SubElement(
-            row_elem, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}c"
-        )
+        cell = ET.SubElement(row_elem, f"{_MAIN}c")
         cell.set("r", cell_ref)
         return cell
 
+    columns = {name: col for col, name in header_map.items()}
     for header, value in data.items():
-        if header not in header_map.values():
+        column = columns.get(header)
+        if column is None:
             continue
-        column = next(col for col, name in header_map.items() if name == header)
         cell = ensure_cell(column)
         for child in list(cell):
             cell.remove(child)
         if value in (None, ""):
             cell.attrib.pop("t", None)
             continue
-        cell.set("t", "inlineStr")
-        is_elem = ET.SubElement(
-            cell, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}is"
-        )
-        t_elem = ET.SubElement(
-            is_elem, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t"
-        )
-        t_elem.text = str(value)
-
-    _excel_write_sheet(sheet_root, sheet_path)
-
-
-def _excel_append_row_dict(data: dict) -> None:
-    with _excel_zip() as zf:
-        sheet_path = _excel_sheet_path(zf, BOOKINGS_SHEET_NAME)
-        sheet_root = ET.fromstring(zf.read(sheet_path))
-        header_map, records = _excel_extract_rows()
+        _excel_set_inline(cell, str(value))
 
-    if not header_map:
-        raise RuntimeError("Header del foglio non trovato")
 
+def _excel_apply_append_dict(
+    sheet_root: ET.Element, header_map: Dict[str, str], row_index: int, data: Dict[str, Any]
+) -> None:
     sheet_data = sheet_root.find("main:sheetData", EXCEL_NS)
     if sheet_data is None:
         raise RuntimeError("sheetData non presente nel foglio Excel")
 
-    new_index = 2 + len(records)
-    row_elem = ET.SubElement(
-        sheet_data, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row"
-    )
-    row_elem.set("r", str(new_index))
-
+    row_elem = _excel_new_row(sheet_data, row_index)
     for col, header in header_map.items():
         value = data.get(header, "")
         if value in (None, ""):
             continue
-        cell = ET.SubElement(
-            row_elem, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}c"
-        )
-        cell.set("r", f"{col}{new_index}")
-        cell.set("t", "inlineStr")
-        is_elem = ET.SubElement(
-            cell, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}is"
-        )
-        t_elem = ET.SubElement(
-            is_elem, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t"
-        )
-        t_elem.text = str(value)
+        cell = ET.SubElement(row_elem, f"{_MAIN}c")
+        cell.set("r", f"{col}{row_index}")
+        _excel_set_inline(cell, str(value))
 
     dimension = sheet_root.find("main:dimension", EXCEL_NS)
     if dimension is not None and header_map:
         start_col = next(iter(header_map.keys()))
         end_col = list(header_map.keys())[-1]
-        dimension.set("ref", f"{start_col}1:{end_col}{new_index}")
+        dimension.set("ref", f"{start_col}1:{end_col}{_excel_last_row(sheet_data)}")
+
+
+def _excel_apply_append(sheet_root: ET.Element, row_index: Optional[int], values: List[str]) -> int:
+    """Aggiunge una riga di valori grezzi; senza `row_index` usa la prima riga libera."""
+
+    sheet_data = sheet_root.find("main:sheetData", EXCEL_NS)
+    if sheet_data is None:
+        sheet_data = ET.SubElement(sheet_root, f"{_MAIN}sheetData")
+
+    if row_index is None:
+        last_index = _excel_last_row(sheet_data)
+        row_index = last_index + 1 if last_index else 1
+
+    row_elem = _excel_new_row(sheet_data, row_index)
+    for offset, value in enumerate(values, start=1):
+        if value == "":
+            continue
+        cell = ET.SubElement(row_elem, f"{_MAIN}c")
+        cell.set("r", f"{_excel_column_from_index(offset)}{row_index}")
+        _excel_set_inline(cell, value)
 
-    _excel_write_sheet(sheet_root, sheet_path)
+    dimension = sheet_root.find("main:dimension", EXCEL_NS)
+    if dimension is None:
+        dimension = ET.SubElement(sheet_root, f"{_MAIN}dimension")
+    end_col = _excel_column_from_index(max(1, len(values)))
+    dimension.set("ref", f"A1:{end_col}{_excel_last_row(sheet_data)}")
+    return row_index
+
+
+def _excel_commit(entries: List[Dict[str, Any]], strict: bool = True) -> FileKey:
+    """Applica un gruppo di modifiche al file Excel con una sola riscrittura.
+
+    Ogni foglio coinvolto viene letto e serializzato una volta sola. Con
+    `strict=False` le modifiche non applicabili (es. una riga cancellata a mano
+    dal file) vengono scartate con un avviso invece di bloccare tutto il gruppo.
+    Restituisce la nuova chiave del file.
+    """
+
+    header_map: Optional[Dict[str, str]] = None
+    roots: Dict[str, ET.Element] = {}
+    paths: Dict[str, str] = {}
+    with _excel_zip() as zf:
+        for entry in entries:
+            sheet = entry["sheet"]
+            if sheet not in paths:
+                paths[sheet] = _excel_sheet_path(zf, sheet)
+                roots[sheet] = ET.fromstring(zf.read(paths[sheet]))
+
+    for entry in entries:
+        sheet_root = roots[entry["sheet"]]
+        try:
+            if entry["op"] == "append":
+                entry["row"] = _excel_apply_append(sheet_root, entry.get("row"), entry["values"])
+                continue
+            if header_map is None:
+                header_map, _ = _excel_extract_rows()
+            if not header_map:
+                raise RuntimeError("Header del foglio non trovato")
+            if entry["op"] == "update":
+                _excel_apply_update(sheet_root, header_map, entry["row"], entry["data"])
+            else:
+                _excel_apply_append_dict(sheet_root, header_map, entry["row"], entry["data"])
+        except (IndexError, RuntimeError) as e:
+            if strict:
+                raise
+            print(f"[SHEETS] modifica scartata ({entry['op']} {entry['sheet']}!{entry.get('row')}): {e}")
+
+    parts = {
+        paths[sheet]: ET.tostring(sheet_root, encoding="utf-8", xml_declaration=True)
+        for sheet, sheet_root in roots.items()
+    }
+    return _excel_write_parts(parts)
+
+
+def _excel_next_row(sheet_name: str) -> int:
+    """Prima riga libera del foglio, tenendo conto delle modifiche in attesa."""
+
+    last_rows = _EXCEL_CACHE.last_rows
+    if sheet_name not in last_rows:
+        if sheet_name == BOOKINGS_SHEET_NAME:
+            last = _EXCEL_CACHE.table.last_row()
+        else:
+            with _excel_zip() as zf:
+                last = _excel_stream_last_row(zf, _excel_sheet_path(zf, sheet_name))
+        journal = _excel_journal()
+        for entry in journal.pending if journal is not None else ():
+            if entry["sheet"] == sheet_name and entry.get("row") is not None:
+                last = max(last, entry["row"])
+        last_rows[sheet_name] = last
+    return last_rows[sheet_name] + 1
+
+
+def _excel_check(entry: Dict[str, Any], header_map: Dict[str, str], sheets_ok: Dict[str, bool]) -> Optional[Exception]:
+    """Errore che la modifica provocherebbe, verificato sulla cache prima di scrivere."""
+
+    if not sheets_ok.get(entry["sheet"]):
+        return RuntimeError(f"Sheet '{entry['sheet']}' non trovato nel file Excel")
+    if entry["sheet"] != BOOKINGS_SHEET_NAME or entry["op"] == "append":
+        return None
+    if not header_map:
+        return RuntimeError("Header del foglio non trovato")
+    if entry["op"] == "update" and entry["row"] not in _EXCEL_CACHE.table:
+        return IndexError(f"Riga {entry['row']} non trovata")
+    return None
+
+
+def _excel_write_batch(batch: List[Tuple[Dict[str, Any], "Future[None]"]]) -> None:
+    """Applica un gruppo di modifiche: una riscrittura del file (o una fsync del journal).
+
+    Le modifiche non valide falliscono singolarmente senza bloccare le altre;
+    un errore di scrittura fallisce tutto il gruppo.
+    """
+
+    accepted: List[Tuple[Dict[str, Any], "Future[None]"]] = []
+    with _EXCEL_LOCK:
+        try:
+            journal = _excel_journal()
+            header_map, _ = _excel_extract_rows()
+            before = _EXCEL_CACHE.key
+            sheets_ok: Dict[str, bool] = {}
+            with _excel_zip() as zf:
+                for entry, _ in batch:
+                    if entry["sheet"] in sheets_ok:
+                        continue
+                    try:
+                        _excel_sheet_path(zf, entry["sheet"])
+                        sheets_ok[entry["sheet"]] = True
+                    except RuntimeError:
+                        sheets_ok[entry["sheet"]] = False
+
+            for entry, fut in batch:
+                error = _excel_check(entry, header_map, sheets_ok)
+                if error is not None:
+                    fut.set_exception(error)
+                    continue
+                if entry.get("row") is None:
+                    entry["row"] = _excel_next_row(entry["sheet"])
+                    # riserviamo la riga per le aggiunte successive dello stesso gruppo
+                    _EXCEL_CACHE.last_rows[entry["sheet"]] = entry["row"]
+                accepted.append((entry, fut))
+            if not accepted:
+                return
+
+            entries = [entry for entry, _ in accepted]
+            if journal is not None:
+                journal.extend(entries)
+                for entry in entries:
+                    _excel_cache_apply(entry)
+            else:
+                after = _excel_commit(entries)
+                _excel_cache_after_write(before, after, entries)
+        except Exception as e:
+            # cache possibilmente disallineata (righe riservate, scrittura a metà)
+            _EXCEL_CACHE.invalidate()
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+    for _, fut in accepted:
+        fut.set_result(None)
+
+
+class _ExcelWriter:
+    """Unico thread che scrive le modifiche al file Excel (group commit).
+
+    Le richieste accodano la propria modifica e attendono il relativo Future;
+    il thread prende tutto ciò che si è accumulato in coda mentre era occupato
+    e lo scrive con una sola riscrittura del file (o una sola fsync del journal).
+    """
+
+    name = "bookings-writer"
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Optional[List[Tuple[Dict[str, Any], Future[None]]]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, entry: Dict[str, Any]) -> "Future[None]":
+        return self.submit_many([entry])[0]
+
+    def submit_many(self, entries: List[Dict[str, Any]]) -> List["Future[None]"]:
+        """Accoda più modifiche insieme: finiscono nello stesso gruppo di scrittura."""
+
+        items = [(entry, Future()) for entry in entries]
+        self._queue.put(items)
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return [fut for _, fut in items]
+
+    def stop(self) -> None:
+        """Scrive ciò che è ancora in coda e ferma il thread."""
+
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = list(item)
+            batch_max = get_settings().BOOKINGS_WRITE_BATCH_MAX
+            while len(batch) < batch_max:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.extend(item)
+            _excel_write_batch(batch)
+
+
+_EXCEL_WRITER = _ExcelWriter()
+
+
+def _excel_submit(entry: Dict[str, Any], wait: bool = True) -> "Future[None]":
+    """Accoda una modifica allo scrittore unico; con `wait` attende che sia durevole.
+
+    Non va chiamata tenendo `_EXCEL_LOCK`: lo scrittore ne ha bisogno per applicarla.
+    """
+
+    fut = _EXCEL_WRITER.submit(entry)
+    if wait:
+        fut.result()
+    return fut
+
+
+def _excel_stringify(data: Dict[str, Any]) -> Dict[str, str]:
+    return {k: "" if v is None else str(v) for k, v in data.items()}
+
+
+def _excel_update_row_dict(row_index: int, data: dict, wait: bool = True) -> "Future[None]":
+    return _excel_submit(
+        {"op": "update", "sheet": BOOKINGS_SHEET_NAME, "row": row_index, "data": _excel_stringify(data)},
+        wait,
+    )
+
+
+def _excel_append_row_dict(data: dict, wait: bool = True) -> "Future[None]":
+    return _excel_submit(
+        {"op": "append_dict", "sheet": BOOKINGS_SHEET_NAME, "row": None, "data": _excel_stringify(data)},
+        wait,
+    )
 
 def _excel_column_from_index(index: int) -> str:
     if index < 1:
@@ -397,79 +1515,931 @@ def _excel_column_from_index(index: int) -> str:
     return result
 
 
-def _excel_append_row(sheet_name: str, values: Iterable[Any]) -> None:
-    with _excel_zip() as zf:
-        sheet_path = _excel_sheet_path(zf, sheet_name)
-        sheet_root = ET.fromstring(zf.read(sheet_path))
+def _excel_append_row(sheet_name: str, values: Iterable[Any], wait: bool = True) -> "Future[None]":
+    normalized_values = ["" if v is None else str(v) for v in values]
+    return _excel_submit(
+        {"op": "append", "sheet": sheet_name, "row": None, "values": normalized_values}, wait
+    )
 
-    sheet_data = sheet_root.find("main:sheetData", EXCEL_NS)
-    if sheet_data is None:
-        sheet_data = ET.SubElement(
-            sheet_root, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}sheetData"
-        )
 
-    last_index = 0
-    for row_elem in sheet_data.findall("main:row", EXCEL_NS):
+# ---------------------------------------------------------------------------
+# Scrittore unico verso Google (coalescenza e quota)
+# ---------------------------------------------------------------------------
+
+
+class _TokenBucket:
+    """Token bucket sulla quota di scrittura al minuto dell'API Sheets."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = max(1.0, per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Consuma un token, attendendo se la quota del minuto è esaurita."""
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def _google_throttled(exc: Exception) -> bool:  # pragma: no cover
+    """True per gli errori temporanei (quota superata, backend Google occupato)."""
+
+    if gspread is None or not isinstance(exc, gspread.exceptions.APIError):
+        return False
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status in (429, 500, 502, 503)
+
+
+def _google_call(fn):  # pragma: no cover - dipende da Google
+    """Esegue una chiamata di scrittura rispettando la quota.
+
+    Sui 429 (e sui 5xx temporanei) riprova con backoff esponenziale e jitter
+    invece di far fallire le richieste; sugli handle scaduti li ricrea.
+    """
+
+    settings = get_settings()
+    bucket = _google_bucket()
+    attempt = 0
+    while True:
+        bucket.acquire()
         try:
-            last_index = max(last_index, int(row_elem.get("r", "0")))
-        except ValueError:
-            continue
-    new_index = last_index + 1 if last_index else 1
+            return fn()
+        except Exception as e:
+            if _google_stale(e) and attempt == 0:
+                _google_reset()
+            elif not _google_throttled(e) or attempt >= settings.GOOGLE_WRITE_MAX_RETRIES:
+                raise
+            delay = min(settings.GOOGLE_WRITE_BACKOFF_MAX, 2 ** attempt) * random.uniform(0.5, 1.5)
+            print(f"[SHEETS] scrittura Google rimandata di {delay:.1f}s: {e}")
+            time.sleep(delay)
+            attempt += 1
+
+
+_GOOGLE_BUCKET: Optional[_TokenBucket] = None
+
+
+def _google_bucket() -> _TokenBucket:
+    """Token bucket della quota, creato al primo uso con `GOOGLE_WRITE_QUOTA_PER_MINUTE`."""
+
+    global _GOOGLE_BUCKET
+    with _GOOGLE_LOCK:
+        if _GOOGLE_BUCKET is None:
+            _GOOGLE_BUCKET = _TokenBucket(get_settings().GOOGLE_WRITE_QUOTA_PER_MINUTE)
+        return _GOOGLE_BUCKET
+
+
+@_google_retry
+def _google_sheet_headers(sheet: str) -> List[str]:  # pragma: no cover
+    return _google_headers(_google_ws(sheet))
+
+
+def _google_write_sheet(sheet: str, items: List[Tuple[Dict[str, Any], "Future[None]"]]) -> None:  # pragma: no cover
+    """Scrive le modifiche di un foglio: un `batch_update` e un `append_rows` al massimo.
+
+    Gli aggiornamenti della stessa cella si fondono (vince l'ultimo); le
+    modifiche non valide falliscono da sole senza bloccare le altre.
+    """
 
-    row_elem = ET.SubElement(
-        sheet_data, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row"
+    updates: List[Tuple[Dict[str, Any], "Future[None]"]] = []
+    appends: List[Tuple[Dict[str, Any], "Future[None]"]] = []
+    try:
+        headers = _google_sheet_headers(sheet) if any(e["op"] != "append" for e, _ in items) else []
+    except Exception as e:
+        for _, fut in items:
+            fut.set_exception(e)
+        return
+
+    for entry, fut in items:
+        if entry["op"] != "append" and not headers:
+            fut.set_exception(RuntimeError(f"Il worksheet '{sheet}' non ha header nella riga 1."))
+        elif entry["op"] == "update":
+            updates.append((entry, fut))
+        else:
+            appends.append((entry, fut))
+
+    if updates:
+        cells: Dict[Tuple[int, int], str] = {}
+        for entry, _ in updates:
+            for i, h in enumerate(headers):
+                if h in entry["data"]:
+                    cells[(entry["row"], i + 1)] = entry["data"][h]
+        body = [
+            {"range": gspread.utils.rowcol_to_a1(row, col), "values": [[value]]}
+            for (row, col), value in cells.items()
+        ]
+        try:
+            if body:
+                _google_call(lambda: _google_ws(sheet).batch_update(body, value_input_option="RAW"))
+        except Exception as e:
+            for _, fut in updates:
+                fut.set_exception(e)
+        else:
+            for entry, fut in updates:
+                _GOOGLE_MIRROR.apply_update(entry["row"], entry["data"])
+                fut.set_result(None)
+
+    if appends:
+        rows = [
+            [entry["data"].get(h, "") for h in headers] if entry["op"] == "append_dict" else entry["values"]
+            for entry, _ in appends
+        ]
+        try:
+            response = _google_call(lambda: _google_ws(sheet).append_rows(rows, value_input_option="RAW"))
+        except Exception as e:
+            for _, fut in appends:
+                fut.set_exception(e)
+        else:
+            # le righe sono contigue a partire da quella indicata da Google
+            start = _google_appended_row(response)
+            if start is None and sheet == BOOKINGS_SHEET_NAME:
+                print("[SHEETS] riga delle aggiunte non ricavabile dalla risposta: riscarico il mirror")
+                _GOOGLE_MIRROR.invalidate()
+            for offset, (entry, fut) in enumerate(appends):
+                entry["row"] = start + offset if start is not None else None
+                if entry["op"] == "append_dict" and start is not None:
+                    _GOOGLE_MIRROR.apply_append(start + offset, entry["data"])
+                fut.set_result(None)
+
+
+class _GoogleWriter(_ExcelWriter):
+    """Unico thread che invia le modifiche a Google, una volta per tick.
+
+    Raccoglie per `GOOGLE_WRITE_TICK` secondi le modifiche di tutte le
+    richieste (compresi i log della chat) e le spedisce con una chiamata per
+    tipo e per foglio, invece di una o più chiamate per modifica.
+    """
+
+    name = "google-writer"
+
+    def _run(self) -> None:  # pragma: no cover - dipende da Google
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = list(item)
+            settings = get_settings()
+            deadline = time.monotonic() + settings.GOOGLE_WRITE_TICK
+            while len(batch) < settings.BOOKINGS_WRITE_BATCH_MAX:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.extend(item)
+
+            by_sheet: Dict[str, List[Tuple[Dict[str, Any], "Future[None]"]]] = {}
+            for entry, fut in batch:
+                by_sheet.setdefault(entry["sheet"], []).append((entry, fut))
+            for sheet, items in by_sheet.items():
+                try:
+                    _google_write_sheet(sheet, items)
+                except Exception as e:
+                    for _, fut in items:
+                        if not fut.done():
+                            fut.set_exception(e)
+
+
+_GOOGLE_WRITER = _GoogleWriter()
+
+
+def _google_submit(entry: Dict[str, Any], wait: bool = True) -> "Future[None]":  # pragma: no cover
+    fut = _GOOGLE_WRITER.submit(entry)
+    if wait:
+        fut.result()
+    return fut
+
+
+def _google_append_row_dict(data: dict, wait: bool = True) -> "Future[None]":  # pragma: no cover
+    return _google_submit(
+        {"op": "append_dict", "sheet": BOOKINGS_SHEET_NAME, "data": _excel_stringify(data)}, wait
     )
-    row_elem.set("r", str(new_index))
 
-    normalized_values = ["" if v is None else str(v) for v in values]
-    for offset, value in enumerate(normalized_values, start=1):
-        if value == "":
-            continue
-        column = _excel_column_from_index(offset)
-        cell = ET.SubElement(
-            row_elem, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}c"
+
+def _google_append_row(sheet_name: str, values: List[str], wait: bool = True) -> "Future[None]":  # pragma: no cover
+    return _google_submit({"op": "append", "sheet": sheet_name, "values": list(values)}, wait)
+
+
+def _google_update_row_dict(row_index: int, data: dict, wait: bool = True) -> "Future[None]":  # pragma: no cover
+    return _google_submit(
+        {"op": "update", "sheet": BOOKINGS_SHEET_NAME, "row": row_index, "data": _excel_stringify(data)},
+        wait,
+    )
+
+
+def _zip_copy_raw(zin: zipfile.ZipFile, zout: zipfile.ZipFile, info: zipfile.ZipInfo) -> None:
+    """Copia un membro nello zip di uscita senza decomprimerlo né ricomprimerlo.
+
+    I byte compressi vengono letti subito dopo l'header locale del membro e
+    riscritti con un nuovo header (CRC e dimensioni restano quelli originali).
+    Usa gli stessi attributi interni di `ZipFile` che aggiorna `writestr`.
+    """
+
+    zin.fp.seek(info.header_offset)
+    header = zin.fp.read(_ZIP_LOCAL_HEADER_SIZE)
+    if len(header) != _ZIP_LOCAL_HEADER_SIZE or header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Header locale non valido per {info.filename}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    zin.fp.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_len + extra_len)
+
+    out = copy.copy(info)
+    # CRC e dimensioni vanno nell'header locale: niente data descriptor in coda.
+    out.flag_bits &= ~_ZIP_DATA_DESCRIPTOR_FLAG
+    zout.fp.seek(zout.start_dir)
+    out.header_offset = zout.fp.tell()
+    zout.fp.write(out.FileHeader(False))
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = zin.fp.read(min(remaining, _ZIP_COPY_CHUNK))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Dati troncati per {info.filename}")
+        zout.fp.write(chunk)
+        remaining -= len(chunk)
+
+    zout.start_dir = zout.fp.tell()
+    zout.filelist.append(out)
+    zout.NameToInfo[out.filename] = out
+    zout._didModify = True
+
+
+def _excel_write_parts(
+    parts: Dict[str, bytes], path: str = BOOKINGS_EXCEL_PATH, source: Optional[str] = None
+) -> FileKey:
+    """Sostituisce alcuni membri del file Excel e restituisce la nuova chiave del file.
+
+    Solo i membri in `parts` vengono compressi di nuovo; tutti gli altri
+    (stili, tema, disegni, altri fogli) sono copiati byte per byte. Con
+    `source` il risultato è una copia modificata di quel file scritta in `path`.
+    """
+
+    # Il temporaneo va creato accanto al file finale: `os.replace` deve restare
+    # una rename atomica sullo stesso filesystem.
+    with tempfile.NamedTemporaryFile(
+        delete=False, dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp"
+    ) as tmp:
+        tmp_path = tmp.name
+
+    try:
+        with _excel_zip(source or path) as zin, zipfile.ZipFile(tmp_path, "w") as zout:
+            pending = dict(parts)
+            for info in zin.infolist():
+                data = pending.pop(info.filename, None)
+                if data is not None:
+                    replaced = zipfile.ZipInfo(info.filename, date_time=time.localtime()[:6])
+                    replaced.compress_type = info.compress_type
+                    replaced.external_attr = info.external_attr
+                    zout.writestr(replaced, data)
+                elif max(info.file_size, info.compress_size) >= zipfile.ZIP64_LIMIT:
+                    zout.writestr(info, zin.read(info))
+                else:
+                    _zip_copy_raw(zin, zout, info)
+            for filename, data in pending.items():
+                zout.writestr(filename, data, compress_type=zipfile.ZIP_DEFLATED)
+        # `os.replace` conserva inode e mtime del file temporaneo: la chiave letta
+        # qui è esattamente quella che vedrà `_excel_extract_rows`.
+        key = _excel_file_key(tmp_path)
+        os.replace(tmp_path, path)
+        return key
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+# ---------------------------------------------------------------------------
+# Journal delle modifiche (backend Excel)
+# ---------------------------------------------------------------------------
+
+
+class _ExcelJournal:
+    """Journal append-only (JSONL) delle modifiche al file Excel.
+
+    Ogni modifica viene scritta e sincronizzata su disco prima di rispondere;
+    un thread in background le compatta in `Bookings.xlsx` con una sola
+    riscrittura. La riga di destinazione è fissata al momento della scrittura,
+    quindi riapplicare il journal dopo un crash non duplica le righe.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.pending: List[Dict[str, Any]] = []
+        self._fh: Optional[IO[str]] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self) -> None:
+        """Rilegge le modifiche non ancora compattate (recupero dopo un crash)."""
+
+        entries: List[Dict[str, Any]] = []
+        good = 0
+        try:
+            with open(self.path, "rb") as fh:
+                for line in fh:
+                    if not line.endswith(b"\n"):
+                        break
+                    if line.strip():
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            break
+                    good += len(line)
+        except FileNotFoundError:
+            pass
+        else:
+            if good < os.path.getsize(self.path):
+                # coda troncata da un crash a metà scrittura: la scartiamo
+                os.truncate(self.path, good)
+        self.pending = entries
+
+    def extend(self, entries: List[Dict[str, Any]]) -> None:
+        """Aggiunge un gruppo di modifiche con una sola fsync."""
+
+        if self._fh is None:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self.pending.extend(entries)
+        if len(self.pending) >= get_settings().BOOKINGS_EXCEL_JOURNAL_MAX_PENDING:
+            self._wake.set()
+
+    def reset(self) -> None:
+        """Svuota il journal dopo che le modifiche sono state compattate."""
+
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        with open(self.path, "w", encoding="utf-8") as fh:
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.pending = []
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="bookings-journal", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(get_settings().BOOKINGS_EXCEL_JOURNAL_INTERVAL)
+            self._wake.clear()
+            try:
+                compact_journal()
+            except Exception as e:
+                print(f"[SHEETS] compattazione journal fallita: {e}")
+
+
+_EXCEL_JOURNAL: Optional[_ExcelJournal] = None
+
+
+def _excel_journal() -> Optional[_ExcelJournal]:
+    """Journal attivo (caricato dal disco e con il compattatore avviato), se abilitato."""
+
+    global _EXCEL_JOURNAL
+    settings = get_settings()
+    if not settings.BOOKINGS_EXCEL_JOURNAL:
+        return None
+    with _EXCEL_LOCK:
+        if _EXCEL_JOURNAL is None:
+            journal = _ExcelJournal(settings.BOOKINGS_EXCEL_JOURNAL_PATH or f"{BOOKINGS_EXCEL_PATH}.journal")
+            journal.load()
+            journal.start()
+            _EXCEL_JOURNAL = journal
+        return _EXCEL_JOURNAL
+
+
+def compact_journal() -> int:
+    """Scrive nel file Excel le modifiche in attesa nel journal.
+
+    Restituisce il numero di modifiche compattate (0 se il journal è spento o vuoto).
+    """
+
+    journal = _excel_journal()
+    if journal is None:
+        return 0
+    with _EXCEL_LOCK:
+        if not journal.pending:
+            return 0
+        entries = list(journal.pending)
+        _excel_extract_rows()
+        before = _EXCEL_CACHE.key
+        after = _excel_commit(entries, strict=False)
+        journal.reset()
+        # La cache contiene già queste modifiche: basta adottare la nuova chiave.
+        if _EXCEL_CACHE.key == before:
+            _EXCEL_CACHE.key = after
+        else:
+            _EXCEL_CACHE.invalidate()
+        return len(entries)
+
+
+def start_background_tasks() -> None:
+    """Avvio dell'app: compatta subito le modifiche rimaste nel journal da un'esecuzione precedente."""
+
+    if get_settings().BOOKINGS_EXCEL_JOURNAL and os.path.exists(BOOKINGS_EXCEL_PATH):
+        compact_journal()
+
+
+def stop_background_tasks() -> None:
+    """Arresto dell'app: svuota la coda di scrittura e compatta il journal nel file Excel."""
+
+    _EXCEL_WRITER.stop()
+    _GOOGLE_WRITER.stop()
+    _GOOGLE_MIRROR.stop()
+    if _EXCEL_JOURNAL is None:
+        return
+    _EXCEL_JOURNAL.stop()
+    compact_journal()
+
+
+# ---------------------------------------------------------------------------
+# Backend SQLite (BOOKINGS_BACKEND=sqlite)
+# ---------------------------------------------------------------------------
+
+
+# Colonne usate se il database viene creato vuoto, senza importare un file Excel.
+_SQLITE_DEFAULT_COLUMNS = [
+    "property_id", "booking_ref", "source_portal", "checkin_date", "checkin_time",
+    "checkout_date", "checkout_time", "guest_first_name", "guest_last_name",
+    "guest_email", "locale", "status", "authorized", "wifi_coupon", "checkin_code",
+    "notes", "allow_web", "ai_calls",
+]
+
+# Chiavi di ricerca calcolate in scrittura con gli stessi normalizzatori delle
+# ricerche, così `find_booking` e simili diventano lookup su indice.
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS booking_columns (
+    position INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS bookings (
+    row_index INTEGER PRIMARY KEY,
+    data TEXT NOT NULL,
+    k_arrival INTEGER,
+    k_departure INTEGER,
+    k_last_name TEXT NOT NULL DEFAULT '',
+    k_first_name TEXT NOT NULL DEFAULT '',
+    k_property TEXT NOT NULL DEFAULT '',
+    k_stay_end INTEGER,
+    k_incomplete INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS bookings_by_name ON bookings (k_arrival, k_last_name);
+CREATE INDEX IF NOT EXISTS bookings_by_stay ON bookings (k_arrival, k_departure);
+CREATE INDEX IF NOT EXISTS bookings_by_property ON bookings (k_property, k_arrival);
+CREATE INDEX IF NOT EXISTS bookings_by_stay_end ON bookings (k_property, k_stay_end);
+CREATE INDEX IF NOT EXISTS bookings_incomplete ON bookings (k_incomplete, k_property, row_index);
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    sheet TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (sheet, row_index)
+);
+"""
+
+_SQLITE_LOCAL = threading.local()
+_SQLITE_WRITE_LOCK = threading.Lock()
+
+
+def _sqlite_conn() -> sqlite3.Connection:
+    """Connessione del thread corrente (sqlite3 non condivide le connessioni tra thread)."""
+
+    conn = getattr(_SQLITE_LOCAL, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(bookings_sqlite_path(), timeout=30, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SQLITE_SCHEMA)
+        if conn.execute("SELECT COUNT(*) FROM booking_columns").fetchone()[0] == 0:
+            with conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO booking_columns (position, name) VALUES (?, ?)",
+                    enumerate(_SQLITE_DEFAULT_COLUMNS),
+                )
+        _SQLITE_LOCAL.conn = conn
+    return conn
+
+
+def _sqlite_columns(conn: sqlite3.Connection) -> List[str]:
+    return [name for (name,) in conn.execute("SELECT name FROM booking_columns ORDER BY position")]
+
+
+def _sqlite_record(columns: List[str], data: Dict[str, Any]) -> Dict[str, str]:
+    rec = {h: "" if data.get(h) is None else str(data.get(h)) for h in columns}
+    return _excel_post_process_record(rec)
+
+
+def _sqlite_store(conn: sqlite3.Connection, row_index: int, rec: Dict[str, str]) -> None:
+    keys = _RowKeys.of(rec)
+    stay = _stay_of(keys)
+    conn.execute(
+        "INSERT OR REPLACE INTO bookings"
+        " (row_index, data, k_arrival, k_departure, k_last_name, k_first_name, k_property, k_stay_end,"
+        " k_incomplete) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            row_index,
+            json.dumps(rec, ensure_ascii=False),
+            *keys,
+            stay[1] if stay else None,
+            int(_missing_details(rec)),
+        ),
+    )
+
+
+def _sqlite_load(row_index: int, data: str) -> Dict[str, Any]:
+    rec: Dict[str, Any] = {"_row_index": row_index}
+    rec.update(json.loads(data))
+    return rec
+
+
+def _sqlite_iter_rows() -> Iterator[Dict[str, Any]]:
+    conn = _sqlite_conn()
+    for _, data in conn.execute("SELECT row_index, data FROM bookings ORDER BY row_index"):
+        yield json.loads(data)
+
+
+def _sqlite_row_by_index(row_index: int) -> Dict[str, Any]:
+    row = _sqlite_conn().execute("SELECT data FROM bookings WHERE row_index = ?", (row_index,)).fetchone()
+    if row is None:
+        raise IndexError(f"Riga {row_index} non trovata nel database")
+    return json.loads(row[0])
+
+
+def _sqlite_apply(conn: sqlite3.Connection, entry: Dict[str, Any]) -> None:
+    """Applica una modifica (stesso formato delle voci dello scrittore Excel)."""
+
+    if entry["op"] == "update":
+        row_index = entry["row"]
+        row = conn.execute("SELECT data FROM bookings WHERE row_index = ?", (row_index,)).fetchone()
+        if row is None:
+            raise IndexError(f"Riga {row_index} non trovata")
+        rec = json.loads(row[0])
+        for header in rec:
+            if header in entry["data"]:
+                rec[header] = entry["data"][header]
+        _sqlite_store(conn, row_index, _excel_post_process_record(rec))
+    elif entry["op"] == "append_dict":
+        (last,) = conn.execute("SELECT COALESCE(MAX(row_index), 1) FROM bookings").fetchone()
+        entry["row"] = last + 1
+        _sqlite_store(conn, entry["row"], _sqlite_record(_sqlite_columns(conn), entry["data"]))
+    else:
+        (last,) = conn.execute(
+            "SELECT COALESCE(MAX(row_index), 1) FROM sheet_rows WHERE sheet = ?", (entry["sheet"],)
+        ).fetchone()
+        entry["row"] = last + 1
+        conn.execute(
+            "INSERT INTO sheet_rows (sheet, row_index, data) VALUES (?, ?, ?)",
+            (entry["sheet"], entry["row"], json.dumps(entry["values"], ensure_ascii=False)),
         )
-        cell.set("r", f"{column}{new_index}")
-        cell.set("t", "inlineStr")
-        is_elem = ET.SubElement(
-            cell, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}is"
+
+
+def _sqlite_commit(entries: List[Dict[str, Any]]) -> None:
+    """Applica le modifiche in un'unica transazione: o tutte o nessuna."""
+
+    conn = _sqlite_conn()
+    with _SQLITE_WRITE_LOCK, conn:
+        for entry in entries:
+            _sqlite_apply(conn, entry)
+
+
+def _sqlite_append_row_dict(data: dict) -> None:
+    _sqlite_commit([{"op": "append_dict", "sheet": BOOKINGS_SHEET_NAME, "row": None, "data": _excel_stringify(data)}])
+
+
+def _sqlite_update_row_dict(row_index: int, data: dict) -> None:
+    _sqlite_commit([{"op": "update", "sheet": BOOKINGS_SHEET_NAME, "row": row_index, "data": _excel_stringify(data)}])
+
+
+def _sqlite_append_row(sheet_name: str, values: List[str]) -> None:
+    _sqlite_commit([{"op": "append", "sheet": sheet_name, "row": None, "values": list(values)}])
+
+
+class _SqliteIndex:
+    """Stessa interfaccia di `_BookingIndex`, risolta con query sugli indici SQLite."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+        self.keys: Dict[int, _RowKeys] = {}
+
+    def _rows(self, where: str, params: Tuple[Any, ...], limit: str = "") -> List[Tuple[int, Dict[str, Any]]]:
+        sql = (
+            "SELECT row_index, data, k_arrival, k_departure, k_last_name, k_first_name, k_property"
+            f" FROM bookings WHERE {where} ORDER BY row_index{limit}"
         )
-        t_elem = ET.SubElement(
-            is_elem, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t"
+        rows = []
+        for idx, data, *keys in self.conn.execute(sql, params):
+            self.keys[idx] = _RowKeys(*keys)
+            rows.append((idx, _sqlite_load(idx, data)))
+        return rows
+
+    def by_name(self, arrival: Optional[int], last_name: str) -> Iterable[Tuple[int, Dict[str, Any]]]:
+        return self._rows("k_arrival = ? AND k_last_name = ?", (arrival, last_name))
+
+    def by_stay(self, arrival: Optional[int], departure: Optional[int]) -> Iterable[Tuple[int, Dict[str, Any]]]:
+        if departure is not None:
+            return self._rows("k_arrival = ? AND k_departure = ?", (arrival, departure))
+        return self._rows("k_arrival = ?", (arrival,))
+
+    def for_property(self, property_id: Optional[str]) -> Iterable[Dict[str, Any]]:
+        return [rec for _, rec in self._rows("k_property = ?", ((property_id or "").strip(),))]
+
+    def properties(self) -> List[str]:
+        return [pid for (pid,) in self.conn.execute("SELECT DISTINCT k_property FROM bookings")]
+
+    def incomplete_count(self, property_id: Optional[str] = None) -> int:
+        if property_id:
+            sql, params = "SELECT COUNT(*) FROM bookings WHERE k_incomplete = 1 AND k_property = ?", (property_id.strip(),)
+        else:
+            sql, params = "SELECT COUNT(*) FROM bookings WHERE k_incomplete = 1", ()
+        return self.conn.execute(sql, params).fetchone()[0]
+
+    def incomplete_rows(
+        self, property_id: Optional[str] = None, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Tuple[int, Dict[str, Any]]]:
+        where, params = "k_incomplete = 1", ()
+        if property_id:
+            where, params = "k_incomplete = 1 AND k_property = ?", (property_id.strip(),)
+        return self._rows(where, (*params, -1 if limit is None else limit, offset), " LIMIT ? OFFSET ?")
+
+    def stays(self, property_id: Optional[str] = None) -> "_SqliteStays":
+        return _SqliteStays(self.conn, (property_id or "").strip() or None)
+
+    def record(self, row_index: int) -> Dict[str, Any]:
+        (data,) = self.conn.execute("SELECT data FROM bookings WHERE row_index = ?", (row_index,)).fetchone()
+        return _sqlite_load(row_index, data)
+
+
+class _SqliteStays:
+    """Stessa interfaccia di `_StayIndex`, con query sugli indici (k_property, k_arrival/k_stay_end)."""
+
+    def __init__(self, conn: sqlite3.Connection, property_id: Optional[str]) -> None:
+        self.conn = conn
+        self.property_id = property_id
+
+    def _select(self, where: str, params: Tuple[Any, ...], order: str = "row_index") -> List[int]:
+        if self.property_id is not None:
+            where = f"k_property = ? AND {where}"
+            params = (self.property_id, *params)
+        sql = f"SELECT row_index FROM bookings WHERE {where} ORDER BY {order}"
+        return [row for (row,) in self.conn.execute(sql, params)]
+
+    def overlapping(self, start: int, end: int) -> List[int]:
+        return self._select("k_arrival < ? AND k_stay_end > ?", (end, start))
+
+    def arriving(self, start: int, end: int) -> List[int]:
+        return self._select("k_arrival >= ? AND k_arrival < ?", (start, end), "k_arrival, row_index")
+
+    def departing(self, start: int, end: int) -> List[int]:
+        # solo partenze reali: senza checkout k_stay_end è la notte presunta
+        return self._select(
+            "k_stay_end >= ? AND k_stay_end < ? AND k_stay_end = k_departure", (start, end), "k_stay_end, row_index"
         )
-        t_elem.text = value
 
-    dimension = sheet_root.find("main:dimension", EXCEL_NS)
-    if dimension is None:
-        dimension = ET.SubElement(
-            sheet_root, "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}dimension"
+    def conflicts(self) -> List[Tuple[int, int]]:
+        where, params = "k_arrival IS NOT NULL", ()
+        if self.property_id is not None:
+            where, params = f"k_property = ? AND {where}", (self.property_id,)
+        stays = list(self.conn.execute(f"SELECT k_arrival, k_stay_end, row_index FROM bookings WHERE {where}", params))
+        return _StayIndex(stays).conflicts()
+
+
+def _excel_sheet_names(zf: zipfile.ZipFile) -> List[str]:
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    return [sheet.get("name") for sheet in workbook.findall("main:sheets/main:sheet", EXCEL_NS)]
+
+
+def _excel_column_to_index(column: str) -> int:
+    index = 0
+    for ch in column:
+        index = index * 26 + ord(ch.upper()) - 64
+    return index
+
+
+def import_excel_to_sqlite(path: str = BOOKINGS_EXCEL_PATH) -> int:
+    """Sostituisce il contenuto del database con quello del file Excel `path`.
+
+    Il foglio Bookings va nelle prenotazioni, gli altri fogli (es. Logs) in
+    `sheet_rows` come liste di valori. I numeri di riga restano quelli del
+    file Excel. Restituisce le prenotazioni importate.
+    """
+
+    header_map: Dict[str, str] = {}
+    records = list(_excel_stream_records(header_map, path))
+    if not header_map:
+        raise RuntimeError(f"Header del foglio '{BOOKINGS_SHEET_NAME}' non trovato in {path}")
+
+    other_rows: List[Tuple[str, int, str]] = []
+    with _excel_zip(path) as zf:
+        shared = _excel_shared_strings(zf)
+        for sheet in _excel_sheet_names(zf):
+            if sheet == BOOKINGS_SHEET_NAME:
+                continue
+            for row_index, cells in _excel_iter_cells(zf, _excel_sheet_path(zf, sheet), shared):
+                if not cells:
+                    continue
+                values = [""] * max(_excel_column_to_index(col) for col in cells)
+                for col, value in cells.items():
+                    values[_excel_column_to_index(col) - 1] = value
+                other_rows.append((sheet, row_index, json.dumps(values, ensure_ascii=False)))
+
+    columns = list(header_map.values())
+    conn = _sqlite_conn()
+    with _SQLITE_WRITE_LOCK, conn:
+        conn.execute("DELETE FROM booking_columns")
+        conn.executemany(
+            "INSERT INTO booking_columns (position, name) VALUES (?, ?)", enumerate(columns)
         )
-    end_col = _excel_column_from_index(max(1, len(normalized_values)))
-    dimension.set("ref", f"A1:{end_col}{new_index}")
+        conn.execute("DELETE FROM bookings")
+        for rec in records:
+            row_index = rec.pop("_row_index")
+            _sqlite_store(conn, row_index, _sqlite_record(columns, rec))
+        conn.execute("DELETE FROM sheet_rows")
+        conn.executemany("INSERT INTO sheet_rows (sheet, row_index, data) VALUES (?, ?, ?)", other_rows)
+    return len(records)
 
-    _excel_write_sheet(sheet_root, sheet_path)
 
-def _excel_write_sheet(sheet_root: ET.Element, sheet_path: str) -> None:
-    xml_bytes = ET.tostring(sheet_root, encoding="utf-8", xml_declaration=True)
-    with _excel_zip() as zf:
-        existing = {
-            item.filename: zf.read(item.filename)
-            for item in zf.infolist()
-            if item.filename != sheet_path
-        }
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+_WORKSHEET_CT = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
 
-    with tempfile.NamedTemporaryFile(delete=False) as tmp:
-        tmp_path = tmp.name
 
+def _xlsx_sheet_xml(sheet_xml: Optional[bytes], rows: List[Tuple[int, List[str]]]) -> bytes:
+    """XML del foglio con le righe date al posto di quelle esistenti.
+
+    Se c'è il foglio di partenza (`sheet_xml`) ne restano impostazioni, colonne
+    e stili delle celle con lo stesso riferimento; altrimenti il foglio è nuovo.
+    """
+
+    styles: Dict[str, str] = {}
+    if sheet_xml is None:
+        sheet = ET.Element(f"{_MAIN}worksheet")
+        sheet_data = ET.SubElement(sheet, f"{_MAIN}sheetData")
+    else:
+        sheet = ET.fromstring(sheet_xml)
+        sheet_data = sheet.find("main:sheetData", EXCEL_NS)
+        if sheet_data is None:
+            sheet_data = ET.SubElement(sheet, f"{_MAIN}sheetData")
+        for cell in sheet_data.iter(f"{_MAIN}c"):
+            if cell.get("s"):
+                styles[cell.get("r", "")] = cell.get("s")
+        for row in list(sheet_data):
+            sheet_data.remove(row)
+
+    width = 1
+    for row_index, values in rows:
+        row = ET.SubElement(sheet_data, f"{_MAIN}row", r=str(row_index))
+        width = max(width, len(values))
+        for i, value in enumerate(values, start=1):
+            if value in (None, ""):
+                continue
+            ref = f"{_excel_column_from_index(i)}{row_index}"
+            cell = ET.SubElement(row, f"{_MAIN}c", r=ref)
+            if ref in styles:
+                cell.set("s", styles[ref])
+            _excel_set_inline(cell, str(value))
+
+    dimension = sheet.find("main:dimension", EXCEL_NS)
+    if dimension is not None:
+        last = rows[-1][0] if rows else 1
+        dimension.set("ref", f"A1:{_excel_column_from_index(width)}{last}")
+    return ET.tostring(sheet, encoding="utf-8", xml_declaration=True)
+
+
+def _xlsx_add_sheet(zf: zipfile.ZipFile, parts: Dict[str, bytes], name: str) -> str:
+    """Registra in `parts` un nuovo foglio `name` del workbook e ne restituisce il percorso."""
+
+    def part(member: str) -> ET.Element:
+        return ET.fromstring(parts[member] if member in parts else zf.read(member))
+
+    workbook = part("xl/workbook.xml")
+    rels = part("xl/_rels/workbook.xml.rels")
+    types = part("[Content_Types].xml")
+
+    members = set(zf.namelist()) | set(parts)
+    number = 1
+    while f"xl/worksheets/sheet{number}.xml" in members:
+        number += 1
+    sheet_path = f"xl/worksheets/sheet{number}.xml"
+    rel_ids = {rel.get("Id") for rel in rels}
+    rel_number = 1
+    while f"rId{rel_number}" in rel_ids:
+        rel_number += 1
+    rel_id = f"rId{rel_number}"
+
+    ET.SubElement(
+        rels, f"{{{_PKG_REL_NS}}}Relationship",
+        Id=rel_id, Type=f"{_REL_NS}/worksheet", Target=f"worksheets/sheet{number}.xml",
+    )
+    sheets = workbook.find("main:sheets", EXCEL_NS)
+    sheet_id = max((int(s.get("sheetId", "0")) for s in sheets), default=0) + 1
+    ET.SubElement(sheets, f"{_MAIN}sheet", {"name": name, "sheetId": str(sheet_id), f"{{{_REL_NS}}}id": rel_id})
+    ET.SubElement(types, f"{{{_CT_NS}}}Override", PartName=f"/{sheet_path}", ContentType=_WORKSHEET_CT)
+
+    parts["xl/workbook.xml"] = ET.tostring(workbook, encoding="utf-8", xml_declaration=True)
+    parts["xl/_rels/workbook.xml.rels"] = ET.tostring(rels, encoding="utf-8", xml_declaration=True)
+    parts["[Content_Types].xml"] = ET.tostring(types, encoding="utf-8", xml_declaration=True)
+    return sheet_path
+
+
+def _xlsx_blank_workbook(directory: str) -> str:
+    """Workbook senza fogli in un file temporaneo, da usare come modello vuoto."""
+
+    parts = {
+        "[Content_Types].xml": (
+            f'<?xml version="1.0" encoding="UTF-8"?><Types xmlns="{_CT_NS}">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            "</Types>"
+        ),
+        "_rels/.rels": (
+            f'<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="{_PKG_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>"
+        ),
+        "xl/workbook.xml": (
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<workbook xmlns="{EXCEL_NS["main"]}" xmlns:r="{_REL_NS}"><sheets/></workbook>'
+        ),
+        "xl/_rels/workbook.xml.rels": (
+            f'<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="{_PKG_REL_NS}"/>'
+        ),
+    }
+    fd, tmp_path = tempfile.mkstemp(suffix=".xlsx", dir=directory)
+    os.close(fd)
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, payload in parts.items():
+            zf.writestr(name, payload.encode("utf-8"))
+    return tmp_path
+
+
+def export_sqlite_to_excel(path: str, template: Optional[str] = BOOKINGS_EXCEL_PATH, overwrite: bool = False) -> int:
+    """Scrive in `path` un file Excel con le prenotazioni e gli altri fogli del database.
+
+    Il file è una copia di `template` (di norma il Bookings.xlsx in uso) in cui
+    cambiano solo i fogli presenti nel database: stili, tema, disegni e gli
+    altri fogli restano quelli del modello. Senza modello si parte da un
+    workbook vuoto. Un file già esistente (compreso il modello stesso) viene
+    sovrascritto solo con `overwrite`.
+
+    Le righe mantengono il proprio numero (buchi compresi), così un file
+    esportato e reimportato è identico. Restituisce le prenotazioni esportate.
+    """
+
+    if os.path.exists(path) and not overwrite:
+        raise FileExistsError(f"{path} esiste già: non viene sovrascritto")
+
+    conn = _sqlite_conn()
+    columns = _sqlite_columns(conn)
+    sheet_rows: Dict[str, List[Tuple[int, List[str]]]] = {BOOKINGS_SHEET_NAME: [(1, columns)]}
+    for row_index, data in conn.execute("SELECT row_index, data FROM bookings ORDER BY row_index"):
+        rec = json.loads(data)
+        sheet_rows[BOOKINGS_SHEET_NAME].append((row_index, [rec.get(h, "") for h in columns]))
+    for sheet, row_index, data in conn.execute("SELECT sheet, row_index, data FROM sheet_rows ORDER BY sheet, row_index"):
+        sheet_rows.setdefault(sheet, []).append((row_index, json.loads(data)))
+
+    blank = None
+    if template is None or not os.path.exists(template):
+        blank = template = _xlsx_blank_workbook(os.path.dirname(os.path.abspath(path)))
     try:
-        with zipfile.ZipFile(tmp_path, "w") as zout:
-            for filename, data in existing.items():
-                zout.writestr(filename, data)
-            zout.writestr(sheet_path, xml_bytes)
-        os.replace(tmp_path, BOOKINGS_EXCEL_PATH)
+        parts: Dict[str, bytes] = {}
+        with _excel_zip(template) as zf:
+            existing = set(_excel_sheet_names(zf))
+            for sheet, rows in sheet_rows.items():
+                if sheet in existing:
+                    sheet_path = _excel_sheet_path(zf, sheet)
+                    parts[sheet_path] = _xlsx_sheet_xml(zf.read(sheet_path), rows)
+                else:
+                    parts[_xlsx_add_sheet(zf, parts, sheet)] = _xlsx_sheet_xml(None, rows)
+        _excel_write_parts(parts, path, source=template)
     finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
+        if blank is not None:
+            os.unlink(blank)
+    return len(sheet_rows[BOOKINGS_SHEET_NAME]) - 1
 
 
 # ---------------------------------------------------------------------------
@@ -477,42 +2447,109 @@ def _excel_write_sheet(sheet_root: ET.Element, sheet_path: str) -> None:
 # ---------------------------------------------------------------------------
 
 
-def list_rows() -> List[Dict[str, Any]]:
+def iter_rows() -> Iterator[Dict[str, Any]]:
+    """Scorre le prenotazioni una alla volta (stesso contenuto di `list_rows`)."""
+
     backend = _determine_backend()
     if backend == "google":  # pragma: no cover
-        return _google_list_rows()
-    return _excel_list_rows()
+        yield from _google_list_rows()
+        return
+    if backend == "sqlite":
+        yield from _sqlite_iter_rows()
+        return
+    yield from _excel_iter_rows()
+
+
+def list_rows() -> List[Dict[str, Any]]:
+    return list(iter_rows())
+
+
+def _done_future() -> "Future[None]":
+    fut: "Future[None]" = Future()
+    fut.set_result(None)
+    return fut
 
 
-def append_row_dict(data: dict) -> None:
+# Le funzioni di scrittura attendono che la modifica sia durevole. Con
+# `wait=False` restituiscono subito un Future che si completa (o fallisce)
+# quando lo è: dal codice async si può attendere con `asyncio.wrap_future`.
+
+
+def append_row_dict(data: dict, wait: bool = True) -> "Future[None]":
     backend = _determine_backend()
     if backend == "google":  # pragma: no cover
-        _google_append_row_dict(data)
-    else:
-        _excel_append_row_dict(data)
+        return _google_append_row_dict(data, wait)
+    if backend == "sqlite":
+        _sqlite_append_row_dict(data)
+        return _done_future()
+    return _excel_append_row_dict(data, wait)
 
-def append_row(sheet_name: str, row: Iterable[Any]) -> None:
+def append_row(sheet_name: str, row: Iterable[Any], wait: bool = True) -> "Future[None]":
     backend = _determine_backend()
     normalized_row = ["" if v is None else str(v) for v in row]
     if backend == "google":  # pragma: no cover
-        ws = _google_ws(sheet_name)
-        ws.append_row(normalized_row, value_input_option="RAW")
-    else:
-        _excel_append_row(sheet_name, normalized_row)
+        return _google_append_row(sheet_name, normalized_row, wait)
+    if backend == "sqlite":
+        _sqlite_append_row(sheet_name, normalized_row)
+        return _done_future()
+    return _excel_append_row(sheet_name, normalized_row, wait)
+
+def _gather(futures: List["Future[None]"]) -> "Future[None]":
+    """Future che si completa quando tutti quelli dati sono completati (primo errore vince)."""
+
+    out: "Future[None]" = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(fut: "Future[None]") -> None:
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if fut.exception() is not None and not out.done():
+            out.set_exception(fut.exception())
+        elif last and not out.done():
+            out.set_result(None)
+
+    if not futures:
+        out.set_result(None)
+    for fut in futures:
+        fut.add_done_callback(done)
+    return out
+
+def append_rows(sheet_name: str, rows: Iterable[Iterable[Any]], wait: bool = True) -> "Future[None]":
+    """Aggiunge più righe a un foglio con una sola scrittura."""
+
+    backend = _determine_backend()
+    entries = [
+        {"op": "append", "sheet": sheet_name, "row": None, "values": ["" if v is None else str(v) for v in row]}
+        for row in rows
+    ]
+    if backend == "sqlite":
+        _sqlite_commit(entries)
+        return _done_future()
+    writer = _GOOGLE_WRITER if backend == "google" else _EXCEL_WRITER
+    fut = _gather(writer.submit_many(entries)) if entries else _done_future()
+    if wait:
+        fut.result()
+    return fut
 
 def read_row_by_index(row_index: int) -> Dict[str, Any]:
     backend = _determine_backend()
     if backend == "google":  # pragma: no cover
         return _google_row_by_index(row_index)
+    if backend == "sqlite":
+        return _sqlite_row_by_index(row_index)
     return _excel_row_by_index(row_index)
 
 
-def update_row_dict(row_index: int, data: dict) -> None:
+def update_row_dict(row_index: int, data: dict, wait: bool = True) -> "Future[None]":
     backend = _determine_backend()
     if backend == "google":  # pragma: no cover
-        _google_update_row_dict(row_index, data)
-    else:
-        _excel_update_row_dict(row_index, data)
+        return _google_update_row_dict(row_index, data, wait)
+    if backend == "sqlite":
+        _sqlite_update_row_dict(row_index, data)
+        return _done_future()
+    return _excel_update_row_dict(row_index, data, wait)
 
 
 # ---------------------------------------------------------------------------
@@ -521,8 +2558,15 @@ def update_row_dict(row_index: int, data: dict) -> None:
 
 
 
-def _normalize_name(s: Optional[str]) -> str:
-    return (s or "").strip().lower()
+def _name_key(s: Any) -> str:
+    """Chiave di confronto di un nome: senza accenti, casefold, internata."""
+
+    text = str(s or "").strip()
+    if not text:
+        return ""
+    if not text.isascii():
+        text = "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+    return sys.intern(text.casefold())
 
 def _parse_date_any(s: str) -> str:
     """Restituisce la data in formato ISO YYYY-MM-DD."""
@@ -560,6 +2604,46 @@ def _normalize_date_value(value: Any) -> str:
     except Exception:
         return _parse_date_any(text)
 
+
+def _date_ordinal(value: Any) -> Optional[int]:
+    """Giorno come intero (`date.toordinal`); None se vuoto o non interpretabile."""
+
+    text = str(value).strip() if value is not None else ""
+    if len(text) == 10 and text[4] == "-":
+        try:
+            return date.fromisoformat(text).toordinal()
+        except ValueError:
+            pass
+    text = _normalize_date_value(value)
+    try:
+        return date.fromisoformat(text).toordinal()
+    except ValueError:
+        return None
+
+@contextmanager
+def _booking_index() -> Iterator[_BookingIndex]:
+    """Indici sulle prenotazioni del backend attivo.
+
+    Restituisce gli indici mantenuti dalla cache Excel o dal mirror Google,
+    tenendo il relativo lock per tutta la ricerca; con SQLite le ricerche
+    diventano query sugli indici del database.
+    """
+
+    backend = _determine_backend()
+    if backend == "google":  # pragma: no cover
+        _GOOGLE_MIRROR.ensure()
+        with _GOOGLE_MIRROR.lock:
+            yield _GOOGLE_MIRROR.index
+        return
+    if backend == "sqlite":
+        yield _SqliteIndex(_sqlite_conn())
+        return
+
+    with _EXCEL_LOCK:
+        _excel_extract_rows()
+        yield _EXCEL_CACHE.index
+
+
 def find_booking(
     arrival_date: str,
     last_name: str,
@@ -568,53 +2652,25 @@ def find_booking(
 ) -> Tuple[Optional[int], Optional[Dict[str, Any]], int]:
     print(f"[DEBUG sheets] cerco booking: arr={arrival_date} last={last_name} first={first_name} prop={property_id}")
 
-    backend = _determine_backend()
-
-    print(f"[DEBUG sheets] backend in uso → {backend}")
-
-    if backend == "google":  # pragma: no cover
-        ws = _google_ws()
-        records = [
-            {**rec, "_row_index": idx}
-            for idx, rec in enumerate(ws.get_all_records(), start=2)
-        ]
-    else:
-        _, records = _excel_extract_rows()
-        print(f"[DEBUG sheets] lette {len(records)} righe dal file Excel '{BOOKINGS_EXCEL_PATH}' (sheet={BOOKINGS_SHEET_NAME})")
-        
-
-    want_date = _parse_date_any(arrival_date)
-    want_ln = _normalize_name(last_name)
-    want_fn = _normalize_name(first_name)
+    want_date = _date_ordinal(arrival_date)
+    want_ln = _name_key(last_name)
+    want_fn = _name_key(first_name)
     want_pid = (property_id or "").strip()
 
     hits: List[Tuple[int, Dict[str, Any]]] = []
-    for rec in records:
-        idx = rec.get("_row_index") or records.index(rec) + 2
-        r_date = _parse_date_any(str(rec.get("checkin_date", "")))
-        r_ln = _normalize_name(rec.get("guest_last_name"))
-        r_fn = _normalize_name(rec.get("guest_first_name"))
-        r_pid = (rec.get("property_id") or "").strip()
-
-        print(f"[DEBUG sheets] confronto riga {idx}: date={r_date}, ln={r_ln}, fn={r_fn}, pid={r_pid}")
-
-
-        if r_date != want_date:
-            continue
-        if r_ln != want_ln:
-            continue
-        if first_name and r_fn != want_fn:
-            continue
-        if property_id and r_pid != want_pid:
-            continue
-
-        hits.append((idx, rec))
+    with _booking_index() as index:
+        for idx, rec in index.by_name(want_date, want_ln) if want_date is not None else ():
+            keys = index.keys[idx]
+            if first_name and keys.first_name != want_fn:
+                continue
+            if property_id and keys.property_id != want_pid:
+                continue
+            hits.append((idx, dict(rec)))
 
     print(f"[DEBUG sheets] trovati {len(hits)} risultati compatibili")
 
     if len(hits) == 1:
         idx, rec = hits[0]
-        rec = dict(rec)
         rec.pop("_row_index", None)
         return idx, rec, 1
     if len(hits) == 0:
@@ -622,29 +2678,218 @@ def find_booking(
     
     return None, None, len(hits)
 
+# Le transazioni sono serializzate tra loro: la ricerca e la modifica che ne
+# dipende non possono intrecciarsi con quelle di un'altra registrazione. Il lock
+# copre solo l'accodamento delle modifiche, non l'attesa della scrittura.
+_BOOKING_TX_LOCK = threading.Lock()
+
+# Modifiche accodate da transazioni già chiuse e non ancora scritte:
+# Future -> (riga aggiornata o None, chiavi (arrivo, cognome) toccate).
+# Una transazione che cerca lo stesso ospite o rilegge la stessa riga le
+# attende, così vede l'indice già aggiornato; le altre non aspettano.
+_TX_INFLIGHT: Dict["Future[None]", Tuple[Optional[int], FrozenSet[Tuple[Optional[int], str]]]] = {}
+_TX_INFLIGHT_LOCK = threading.Lock()
+# colonne che cambiano l'esito di una ricerca per ospite
+_TX_KEY_COLUMNS = ("checkin_date", "guest_last_name", "guest_first_name", "property_id")
+
+
+def _tx_guest_key(rec: Dict[str, Any]) -> Tuple[Optional[int], str]:
+    keys = _RowKeys.of(rec)
+    return keys.arrival, keys.last_name
+
+
+def _tx_untrack(fut: "Future[None]") -> None:
+    with _TX_INFLIGHT_LOCK:
+        _TX_INFLIGHT.pop(fut, None)
+
+
+def _tx_wait_inflight(
+    row_index: Optional[int] = None, key: Optional[Tuple[Optional[int], str]] = None
+) -> bool:
+    """Attende le modifiche in volo sulla riga o sull'ospite indicati; True se ce n'erano."""
+
+    with _TX_INFLIGHT_LOCK:
+        futures = [
+            fut
+            for fut, (row, keys) in _TX_INFLIGHT.items()
+            if (row_index is not None and row == row_index) or (key is not None and key in keys)
+        ]
+    for fut in futures:
+        fut.exception()  # l'esito lo riporta la transazione che l'ha scritta
+    return bool(futures)
+
+
+class BookingTransaction:
+    """Ricerca, modifiche e rilettura di prenotazioni con un'unica scrittura.
+
+    Le righe lette restano in memoria e le modifiche vi vengono applicate
+    subito, così la rilettura non passa dal backend; alla chiusura di
+    `booking_transaction()` tutte le modifiche vengono scritte insieme.
+    """
+
+    def __init__(self) -> None:
+        self.entries: List[Dict[str, Any]] = []
+        self.errors: List[Optional[BaseException]] = []
+        self._errors_by_entry: Dict[int, Optional[BaseException]] = {}
+        self._rows: Dict[int, Dict[str, Any]] = {}
+        # righe aggiunte in questa transazione, ancora senza numero
+        self._appended: List[Tuple[_RowKeys, Dict[str, Any]]] = []
+        # ospiti (arrivo, cognome) di cui un aggiornamento cambia le chiavi, per voce
+        self._keys_by_entry: Dict[int, FrozenSet[Tuple[Optional[int], str]]] = {}
+        self._submitted: List[Dict[str, Any]] = []
+        self._futures: List["Future[None]"] = []
+
+    def find(
+        self,
+        arrival_date: str,
+        last_name: str,
+        first_name: Optional[str] = None,
+        property_id: Optional[str] = None,
+    ) -> Tuple[Optional[int], Optional[Dict[str, Any]], int]:
+        _tx_wait_inflight(key=(_date_ordinal(arrival_date), _name_key(last_name)))
+        idx, rec, count = find_booking(arrival_date, last_name, first_name, property_id)
+        if idx is not None and idx not in self._rows and _tx_wait_inflight(row_index=idx):
+            idx, rec, count = find_booking(arrival_date, last_name, first_name, property_id)
+        if idx is not None and rec is not None:
+            self._rows.setdefault(idx, rec)
+            rec = dict(self._rows[idx])
+        return idx, rec, count
+
+    def row(self, row_index: int) -> Dict[str, Any]:
+        if row_index not in self._rows:
+            _tx_wait_inflight(row_index=row_index)
+            self._rows[row_index] = read_row_by_index(row_index)
+        return dict(self._rows[row_index])
+
+    def update(self, row_index: int, data: dict) -> Dict[str, Any]:
+        """Registra la modifica e restituisce la riga come sarà dopo la scrittura."""
+
+        rec = self._rows.get(row_index)
+        if rec is None:
+            self.row(row_index)
+            rec = self._rows[row_index]
+        values = _excel_stringify(data)
+        before = _tx_guest_key(rec)
+        for header, value in values.items():
+            if header in rec:
+                rec[header] = _normalize_date_value(value) if header in _DATE_COLUMNS else value
+        entry = {"op": "update", "sheet": BOOKINGS_SHEET_NAME, "row": row_index, "data": values}
+        if any(column in values for column in _TX_KEY_COLUMNS):
+            self._keys_by_entry[id(entry)] = frozenset((before, _tx_guest_key(rec)))
+        self.entries.append(entry)
+        return dict(rec)
+
+    def append(self, data: dict) -> Dict[str, Any]:
+        """Registra una nuova riga; dopo il commit `entry["row"]` ne contiene il numero, se noto."""
+
+        entry = {"op": "append_dict", "sheet": BOOKINGS_SHEET_NAME, "row": None, "data": _excel_stringify(data)}
+        self.entries.append(entry)
+        self._appended.append((_RowKeys.of(entry["data"]), entry))
+        return entry
+
+    def upsert(self, arrival_date: str, last_name: str, first_name: str, payload: dict) -> Tuple[str, Dict[str, Any]]:
+        """Aggiorna la prenotazione dell'ospite se è una sola, altrimenti ne aggiunge una.
+
+        Considera anche le righe aggiunte prima nella stessa transazione.
+        Restituisce l'azione e la voce di scrittura (`row` noto dopo il commit
+        per le aggiunte).
+        """
+
+        idx, _, count = self.find(arrival_date, last_name, first_name)
+        want = (_date_ordinal(arrival_date), _name_key(last_name), _name_key(first_name))
+        pending = [
+            entry for keys, entry in self._appended
+            if (keys.arrival, keys.last_name) == want[:2] and (not first_name or keys.first_name == want[2])
+        ]
+        if count + len(pending) == 1:
+            if idx:
+                self.update(idx, payload)
+                return "updated", self.entries[-1]
+            entry = pending[0]
+            entry["data"].update(_excel_stringify(payload))
+            return "updated", entry
+        return "inserted", self.append(payload)
+
+    def submit(self) -> None:
+        """Accoda le modifiche allo scrittore (con SQLite le scrive subito).
+
+        Da chiamare sotto `_BOOKING_TX_LOCK`: da qui in poi le transazioni
+        successive sullo stesso ospite o sulla stessa riga attendono queste
+        modifiche prima di leggere.
+        """
+
+        entries, self.entries = self.entries, []
+        self._submitted, self._futures = entries, []
+        if not entries:
+            return
+        backend = _determine_backend()
+        if backend == "sqlite":
+            try:
+                _sqlite_commit(entries)
+                self.errors = [None] * len(entries)
+            except Exception as e:
+                self.errors = [e] * len(entries)
+            return
+        writer = _GOOGLE_WRITER if backend == "google" else _EXCEL_WRITER
+        self._futures = writer.submit_many(entries)
+        with _TX_INFLIGHT_LOCK:
+            for entry, fut in zip(entries, self._futures):
+                if entry["op"] == "update":
+                    _TX_INFLIGHT[fut] = (entry["row"], self._keys_by_entry.get(id(entry), frozenset()))
+                else:
+                    _TX_INFLIGHT[fut] = (None, frozenset((_tx_guest_key(entry["data"]),)))
+        for fut in self._futures:
+            fut.add_done_callback(_tx_untrack)
+
+    def wait(self) -> List[Optional[BaseException]]:
+        """Attende la scrittura delle modifiche accodate; restituisce l'eventuale errore di ciascuna."""
+
+        if not self._submitted:
+            return []
+        if self._futures:
+            self.errors = [fut.exception() for fut in self._futures]
+        self._errors_by_entry = {id(entry): error for entry, error in zip(self._submitted, self.errors)}
+        return self.errors
+
+    def commit(self) -> List[Optional[BaseException]]:
+        """Scrive le modifiche; restituisce l'eventuale errore di ciascuna."""
+
+        self.submit()
+        return self.wait()
+
+    def error_of(self, entry: Dict[str, Any]) -> Optional[BaseException]:
+        """Errore di scrittura di una voce, dopo il commit."""
+
+        return self._errors_by_entry.get(id(entry))
+
+
+@contextmanager
+def booking_transaction(strict: bool = True) -> Iterator[BookingTransaction]:
+    """Apre una transazione sulle prenotazioni; scrive tutto all'uscita senza errori.
+
+    Con `strict` il primo errore di scrittura viene rilanciato; altrimenti gli
+    errori delle singole modifiche restano in `tx.errors`.
+    """
+
+    with _BOOKING_TX_LOCK:
+        tx = BookingTransaction()
+        yield tx
+        tx.submit()
+    # la durabilità si attende fuori dal lock: le altre transazioni proseguono
+    errors = tx.wait()
+    if strict:
+        for error in errors:
+            if error is not None:
+                raise error
+
+
 def upsert_booking(arrival_date: str, last_name: str, first_name: str, payload: dict) -> dict:
-    
-    idx, rec, count = find_booking(arrival_date, last_name, first_name)
-    backend = _determine_backend()
 
-    if backend == "google":  # pragma: no cover
-        ws = _google_ws()
-        headers = _google_headers(ws)
-    else:
-        header_map, _ = _excel_extract_rows()
-        headers = list(header_map.values())
+    with booking_transaction() as tx:
+        action, entry = tx.upsert(arrival_date, last_name, first_name, payload)
+        data = tx.row(entry["row"]) if entry["op"] == "update" else payload
 
-    if count == 1 and idx:
-        update_row_dict(idx, payload)
-        return {"action": "updated", "row_index": idx, "data": read_row_by_index(idx)}
-    
-    if backend == "google":  # pragma: no cover
-        row = [str(payload.get(h, "")) for h in headers]
-        ws.append_row(row, value_input_option="RAW")
-    else:
-        _excel_append_row_dict(payload)
-    
-    return {"action": "inserted", "row_index": None, "data": payload}
+    return {"action": action, "row_index": entry.get("row"), "data": data}
 
 def authorize_guest(
     arrival_date: str,
@@ -654,8 +2899,21 @@ def authorize_guest(
     wifi_coupon: str,
     notes: str = "",
 ) -> dict:
-   
-    idx, rec, count = find_booking(arrival_date, last_name, first_name)
+
+    with booking_transaction() as tx:
+        return _authorize_in(tx, arrival_date, last_name, first_name, checkin_code, wifi_coupon, notes)
+
+
+def _authorize_in(
+    tx: BookingTransaction,
+    arrival_date: str,
+    last_name: str,
+    first_name: str,
+    checkin_code: str,
+    wifi_coupon: str,
+    notes: str = "",
+) -> dict:
+    idx, rec, count = tx.find(arrival_date, last_name, first_name)
 
     if count == 0:
         return {"status": "not_found", "message": "Prenotazione non trovata."}
@@ -669,27 +2927,128 @@ def authorize_guest(
         "status": "ready",
         "notes": notes or (rec or {}).get("notes", ""),
     }
-    update_row_dict(idx, payload)
-    return {"status": "ok", "row_index": idx, "data": read_row_by_index(idx)}
+    data = tx.update(idx, payload)
+    return {"status": "ok", "row_index": idx, "data": data}
+
+
+# --- Operazioni massive: tutte le modifiche in una sola scrittura ---
+
+
+def bulk_upsert_bookings(items: Iterable[Any]) -> List[dict]:
+    """Registra o aggiorna molte prenotazioni (righe con le colonne di Bookings).
+
+    Ogni elemento viene validato da solo: quelli non validi non bloccano gli
+    altri. Le modifiche valide vengono scritte insieme; l'esito è per elemento.
+    """
+
+    results: List[dict] = []
+    pending: List[Tuple[dict, Dict[str, Any]]] = []
+    with booking_transaction(strict=False) as tx:
+        for item in items:
+            if not isinstance(item, dict):
+                results.append({"status": "invalid", "message": "Elemento non valido: serve un oggetto."})
+                continue
+            arrival = str(item.get("checkin_date") or "")
+            last_name = str(item.get("guest_last_name") or "").strip()
+            if _date_ordinal(arrival) is None:
+                results.append({"status": "invalid", "message": f"checkin_date non valida: {arrival!r}"})
+                continue
+            if not last_name:
+                results.append({"status": "invalid", "message": "guest_last_name mancante."})
+                continue
+            first_name = str(item.get("guest_first_name") or "")
+            # celle vuote (CSV) = campo non fornito: non cancellano i valori già salvati
+            payload = {k: v for k, v in item.items() if v is not None and v != ""}
+            for key in _DATE_COLUMNS:
+                if key in payload:
+                    payload[key] = _normalize_date_value(payload[key])
+            action, entry = tx.upsert(arrival, last_name, first_name, payload)
+            # copia della riga a questo punto: un duplicato successivo può modificare la stessa voce
+            data = tx.row(entry["row"]) if entry["op"] == "update" else dict(entry["data"])
+            result = {"status": "ok", "action": action, "row_index": entry.get("row"), "data": data}
+            results.append(result)
+            pending.append((result, entry))
+
+    for result, entry in pending:
+        error = tx.error_of(entry)
+        if error is not None:
+            result.update(status="error", message=str(error), data=None)
+            continue
+        result["row_index"] = entry.get("row")
+    return results
+
+
+def bulk_authorize_guests(items: Iterable[Dict[str, Any]]) -> List[dict]:
+    """Autorizza molti ospiti (stessi campi di `authorize_guest`) con una sola scrittura."""
+
+    results: List[dict] = []
+    entries: List[Optional[Dict[str, Any]]] = []
+    with booking_transaction(strict=False) as tx:
+        for item in items:
+            try:
+                result = _authorize_in(
+                    tx,
+                    item["arrival_date"],
+                    item["last_name"],
+                    item["first_name"],
+                    item["checkin_code"],
+                    item["wifi_coupon"],
+                    item.get("notes") or "",
+                )
+            except KeyError as e:
+                result = {"status": "invalid", "message": f"Campo mancante: {e.args[0]}"}
+            results.append(result)
+            entries.append(tx.entries[-1] if result["status"] == "ok" else None)
+
+    for result, entry in zip(results, entries):
+        error = tx.error_of(entry) if entry is not None else None
+        if error is not None:
+            result.update(status="error", message=str(error), data=None)
+    return results
+
 
 # ---------------------------------------------------------------------------
 # Funzioni aggiuntive per chatbot
 # ---------------------------------------------------------------------------
 
 
+def _missing_details(rec: Dict[str, Any]) -> bool:
+    return (
+        not rec.get("guest_first_name")
+        or not rec.get("guest_last_name")
+        or not rec.get("guest_email")
+    )
+
+
+# Le righe incomplete sono tenute dagli indici a ogni aggiunta/modifica:
+# contarle costa O(1) e sfogliarle non richiede di scorrere tutto il foglio.
+
+
+def has_incomplete_bookings(property_id: Optional[str] = None) -> bool:
+    return count_incomplete_bookings(property_id) > 0
+
+
+def count_incomplete_bookings(property_id: Optional[str] = None) -> int:
+    with _booking_index() as index:
+        return index.incomplete_count(property_id)
+
+
+def incomplete_booking_rows(
+    property_id: Optional[str] = None, offset: int = 0, limit: Optional[int] = None
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """Righe incomplete in ordine di riga, a pagine: [(row_index, record)]."""
+
+    out = []
+    with _booking_index() as index:
+        for idx, rec in index.incomplete_rows(property_id, offset, limit):
+            rec = dict(rec)
+            rec.pop("_row_index", None)
+            out.append((idx, rec))
+    return out
+
+
 def list_incomplete_bookings(property_id: Optional[str] = None) -> List[Dict[str, Any]]:
-    rows = list_rows()
-    filtered: List[Dict[str, Any]] = []
-    for rec in rows:
-        if property_id and (rec.get("property_id") or "").strip() != property_id.strip():
-            continue
-        if (
-            not rec.get("guest_first_name")
-            or not rec.get("guest_last_name")
-            or not rec.get("guest_email")
-        ):
-            filtered.append(rec)
-    return filtered
+    return [rec for _, rec in incomplete_booking_rows(property_id)]
 
 
 def find_booking_by_dates(
@@ -698,43 +3057,107 @@ def find_booking_by_dates(
     property_id: Optional[str] = None,
     require_missing_details: bool = False,
 ) -> Tuple[Optional[int], Optional[Dict[str, Any]], int]:
-    backend = _determine_backend()
-    if backend == "google":  # pragma: no cover
-        ws = _google_ws()
-        raw_records = [
-            {**rec, "_row_index": idx}
-            for idx, rec in enumerate(ws.get_all_records(), start=2)
-        ]
-    else:
-        _, raw_records = _excel_extract_rows()
-
-    want_arrival = _parse_date_any(arrival_date)
-    want_departure = _parse_date_any(departure_date or "")
+    want_arrival = _date_ordinal(arrival_date)
+    want_departure = _date_ordinal(departure_date) if departure_date else None
     want_pid = (property_id or "").strip()
 
-    hits: List[Dict[str, Any]] = []
-    for rec in raw_records:
-        r_pid = (rec.get("property_id") or "").strip()
-        if property_id and r_pid != want_pid:
-            continue
-        r_arrival = _parse_date_any(str(rec.get("checkin_date", "")))
-        r_departure = _parse_date_any(str(rec.get("checkout_date", "")))
-        if r_arrival != want_arrival:
-            continue
-        if departure_date and r_departure != want_departure:
-            continue
-        if require_missing_details and not (
-            not rec.get("guest_first_name")
-            or not rec.get("guest_last_name")
-            or not rec.get("guest_email")
-        ):
-            continue
-        hits.append(rec)
+    hits: List[Tuple[int, Dict[str, Any]]] = []
+    with _booking_index() as index:
+        if want_arrival is None or (departure_date and want_departure is None):
+            found: Iterable[Tuple[int, Dict[str, Any]]] = ()
+        else:
+            found = index.by_stay(want_arrival, want_departure)
+        for idx, rec in found:
+            if property_id and index.keys[idx].property_id != want_pid:
+                continue
+            if require_missing_details and not _missing_details(rec):
+                continue
+            hits.append((idx, dict(rec)))
 
     if len(hits) == 1:
-        idx = hits[0].get("_row_index")
-        rec = dict(hits[0])
-        if "_row_index" in rec:
-            rec.pop("_row_index")
+        idx, rec = hits[0]
+        rec.pop("_row_index", None)
         return idx, rec, 1
-    return None, None, len(hits)
\ No newline at end of file
+    return None, None, len(hits)
+
+
+
+# ---------------------------------------------------------------------------
+# Soggiorni: presenze, arrivi/partenze e doppie prenotazioni
+# ---------------------------------------------------------------------------
+
+
+def _stay_day(value: str) -> int:
+    day = _date_ordinal(value)
+    if day is None:
+        raise ValueError(f"Data non valida: {value!r}")
+    return day
+
+
+def _stay_period(date_from: str, date_to: Optional[str]) -> Tuple[int, int]:
+    """Periodo [date_from, date_to] con estremi inclusi, come intervallo di ordinali."""
+
+    start = _stay_day(date_from)
+    end = _stay_day(date_to) if date_to else start
+    if end < start:
+        raise ValueError("La data finale precede quella iniziale")
+    return start, end + 1
+
+
+def _stay_records(index: Any, rows: Iterable[int]) -> List[Tuple[int, Dict[str, Any]]]:
+    out = []
+    for row_index in rows:
+        rec = dict(index.record(row_index))
+        rec.pop("_row_index", None)
+        out.append((row_index, rec))
+    return out
+
+
+def bookings_in_house(day: str, property_id: Optional[str] = None) -> List[Tuple[int, Dict[str, Any]]]:
+    """Prenotazioni con ospiti in casa nella notte di `day` (arrivo <= day < partenza)."""
+
+    start = _stay_day(day)
+    with _booking_index() as index:
+        return _stay_records(index, index.stays(property_id).overlapping(start, start + 1))
+
+
+def bookings_overlapping(
+    date_from: str, date_to: Optional[str] = None, property_id: Optional[str] = None
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """Prenotazioni con almeno una notte nel periodo [date_from, date_to]."""
+
+    start, end = _stay_period(date_from, date_to)
+    with _booking_index() as index:
+        return _stay_records(index, index.stays(property_id).overlapping(start, end))
+
+
+def bookings_arriving(
+    date_from: str, date_to: Optional[str] = None, property_id: Optional[str] = None
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """Arrivi nel periodo [date_from, date_to], in ordine di data."""
+
+    start, end = _stay_period(date_from, date_to)
+    with _booking_index() as index:
+        return _stay_records(index, index.stays(property_id).arriving(start, end))
+
+
+def bookings_departing(
+    date_from: str, date_to: Optional[str] = None, property_id: Optional[str] = None
+) -> List[Tuple[int, Dict[str, Any]]]:
+    """Partenze nel periodo [date_from, date_to], in ordine di data."""
+
+    start, end = _stay_period(date_from, date_to)
+    with _booking_index() as index:
+        return _stay_records(index, index.stays(property_id).departing(start, end))
+
+
+def find_double_bookings(property_id: Optional[str] = None) -> List[Tuple[str, int, int]]:
+    """Coppie di righe con soggiorni sovrapposti nella stessa struttura: (property_id, riga, riga)."""
+
+    with _booking_index() as index:
+        pids = [property_id.strip()] if property_id and property_id.strip() else index.properties()
+        pairs: List[Tuple[str, int, int]] = []
+        for pid in pids:
+            if pid:
+                pairs.extend((pid, first, second) for first, second in index.stays(pid).conflicts())
+    return sorted(pairs)
@@ -0,0 +1,13 @@
+# tests/conftest.py
+"""Configurazione comune dei test.
+
+Il percorso del file Excel viene fissato all'import di app.services.sheets
+(importato anche dal logger): lo puntiamo a una cartella temporanea prima che
+qualunque modulo di test lo importi.
+"""
+
+import os
+import tempfile
+
+_WORKDIR = tempfile.mkdtemp(prefix="concierge-tests-")
+os.environ["BOOKINGS_EXCEL_PATH"] = os.path.join(_WORKDIR, "Bookings.xlsx")
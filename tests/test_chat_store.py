@@ -0,0 +1,121 @@
+# tests/test_chat_store.py
+"""Test dell'archivio a colonne dei log e delle statistiche."""
+
+import random
+
+import pytest
+
+from app.config import get_settings
+from app.services import chat_store
+
+
+@pytest.fixture(autouse=True)
+def store(monkeypatch, tmp_path):
+    monkeypatch.setenv("CHAT_STORE_DIR", str(tmp_path / "store"))
+    monkeypatch.setenv("CHAT_LOG_DIR", str(tmp_path / "logs"))
+    get_settings.cache_clear()
+    yield tmp_path / "store"
+    monkeypatch.undo()
+    get_settings.cache_clear()
+
+
+@pytest.fixture(params=["numpy", "array"])
+def columns(request, monkeypatch):
+    """Statistiche con numpy (se installato) e con gli array della libreria standard."""
+
+    if request.param == "numpy" and chat_store.np is None:
+        pytest.skip("numpy non installato")
+    if request.param == "array":
+        monkeypatch.setattr(chat_store, "np", None)
+    return request.param
+
+
+def _records(seed, count):
+    rng = random.Random(seed)
+    questions = ["Dov'è il parcheggio?", "dov'è il parcheggio", "Orari piscina?", "Animali ammessi?", "Wifi?"]
+    latencies = [None, 0.5, 1.0, 12.3, 12.3, 250.0, 1e7, float(rng.randrange(1, 5000)) / 10]
+    out = []
+    for i in range(count):
+        out.append({
+            "ts": f"2031-03-{1 + i % 3:02d}T12:00:00",
+            "property_id": rng.choice(["CT-01", "CT-02", ""]),
+            "locale": rng.choice(["it", "en", "de", ""]),
+            "guest_msg": rng.choice(questions),
+            "bot_msg": "ok",
+            "used_ai": rng.random() < 0.4,
+            "extra": {"kb_hits": rng.choice([0, 0, 1, 3])} if rng.random() < 0.8 else {},
+            "latency_ms": rng.choice(latencies),
+        })
+    return out
+
+
+def _expected(records, top=10):
+    per_locale = {}
+    unanswered = {}
+    for record in records:
+        stats = per_locale.setdefault(record["locale"], {"count": 0, "hist": [0] * chat_store._LAT_BUCKETS, "n": 0})
+        stats["count"] += 1
+        if record["latency_ms"] is not None:
+            stats["hist"][chat_store._lat_bucket(record["latency_ms"])] += 1
+            stats["n"] += 1
+        if record["extra"].get("kb_hits") == 0:
+            key = chat_store._question_key(record["guest_msg"])
+            unanswered[key] = unanswered.get(key, 0) + 1
+    return {
+        "total": len(records),
+        "ai_ratio": round(sum(r["used_ai"] for r in records) / len(records), 4),
+        "unanswered": sum(unanswered.values()),
+        "counts": sorted(unanswered.values(), reverse=True)[:top],
+        "locales": {
+            name: {
+                "count": stats["count"],
+                "latency_ms": {
+                    f"p{int(q * 100)}": chat_store._percentile(stats["hist"], stats["n"], q) for q in (0.5, 0.9, 0.99)
+                },
+            }
+            for name, stats in sorted(per_locale.items())
+        },
+    }
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_stats_match_the_records(columns, seed):
+    records = _records(seed, 400)
+    for start in range(0, len(records), 64):  # blocchi come quelli del logger
+        chat_store.append_records(records[start:start + 64])
+
+    stats = chat_store.chat_stats()
+    expected = _expected(records)
+    assert stats["days"] == 3
+    assert stats["total"] == expected["total"]
+    assert stats["ai_ratio"] == expected["ai_ratio"]
+    assert stats["unanswered"] == expected["unanswered"]
+    assert [q["count"] for q in stats["top_unanswered"]] == expected["counts"]
+    assert not stats["top_unanswered_approximate"]
+    assert stats["locales"] == expected["locales"]
+
+
+def test_stats_filters(columns):
+    records = _records(7, 200)
+    chat_store.append_records(records)
+    day = [r for r in records if r["ts"].startswith("2031-03-02")]
+    assert chat_store.chat_stats("2031-03-02", "2031-03-02")["total"] == len(day)
+    prop = [r for r in records if r["property_id"] == "CT-02"]
+    assert chat_store.chat_stats(property_id="CT-02")["total"] == len(prop)
+    assert chat_store.chat_stats("2031-04-01")["total"] == 0
+
+
+def test_zero_rows_ignores_zero_bytes_across_values(columns):
+    from array import array
+
+    values = array("h", [256, 0, 1, -1, 0, 0, 512, 3])
+    assert chat_store._zero_rows(values) == [1, 4, 5]
+
+
+def test_store_dir_defaults_to_the_log_dir(monkeypatch, tmp_path):
+    from app.services import logger
+
+    monkeypatch.delenv("CHAT_STORE_DIR")
+    get_settings.cache_clear()
+    assert chat_store.store_dir() == str(tmp_path / "logs" / "store")
+    assert chat_store.store_dir().startswith(logger.log_dir())
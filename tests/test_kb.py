@@ -0,0 +1,491 @@
+# tests/test_kb.py
+"""Test del knowledge base: indice BM25, ricarica a caldo, tabella delle sezioni,
+KB per struttura, snapshot compilati, ricerca ibrida e cache delle ricerche."""
+
+import hashlib
+import math
+import os
+import random
+import time
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+from app.config import get_settings
+from app.services import kb
+
+_ORIGINAL_KB = Path(kb.__file__).resolve().parents[2] / "conoscenza.txt"
+# sezioni aggiunte alla copia: altre strutture, altre lingue, sezioni comuni
+_EXTRA = """
+# WIFI
+@property:CT-02 @lang:it
+SSID: Etna_WIFI
+PASSWORD: Lava2024
+NOTE: Il router è in cucina.
+
+# WIFI
+@property:CT-01 @lang:en
+SSID: FamedaHouse_WIFI
+PASSWORD: Sole123
+NOTE: Best coverage in the living room.
+
+# PARKING
+@property:CT-02 @lang:it
+TEXT: Parcheggio gratuito nel cortile interno, posto numero 4.
+
+# CHECKOUT
+@property:CT-01 @lang:en
+TIME: 10:30
+TEXT: Please leave the keys on the table.
+
+# SEA
+@lang:it
+SUMMER: Spiaggia libera di San Giovanni Li Cuti, dieci minuti a piedi.
+WINTER: Lungomare di Ognina per una passeggiata.
+"""
+
+
+def _setenv(monkeypatch, **values):
+    for name, value in values.items():
+        monkeypatch.setenv(name, str(value))
+    get_settings.cache_clear()
+
+
+def _reset_state():
+    kb.stop_kb_watcher()
+    kb._KB = None
+    kb._SHARDS = None
+    kb._query_cache_instance = None
+    kb._numpy_warned = False
+
+
+@pytest.fixture(autouse=True)
+def kb_copy(monkeypatch, tmp_path):
+    """Copia di conoscenza.txt (più _EXTRA) in una cartella temporanea, KB_DIR vuota accanto."""
+    path = tmp_path / "conoscenza.txt"
+    path.write_text(_ORIGINAL_KB.read_text(encoding="utf-8") + _EXTRA, encoding="utf-8")
+    (tmp_path / "conoscenza").mkdir()
+    monkeypatch.setattr(kb, "KB_PATH", path)
+    _setenv(monkeypatch, KB_DIR=tmp_path / "conoscenza", KB_RELOAD_INTERVAL=0, KB_RETRIEVAL="bm25")
+    _reset_state()
+    yield path
+    _reset_state()
+    monkeypatch.undo()
+    get_settings.cache_clear()
+
+
+# -------------------------------------------------
+# Indice invertito e BM25
+# -------------------------------------------------
+def _bm25_reference(sections, query, property_id, lang):
+    """Punteggi BM25 calcolati sezione per sezione, senza indice."""
+    bodies = [kb._section_body(s) for s in sections]
+    docs = [(body, s, Counter(kb._tokens(body))) for body, s in zip(bodies, sections) if body]
+    avgdl = sum(sum(tf.values()) for _, _, tf in docs) / len(docs)
+    df = Counter(term for _, _, tf in docs for term in tf)
+    scores = {}
+    for body, s, tf in docs:
+        if s["lang"] != lang or s["property"] not in (None, property_id):
+            continue
+        norm = kb._BM25_K1 * (1 - kb._BM25_B + kb._BM25_B * sum(tf.values()) / avgdl)
+        score = 0.0
+        matched = False
+        for term in set(kb._tokens(query)):
+            if term in tf:
+                matched = True
+                idf = math.log(1 + (len(docs) - df[term] + 0.5) / (df[term] + 0.5))
+                score += idf * tf[term] * (kb._BM25_K1 + 1) / (tf[term] + norm)
+        if matched:
+            scores[body] = score
+    return scores
+
+
+def test_tokens_fold_accents_and_case():
+    assert kb._tokens("Attività, PARCHEGGIO; perché 24h?") == ["attivita", "parcheggio", "perche", "24h"]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_snippets_rank_like_bm25(seed):
+    rng = random.Random(seed)
+    sections = list(kb._main_kb().snapshot.sections)
+    vocabulary = sorted({term for s in sections for term in kb._tokens(kb._section_body(s))})
+    props = sorted({s["property"] for s in sections if s["property"]})
+    for _ in range(50):
+        query = " ".join(rng.sample(vocabulary, rng.randint(1, 4)))
+        property_id = rng.choice(props + ["XX-99"])
+        lang = rng.choice(["it", "en"])
+        expected = _bm25_reference(sections, query, property_id, lang)
+
+        result = kb.kb_snippets_for(query, property_id, lang, top_k=4)
+        assert len(result) == min(4, len(expected))
+        scores = [expected[body] for body in result]
+        assert scores == sorted(scores, reverse=True)
+        assert scores == pytest.approx(sorted(expected.values(), reverse=True)[:4])
+
+
+def test_snippets_match_whole_terms_only():
+    # "pass" non deve trovare "PASSWORD" come faceva la ricerca per sottostringa
+    assert kb.kb_snippets_for("pass", "CT-01", "it") == []
+    assert any("PASSWORD" in body for body in kb.kb_snippets_for("password", "CT-01", "it"))
+
+
+# -------------------------------------------------
+# Ricarica a caldo
+# -------------------------------------------------
+def _wifi_password(property_id="CT-01"):
+    return kb._find_section("WIFI", property_id, "it")["kv"]["PASSWORD"]
+
+
+def _rewrite(path, old, new):
+    """Modifica il file e ne sposta l'mtime: la ricarica non dipende dalla risoluzione del filesystem."""
+    stat = path.stat()
+    path.write_text(path.read_text(encoding="utf-8").replace(old, new), encoding="utf-8")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def test_reload_swaps_the_snapshot(kb_copy):
+    manager = kb._main_kb()
+    before = manager.snapshot
+    assert _wifi_password() == "Sole123"
+    assert not manager.reload_if_changed()
+
+    _rewrite(kb_copy, "PASSWORD: Sole123", "PASSWORD: Luna456")
+    assert manager.reload_if_changed()
+    assert _wifi_password() == "Luna456"
+    assert manager.snapshot.version > before.version
+    # chi aveva letto lo snapshot vecchio continua a vedere la versione precedente
+    wifi = next(s for s in before.sections if s["name"] == "WIFI" and s["property"] == "CT-01")
+    assert wifi["kv"]["PASSWORD"] == "Sole123"
+
+
+def test_reload_error_keeps_the_current_snapshot(kb_copy, monkeypatch):
+    manager = kb._main_kb()
+    before = manager.snapshot
+    _rewrite(kb_copy, "Sole123", "Luna456")
+
+    def broken(*args, **kwargs):
+        raise ValueError("KB non valido")
+
+    monkeypatch.setattr(kb, "_parse_sections", broken)
+    assert not manager.reload_if_changed()
+    assert manager.snapshot is before
+
+
+def test_watcher_reloads_in_background(kb_copy, monkeypatch):
+    _setenv(monkeypatch, KB_RELOAD_INTERVAL=0.02)
+    kb.start_kb_watcher()
+    assert _wifi_password() == "Sole123"
+    _rewrite(kb_copy, "PASSWORD: Sole123", "PASSWORD: Luna456")
+    deadline = time.monotonic() + 5
+    while _wifi_password() != "Luna456":
+        assert time.monotonic() < deadline, "KB non ricaricato"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("interval", [0, 0.02])
+def test_watcher_start_loads_the_kb(monkeypatch, interval):
+    _setenv(monkeypatch, KB_RELOAD_INTERVAL=interval)
+    assert kb._KB is None and kb._SHARDS is None
+    kb.start_kb_watcher()
+    assert kb._KB is not None and kb._SHARDS is not None
+    assert (kb._watch_thread is not None) == (interval > 0)
+
+
+# -------------------------------------------------
+# Tabella delle sezioni e valori memorizzati
+# -------------------------------------------------
+def _find_section_reference(sections, name, property_id, lang):
+    """La ricerca a tre passate di prima: match perfetto, poi solo property, poi solo nome."""
+    name = name.upper()
+    for match in (
+        lambda s: s["name"] == name and s["property"] == property_id and s["lang"] == lang,
+        lambda s: s["name"] == name and s["property"] == property_id,
+        lambda s: s["name"] == name,
+    ):
+        for s in sections:
+            if match(s):
+                return s
+    return None
+
+
+def test_find_section_matches_the_fallback_chain():
+    sections = kb._main_kb().snapshot.sections
+    names = sorted({s["name"] for s in sections}) + ["NON_ESISTE"]
+    for name in names:
+        for property_id in ("CT-01", "CT-02", "XX-99"):
+            for lang in ("it", "en", "de"):
+                for query in (name, name.lower()):
+                    expected = _find_section_reference(sections, query, property_id, lang)
+                    assert kb._find_section(query, property_id, lang) is expected, (query, property_id, lang)
+
+
+def test_accessors_are_memoized_per_snapshot(kb_copy):
+    info = kb.get_initial_info("CT-01")
+    assert info["checkin_time"] == "12:00" and info["checkout_time"] == "11:00"
+    assert kb.get_initial_info("CT-01") is info
+    # lingua o struttura sconosciute ricadono sulla stessa voce
+    assert kb.get_initial_info("CT-01", "de") is kb.get_initial_info("CT-01", "fr")
+    assert kb.get_checkout("CT-01", "en")["time"] == "10:30"
+    assert kb.get_checkout("CT-02")["time"] == "10:30"  # fallback sul solo nome
+    assert kb.get_restaurants("CT-01") is None  # nessuna sezione RESTAURANTS
+
+    _rewrite(kb_copy, "ore 12:00", "ore 14:00")
+    assert kb._main_kb().reload_if_changed()
+    assert kb.get_initial_info("CT-01")["checkin_time"] == "14:00"
+
+
+# -------------------------------------------------
+# KB per struttura
+# -------------------------------------------------
+def _write_shard(kb_copy, property_id, password):
+    path = kb_copy.parent / "conoscenza" / f"{property_id}.txt"
+    path.write_text(f"# WIFI\n@lang:it\nSSID: {property_id}_WIFI\nPASSWORD: {password}\n", encoding="utf-8")
+    return path
+
+
+def test_shard_overrides_the_main_kb(kb_copy):
+    _write_shard(kb_copy, "CT-01", "Shard01")
+    assert _wifi_password("CT-01") == "Shard01"
+    assert any("Shard01" in body for body in kb.kb_snippets_for("password wifi", "CT-01", "it"))
+    # senza file si usa conoscenza.txt; id non validi non diventano percorsi
+    assert _wifi_password("CT-02") == "Lava2024"
+    assert _wifi_password("../conoscenza/CT-01") == "Sole123"
+
+
+def test_shards_are_an_lru(kb_copy, monkeypatch):
+    _setenv(monkeypatch, KB_SHARD_CACHE_SIZE=2)
+    for i in range(3):
+        _write_shard(kb_copy, f"P{i}", f"pw{i}")
+    assert [_wifi_password(f"P{i}") for i in range(3)] == ["pw0", "pw1", "pw2"]
+    assert list(kb._shards()._shards) == ["P1", "P2"]
+    _wifi_password("P1")
+    _wifi_password("P0")
+    assert list(kb._shards()._shards) == ["P1", "P0"]
+
+
+def test_shard_refresh_follows_the_directory(kb_copy):
+    assert _wifi_password("P9") == "Sole123"  # fallback senza @property
+    assert "P9" in kb._shards()._missing
+    path = _write_shard(kb_copy, "P9", "nuova")
+    assert _wifi_password("P9") == "Sole123"  # l'assenza resta in memoria fino al refresh
+    kb._shards().refresh()
+    assert _wifi_password("P9") == "nuova"
+
+    _rewrite(path, "nuova", "cambiata")
+    kb._shards().refresh()
+    assert _wifi_password("P9") == "cambiata"
+    path.unlink()
+    kb._shards().refresh()
+    assert _wifi_password("P9") == "Sole123"
+
+
+def test_missing_shards_are_bounded(kb_copy):
+    cache = kb._ShardCache(kb_copy.parent / "conoscenza", capacity=2, miss_capacity=3)
+    for i in range(10):
+        assert cache.get(f"X{i}") is None
+    assert list(cache._missing) == ["X7", "X8", "X9"]
+
+
+# -------------------------------------------------
+# Snapshot compilati
+# -------------------------------------------------
+def _forbid_parsing(monkeypatch):
+    """Da qui in poi il KB può arrivare solo da uno snapshot compilato."""
+
+    def fail(*args, **kwargs):
+        raise AssertionError("KB riparsato")
+
+    monkeypatch.setattr(kb, "_parse_sections", fail)
+
+
+def _digest(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def test_snapshot_is_compiled_and_reused(kb_copy, monkeypatch):
+    first = kb._build_snapshot(kb_copy)
+    assert kb.compiled_path(kb_copy).is_file()
+    _forbid_parsing(monkeypatch)
+    second = kb._build_snapshot(kb_copy)
+    assert second.sections == first.sections
+    assert second.index.state() == first.index.state()
+    assert kb.kb_snippets_for("parcheggio", "CT-02", "it")
+
+
+def test_startup_loads_the_compiled_snapshot(kb_copy, monkeypatch):
+    assert kb.compile_kb(kb_copy) == kb.compiled_path(kb_copy)
+    _forbid_parsing(monkeypatch)
+    kb.start_kb_watcher()
+    assert kb._KB is not None
+    assert _wifi_password() == "Sole123"
+
+
+def test_changed_source_is_reparsed(kb_copy):
+    kb.compile_kb(kb_copy)
+    manager = kb._main_kb()
+    _rewrite(kb_copy, "Sole123", "Luna456")
+    assert manager.reload_if_changed()
+    assert _wifi_password() == "Luna456"
+    # lo snapshot riscritto è quello del nuovo testo
+    assert kb._load_compiled(kb_copy, _digest(kb_copy), None) is not None
+
+
+def test_unreadable_snapshot_is_rebuilt(kb_copy, capsys):
+    kb.compiled_path(kb_copy).write_bytes(b"non marshal")
+    assert kb._build_snapshot(kb_copy).sections
+    assert "illeggibile" in capsys.readouterr().out
+    assert kb._load_compiled(kb_copy, _digest(kb_copy), None) is not None
+
+
+def test_snapshot_is_keyed_on_the_default_property(kb_copy):
+    path = _write_shard(kb_copy, "P1", "pw1")
+    kb.compile_kb(path, "P1")
+    assert kb._load_compiled(path, _digest(path), "P1") is not None
+    assert kb._load_compiled(path, _digest(path), None) is None
+
+
+def test_compiled_disabled_writes_nothing(kb_copy, monkeypatch):
+    _setenv(monkeypatch, KB_COMPILED=0)
+    kb._build_snapshot(kb_copy)
+    assert not kb.compiled_path(kb_copy).exists()
+
+
+def test_build_command_compiles_every_file(kb_copy):
+    pytest.importorskip("dotenv")
+    from app.services import kb_build
+
+    shard = _write_shard(kb_copy, "P1", "pw1")
+    assert kb_build.main([]) == 0
+    assert kb.compiled_path(kb_copy).is_file()
+    assert kb.compiled_path(shard).is_file()
+
+
+# -------------------------------------------------
+# Ricerca ibrida (TF-IDF su n-grammi)
+# -------------------------------------------------
+@pytest.fixture
+def hybrid(monkeypatch):
+    if kb.np is None:
+        pytest.skip("numpy non installato")
+    _setenv(monkeypatch, KB_RETRIEVAL="hybrid")
+
+
+def _cosine_reference(bodies, query):
+    """Coseno TF-IDF calcolato con la matrice densa."""
+    np = kb.np
+    docs = [kb._char_ngrams(body) for body in bodies]
+    vocab = sorted({gram for grams in docs for gram in grams})
+    col = {gram: i for i, gram in enumerate(vocab)}
+    df = np.zeros(len(vocab))
+    for grams in docs:
+        for gram in grams:
+            df[col[gram]] += 1
+    idf = np.log((1 + len(docs)) / (1 + df)) + 1
+
+    def vector(grams):
+        v = np.zeros(len(vocab))
+        for gram, count in grams.items():
+            if gram in col:
+                v[col[gram]] = (1 + math.log(count)) * idf[col[gram]]
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    matrix = np.array([vector(grams) for grams in docs])
+    return matrix @ vector(kb._char_ngrams(query))
+
+
+def test_vector_scores_match_dense_tfidf(hybrid):
+    snapshot = kb._main_kb().snapshot
+    assert snapshot.vectors is not None
+    for query in ("parcheggiare", "password del wifi", "spiagge vicine", "ristorante di pesce"):
+        expected = _cosine_reference(snapshot.index.bodies, query)
+        mask = [lang == "it" and prop in (None, "CT-01") for lang, prop in zip(snapshot.index.langs, snapshot.index.props)]
+        sims = snapshot.vectors.scores(query, "CT-01", "it")
+        assert sims.tolist() == pytest.approx((expected * mask).tolist(), abs=1e-5)
+
+
+def test_hybrid_finds_paraphrases(monkeypatch):
+    assert kb.kb_snippets_for("parcheggiare", "CT-02", "it") == []
+    if kb.np is None:
+        pytest.skip("numpy non installato")
+    _setenv(monkeypatch, KB_RETRIEVAL="hybrid")
+    _reset_state()
+    result = kb.kb_snippets_for("parcheggiare", "CT-02", "it", top_k=1)
+    assert result and result[0].startswith("PARKING")
+
+
+def test_compiled_snapshot_keeps_the_vectors(kb_copy, hybrid, monkeypatch):
+    _setenv(monkeypatch, KB_RETRIEVAL="bm25")
+    kb.compile_kb(kb_copy)  # senza vettori
+    _setenv(monkeypatch, KB_RETRIEVAL="hybrid")
+    assert kb._load_compiled(kb_copy, _digest(kb_copy), None)[2] is None
+    first = kb._build_snapshot(kb_copy)  # li aggiunge e riscrive lo snapshot
+    assert kb._load_compiled(kb_copy, _digest(kb_copy), None)[2] is not None
+    _forbid_parsing(monkeypatch)
+    second = kb._build_snapshot(kb_copy)
+    assert second.vectors is not None
+    assert second.vectors.state() == first.vectors.state()
+
+
+def test_hybrid_without_numpy_warns_at_startup(monkeypatch, capsys):
+    monkeypatch.setattr(kb, "np", None)
+    _setenv(monkeypatch, KB_RETRIEVAL="hybrid")
+    kb.start_kb_watcher()
+    assert capsys.readouterr().out.count("richiede numpy") == 1
+    assert kb._main_kb().snapshot.vectors is None
+    assert kb.kb_snippets_for("password", "CT-01", "it")
+    assert "richiede numpy" not in capsys.readouterr().out
+
+
+# -------------------------------------------------
+# Cache delle ricerche
+# -------------------------------------------------
+def test_query_cache_hits_on_the_normalized_query():
+    first = kb.kb_snippets_for("Password del WIFI?", "CT-01", "it")
+    assert kb.kb_snippets_for("wifi, password DEL", "CT-01", "it") == first
+    stats = kb.kb_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    # struttura, lingua e top_k fanno parte della chiave
+    kb.kb_snippets_for("password wifi", "CT-02", "it")
+    kb.kb_snippets_for("password wifi", "CT-01", "en")
+    kb.kb_snippets_for("password wifi", "CT-01", "it", top_k=1)
+    assert kb.kb_cache_stats()["misses"] == 4
+
+
+def test_query_cache_returns_copies():
+    kb.kb_snippets_for("password wifi", "CT-01", "it").clear()
+    assert kb.kb_snippets_for("password wifi", "CT-01", "it")
+
+
+def test_query_cache_follows_reloads(kb_copy):
+    assert any("Sole123" in body for body in kb.kb_snippets_for("password wifi", "CT-01", "it"))
+    _rewrite(kb_copy, "PASSWORD: Sole123", "PASSWORD: Luna456")
+    assert kb._main_kb().reload_if_changed()
+    result = kb.kb_snippets_for("password wifi", "CT-01", "it")
+    assert any("Luna456" in body for body in result)
+    assert kb.kb_cache_stats()["hits"] == 0
+
+
+def test_query_cache_ttl_and_capacity(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(kb._time, "monotonic", lambda: now[0])
+    cache = kb._QueryCache(capacity=2, ttl=10)
+    cache.put(("a",), ["1"])
+    cache.put(("b",), ["2"])
+    assert cache.get(("a",)) == ["1"]
+    cache.put(("c",), ["3"])  # esce "b", il meno usato
+    assert cache.get(("b",)) is None
+    now[0] += 11
+    assert cache.get(("a",)) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expired"], stats["evictions"]) == (1, 2, 1, 1)
+    assert stats["hit_ratio"] == round(1 / 3, 4)
+
+
+def test_query_cache_can_be_disabled(monkeypatch):
+    _setenv(monkeypatch, KB_QUERY_CACHE_SIZE=0)
+    for _ in range(3):
+        kb.kb_snippets_for("password wifi", "CT-01", "it")
+    stats = kb.kb_cache_stats()
+    assert (stats["hits"], stats["size"]) == (0, 0)
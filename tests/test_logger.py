@@ -0,0 +1,111 @@
+# tests/test_logger.py
+"""Test del log della chat in background (coda, NDJSON, rotazione, tab Logs)."""
+
+import gzip
+import json
+import os
+import threading
+
+import pytest
+
+from app.config import get_settings
+from app.services import chat_store, logger
+
+
+def _record(i):
+    return {
+        "ts": f"2031-01-02T10:00:{i % 60:02d}",
+        "property_id": "CT-01",
+        "locale": "it",
+        "guest_msg": f"domanda {i}",
+        "bot_msg": f"risposta {i}",
+        "used_ai": bool(i % 2),
+        "extra": {"kb_hits": i % 3},
+        "latency_ms": 10.0 + i,
+    }
+
+
+@pytest.fixture
+def sink(monkeypatch, tmp_path):
+    values = {
+        "CHAT_LOG_DIR": str(tmp_path / "logs"),
+        "CHAT_STORE_DIR": str(tmp_path / "store"),
+        "CHAT_LOG_FLUSH_INTERVAL": "0.05",
+        "CHAT_LOG_EXPORT_INTERVAL": "3600",
+    }
+    for name, value in values.items():
+        monkeypatch.setenv(name, value)
+    get_settings.cache_clear()
+    exported = []
+    monkeypatch.setattr(logger.sheets, "append_rows", lambda sheet, rows, wait=True: exported.append((sheet, rows)))
+    sink = logger._ChatLogSink()
+    sink.exported = exported
+    yield sink
+    sink.stop()
+    monkeypatch.undo()
+    get_settings.cache_clear()
+
+
+def _ndjson(directory):
+    lines = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".gz"):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                lines += f.read().splitlines()
+    current = os.path.join(directory, "chat.ndjson")
+    if os.path.exists(current):
+        with open(current, encoding="utf-8") as f:
+            lines += f.read().splitlines()
+    return [json.loads(line) for line in lines]
+
+
+def test_sink_writes_file_store_and_sheet(sink):
+    records = [_record(i) for i in range(50)]
+    for record in records:
+        assert sink.put(record)
+    sink.stop()
+
+    assert _ndjson(sink.dir) == records
+    assert chat_store.chat_stats()["total"] == 50
+    # l'esportazione nel tab Logs avviene in blocco, all'arresto
+    assert len(sink.exported) == 1
+    sheet, rows = sink.exported[0]
+    assert sheet == logger.LOG_SHEET_NAME
+    assert rows == [logger._sheet_row(record) for record in records]
+
+
+def test_sink_rotates_and_compresses(sink, monkeypatch):
+    monkeypatch.setenv("CHAT_LOG_ROTATE_BYTES", "2000")
+    monkeypatch.setenv("CHAT_LOG_BATCH_MAX", "5")
+    get_settings.cache_clear()
+    records = [_record(i) for i in range(60)]
+    for record in records:
+        sink.put(record)
+    sink.stop()
+
+    assert any(name.endswith(".ndjson.gz") for name in os.listdir(sink.dir))
+    assert _ndjson(sink.dir) == records
+
+
+def test_full_queue_drops_instead_of_blocking(sink, monkeypatch):
+    monkeypatch.setenv("CHAT_LOG_QUEUE_MAX", "1")
+    monkeypatch.setenv("CHAT_LOG_BATCH_MAX", "1")
+    get_settings.cache_clear()
+    writing, release = threading.Event(), threading.Event()
+    write = sink._write
+
+    def slow_write(batch):
+        writing.set()
+        release.wait(5)
+        write(batch)
+
+    monkeypatch.setattr(sink, "_write", slow_write)
+    assert sink.put(_record(0))
+    assert writing.wait(5)  # il thread è fermo sul primo log
+    assert sink.put(_record(1))  # riempie la coda
+    assert not sink.put(_record(2))
+    assert sink.dropped == 1
+    release.set()
+    sink.stop()
+    assert [r["guest_msg"] for r in _ndjson(sink.dir)] == ["domanda 0", "domanda 1"]
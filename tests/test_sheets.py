@@ -0,0 +1,600 @@
+# tests/test_sheets.py
+"""Test del backend prenotazioni (Excel e SQLite).
+
+BOOKINGS_EXCEL_PATH punta a una cartella temporanea (vedi conftest.py): ogni
+test parte da una copia fresca di Bookings.xlsx.
+"""
+
+import os
+import random
+import shutil
+import threading
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from app.config import get_settings
+from app.services import sheets
+
+_ORIGINAL_XLSX = Path(__file__).resolve().parents[1] / "Bookings.xlsx"
+
+_JOURNAL_PATH = sheets.BOOKINGS_EXCEL_PATH + ".journal"
+
+
+def _setenv(monkeypatch, **values):
+    """Imposta le variabili e rilegge i Settings (get_settings è memoizzato)."""
+
+    for name, value in values.items():
+        monkeypatch.setenv(name, value)
+    get_settings.cache_clear()
+
+
+def _disk_rows():
+    """Righe lette direttamente dal file, senza passare dalla cache."""
+
+    return [
+        {k: v for k, v in rec.items() if k != "_row_index"}
+        for rec in sheets._excel_stream_records({}, sheets.BOOKINGS_EXCEL_PATH)
+    ]
+
+
+def _reset_state():
+    sheets._EXCEL_WRITER.stop()
+    if sheets._EXCEL_JOURNAL is not None:
+        sheets._EXCEL_JOURNAL.stop()
+        sheets._EXCEL_JOURNAL = None
+    sheets._EXCEL_CACHE.invalidate()
+    sheets._BACKEND = None
+    conn = getattr(sheets._SQLITE_LOCAL, "conn", None)
+    if conn is not None:
+        conn.close()
+        del sheets._SQLITE_LOCAL.conn
+
+
+@pytest.fixture(autouse=True)
+def excel_copy(monkeypatch):
+    monkeypatch.delenv("BOOKINGS_BACKEND", raising=False)
+    _setenv(monkeypatch, GOOGLE_SERVICE_ACCOUNT_JSON="{}", BOOKINGS_EXCEL_JOURNAL="false")
+    _reset_state()
+    shutil.copyfile(_ORIGINAL_XLSX, sheets.BOOKINGS_EXCEL_PATH)
+    if os.path.exists(_JOURNAL_PATH):
+        os.unlink(_JOURNAL_PATH)
+    yield
+    _reset_state()
+    monkeypatch.undo()
+    get_settings.cache_clear()
+
+
+# ---------------------------------------------------------------------------
+# Copia raw dei membri dello zip
+# ---------------------------------------------------------------------------
+
+def test_raw_copied_xlsx_round_trip():
+    with zipfile.ZipFile(sheets.BOOKINGS_EXCEL_PATH) as zf:
+        original = {info.filename: zf.read(info) for info in zf.infolist()}
+        sheet_path = sheets._excel_sheet_path(zf, sheets.BOOKINGS_SHEET_NAME)
+    rows = _disk_rows()
+
+    sheets.update_row_dict(2, {"notes": "copia raw"})
+    sheets.append_row_dict({"checkin_date": "2031-05-06", "guest_last_name": "Raw", "guest_first_name": "Bea"})
+
+    with zipfile.ZipFile(sheets.BOOKINGS_EXCEL_PATH) as zf:
+        assert zf.testzip() is None
+        copied = {info.filename: zf.read(info) for info in zf.infolist()}
+    assert set(copied) == set(original)
+    # solo il foglio modificato (e le stringhe condivise, se usate) cambiano
+    for name, data in original.items():
+        if name not in (sheet_path, "xl/sharedStrings.xml"):
+            assert copied[name] == data, name
+
+    rows[0]["notes"] = "copia raw"
+    after = _disk_rows()
+    assert after[:-1] == rows
+    assert after[-1]["guest_last_name"] == "Raw"
+    assert after[-1]["checkin_date"] == "2031-05-06"
+    assert sheets.list_rows() == after
+
+
+# ---------------------------------------------------------------------------
+# Journal
+# ---------------------------------------------------------------------------
+
+def test_journal_replay_after_crash(monkeypatch):
+    # nessuna compattazione spontanea durante il test
+    _setenv(
+        monkeypatch,
+        BOOKINGS_EXCEL_JOURNAL="true",
+        BOOKINGS_EXCEL_JOURNAL_INTERVAL="3600",
+        BOOKINGS_EXCEL_JOURNAL_MAX_PENDING="100000",
+    )
+
+    before = _disk_rows()
+    target = 2
+    sheets.update_row_dict(target, {"notes": "dal journal"})
+    sheets.append_row_dict({"checkin_date": "2031-03-04", "guest_last_name": "Journal", "guest_first_name": "Ada"})
+    assert os.path.getsize(_JOURNAL_PATH) > 0
+    # le modifiche sono nel journal ma non ancora nel file
+    assert _disk_rows() == before
+
+    # crash tra l'append al journal e la compattazione: lo stato in memoria si perde
+    # e l'ultima riga del journal resta scritta a metà
+    with open(_JOURNAL_PATH, "a", encoding="utf-8") as fh:
+        fh.write('{"op": "update", "sheet": "Bookings", "row": 2, "data": {"notes": "trunc')
+    _reset_state()
+
+    sheets.start_background_tasks()
+
+    after = _disk_rows()
+    assert len(after) == len(before) + 1
+    assert after[target - 2]["notes"] == "dal journal"
+    assert after[-1]["guest_last_name"] == "Journal"
+    assert after[-1]["checkin_date"] == "2031-03-04"
+    assert os.path.getsize(_JOURNAL_PATH) == 0
+
+    # una seconda ripartenza non riapplica nulla
+    _reset_state()
+    assert sheets.compact_journal() == 0
+    assert _disk_rows() == after
+
+
+# ---------------------------------------------------------------------------
+# Cache del foglio
+# ---------------------------------------------------------------------------
+
+def test_cache_reparses_only_when_the_file_changes(monkeypatch):
+    parses = []
+    parse = sheets._excel_parse_rows
+    monkeypatch.setattr(sheets, "_excel_parse_rows", lambda: parses.append(1) or parse())
+
+    original = sheets.read_row_by_index(2)["notes"]
+    sheets.read_row_by_index(3)
+    sheets.find_booking("2025-12-10", "Rossi")
+    assert len(parses) == 1
+
+    # le nostre scritture aggiornano la cache senza rileggere il file
+    sheets.update_row_dict(2, {"notes": "in cache"})
+    assert sheets.read_row_by_index(2)["notes"] == "in cache"
+    assert len(parses) == 1
+
+    # una modifica esterna cambia la chiave del file e forza un nuovo parsing
+    shutil.copyfile(_ORIGINAL_XLSX, sheets.BOOKINGS_EXCEL_PATH)
+    os.utime(sheets.BOOKINGS_EXCEL_PATH, ns=(0, 10**9))
+    assert sheets.read_row_by_index(2)["notes"] == original
+    assert len(parses) == 2
+
+
+# ---------------------------------------------------------------------------
+# Indice per la ricerca delle prenotazioni
+# ---------------------------------------------------------------------------
+
+def _brute_force_matches(arrival, last_name, first_name=None):
+    return [
+        rec for rec in sheets.list_rows()
+        if rec["checkin_date"] == arrival
+        and sheets._name_key(rec["guest_last_name"]) == sheets._name_key(last_name)
+        and (not first_name or sheets._name_key(rec["guest_first_name"]) == sheets._name_key(first_name))
+    ]
+
+
+def test_find_booking_matches_brute_force():
+    sheets.append_row_dict({"checkin_date": "2025-12-10", "guest_last_name": "Rossi", "guest_first_name": "Anna"})
+    for rec in sheets.list_rows():
+        for first_name in (None, rec["guest_first_name"]):
+            expected = _brute_force_matches(rec["checkin_date"], rec["guest_last_name"], first_name)
+            row_index, found, count = sheets.find_booking(rec["checkin_date"], rec["guest_last_name"], first_name)
+            assert count == len(expected)
+            assert found == (expected[0] if count == 1 else None)
+            assert (row_index is None) == (count != 1)
+
+    # date in un altro formato e nomi con maiuscole/spazi diversi
+    _, found, count = sheets.find_booking("10/12/2025", "  rossi ", "ANNA")
+    assert count == 1 and found["guest_first_name"] == "Anna"
+
+
+def test_find_booking_follows_updates():
+    row_index, _, count = sheets.find_booking("2025-12-10", "Rossi", "Mario")
+    assert count == 1
+    sheets.update_row_dict(row_index, {"guest_last_name": "Verdi"})
+    assert sheets.find_booking("2025-12-10", "Rossi", "Mario")[2] == 0
+    assert sheets.find_booking("2025-12-10", "Verdi", "Mario")[0] == row_index
+
+
+# ---------------------------------------------------------------------------
+# Scrittore unico (group commit)
+# ---------------------------------------------------------------------------
+
+def _count_commits(monkeypatch):
+    commits = []
+    commit = sheets._excel_commit
+    monkeypatch.setattr(
+        sheets, "_excel_commit", lambda entries, strict=True: commits.append(len(entries)) or commit(entries, strict)
+    )
+    return commits
+
+
+def test_writer_groups_concurrent_writes(monkeypatch):
+    commits = _count_commits(monkeypatch)
+    before = _disk_rows()
+
+    # finché teniamo il lock lo scrittore non può scrivere: le modifiche si accumulano in coda
+    with sheets._EXCEL_LOCK:
+        futures = [
+            sheets.append_row_dict({"checkin_date": "2031-01-01", "guest_last_name": f"Gruppo{i}"}, wait=False)
+            for i in range(20)
+        ]
+        missing = sheets.update_row_dict(10_000, {"notes": "riga inesistente"}, wait=False)
+        futures.append(sheets.update_row_dict(2, {"notes": "nel gruppo"}, wait=False))
+    for fut in futures:
+        fut.result(timeout=10)
+    with pytest.raises(IndexError):
+        missing.result(timeout=10)
+
+    # al più la prima modifica viene scritta da sola, le altre in un'unica riscrittura
+    assert len(commits) <= 2 and sum(commits) == 21
+    after = _disk_rows()
+    assert [rec["guest_last_name"] for rec in after[len(before):]] == [f"Gruppo{i}" for i in range(20)]
+    assert after[0]["notes"] == "nel gruppo"
+
+
+def test_writer_respects_batch_max(monkeypatch):
+    _setenv(monkeypatch, BOOKINGS_WRITE_BATCH_MAX="3")
+    commits = _count_commits(monkeypatch)
+    with sheets._EXCEL_LOCK:
+        futures = [sheets.append_row_dict({"guest_last_name": f"Lotto{i}"}, wait=False) for i in range(10)]
+    for fut in futures:
+        fut.result(timeout=10)
+    assert max(commits) <= 3 and sum(commits) == 10
+
+
+# ---------------------------------------------------------------------------
+# Mirror del foglio Google
+# ---------------------------------------------------------------------------
+
+def _fake_google(monkeypatch, sheet):
+    """Foglio Google finto (`values`, `revision`): restituisce la lista dei download fatti."""
+
+    downloads = []
+
+    def fetch():
+        downloads.append(sheet["revision"])
+        return [list(row) for row in sheet["values"]]
+
+    def revision():
+        if isinstance(sheet["revision"], Exception):
+            raise sheet["revision"]
+        return sheet["revision"]
+
+    monkeypatch.setattr(sheets, "_google_fetch_values", fetch)
+    monkeypatch.setattr(sheets, "_google_revision", revision)
+    return downloads
+
+
+def test_google_mirror_skips_unchanged_revisions(monkeypatch):
+    sheet = {
+        "values": [["first_name", "last_name"], ["Mario", "Rossi"]],
+        "revision": ("2031-01-02T10:00:00.000Z", "7"),
+    }
+    downloads = _fake_google(monkeypatch, sheet)
+    mirror = sheets._GoogleMirror()
+    assert mirror.sync()
+    assert not mirror.sync()
+    assert len(downloads) == 1
+
+    sheet["values"].append(["Anna", "Bianchi"])
+    sheet["revision"] = ("2031-01-02T10:05:00.000Z", "8")
+    assert mirror.sync()
+    assert len(downloads) == 2
+    assert [rec.to_dict()["last_name"] for rec in mirror.table] == ["Rossi", "Bianchi"]
+
+    # dopo un'invalidazione si riscarica anche con la stessa versione
+    mirror.invalidate()
+    assert mirror.sync()
+    assert len(downloads) == 3
+
+
+def test_google_mirror_downloads_without_drive_metadata(monkeypatch, capsys):
+    sheet = {"values": [["first_name", "last_name"]], "revision": PermissionError("Drive API disattivata")}
+    downloads = _fake_google(monkeypatch, sheet)
+    mirror = sheets._GoogleMirror()
+    for _ in range(3):
+        mirror.sync()
+    assert len(downloads) == 3
+    assert capsys.readouterr().out.count("versione del foglio non leggibile") == 1
+
+
+# ---------------------------------------------------------------------------
+# Backend SQLite: import/export
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def sqlite_backend(monkeypatch, tmp_path):
+    _setenv(monkeypatch, BOOKINGS_BACKEND="sqlite", BOOKINGS_SQLITE_PATH=str(tmp_path / "bookings.sqlite3"))
+    _reset_state()
+    yield
+    _reset_state()
+
+
+def _members(path):
+    with zipfile.ZipFile(path) as zf:
+        assert zf.testzip() is None
+        return {info.filename: zf.read(info) for info in zf.infolist()}
+
+
+def _sheet_cells(path, sheet):
+    with zipfile.ZipFile(path) as zf:
+        shared = sheets._excel_shared_strings(zf)
+        return dict(sheets._excel_iter_cells(zf, sheets._excel_sheet_path(zf, sheet), shared))
+
+
+def test_sqlite_round_trip_keeps_the_workbook(sqlite_backend, tmp_path):
+    live = sheets.BOOKINGS_EXCEL_PATH
+    original = _members(live)
+    logs = _sheet_cells(live, "Logs")
+
+    count = sheets.import_excel_to_sqlite(live)
+    assert count == len(_disk_rows())
+    sheets.update_row_dict(2, {"notes": "da sqlite"})
+    sheets.append_row_dict({"checkin_date": "2031-07-08", "guest_last_name": "Sql", "guest_first_name": "Ida"})
+    sheets.append_row("Logs", ["2031-07-08", "CT-01", "domanda", "risposta"])
+    rows = sheets.list_rows()
+
+    out = str(tmp_path / "export.xlsx")
+    assert sheets.export_sqlite_to_excel(out) == count + 1
+    exported = _members(out)
+
+    # stessa struttura del file in uso: cambiano solo i due fogli
+    assert set(exported) == set(original)
+    with zipfile.ZipFile(live) as zf:
+        changed = {sheets._excel_sheet_path(zf, name) for name in ("Bookings", "Logs")}
+    for name, data in original.items():
+        if name not in changed:
+            assert exported[name] == data, name
+    assert _members(live) == original
+
+    assert [{k: v for k, v in rec.items() if k != "_row_index"}
+            for rec in sheets._excel_stream_records({}, out)] == rows
+    exported_logs = _sheet_cells(out, "Logs")
+    new_row = max(exported_logs)
+    assert {r: exported_logs[r] for r in logs} == logs
+    assert exported_logs[new_row] == {"A": "2031-07-08", "B": "CT-01", "C": "domanda", "D": "risposta"}
+
+    # reimportando l'export si ottiene lo stesso database
+    assert sheets.import_excel_to_sqlite(out) == count + 1
+    assert sheets.list_rows() == rows
+    again = str(tmp_path / "again.xlsx")
+    sheets.export_sqlite_to_excel(again)
+    assert _sheet_cells(again, "Logs") == exported_logs
+
+
+def test_sqlite_export_refuses_to_overwrite(sqlite_backend, tmp_path):
+    live = sheets.BOOKINGS_EXCEL_PATH
+    original = _members(live)
+    sheets.import_excel_to_sqlite(live)
+    sheets.update_row_dict(2, {"notes": "non nel file"})
+
+    with pytest.raises(FileExistsError):
+        sheets.export_sqlite_to_excel(live)
+    assert _members(live) == original
+
+    sheets.export_sqlite_to_excel(live, overwrite=True)
+    assert _disk_rows()[0]["notes"] == "non nel file"
+    assert set(_members(live)) == set(original)
+
+
+def test_sqlite_export_without_template(sqlite_backend, tmp_path):
+    sheets.import_excel_to_sqlite(sheets.BOOKINGS_EXCEL_PATH)
+    rows = sheets.list_rows()
+    out = str(tmp_path / "nuovo.xlsx")
+    sheets.export_sqlite_to_excel(out, template=None)
+
+    with zipfile.ZipFile(out) as zf:
+        assert sheets._excel_sheet_names(zf) == ["Bookings", "Logs"]
+    assert _sheet_cells(out, "Logs") == _sheet_cells(sheets.BOOKINGS_EXCEL_PATH, "Logs")
+    assert sheets.import_excel_to_sqlite(out) == len(rows)
+    assert sheets.list_rows() == rows
+
+
+# ---------------------------------------------------------------------------
+# Indice dei soggiorni
+# ---------------------------------------------------------------------------
+
+def _random_stays(rng, count):
+    stays = []
+    for row in range(2, count + 2):
+        start = rng.randrange(0, 120)
+        stays.append((start, start + rng.randrange(1, 15), row))
+    return stays
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_stay_index_overlapping_matches_brute_force(seed):
+    rng = random.Random(seed)
+    stays = _random_stays(rng, rng.randrange(1, 200))
+    index = sheets._StayIndex(stays)
+    for _ in range(300):
+        start = rng.randrange(-5, 140)
+        end = start + rng.randrange(0, 20)
+        expected = sorted(row for s, e, row in stays if s < end and e > start and start < end)
+        assert index.overlapping(start, end) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_stay_index_conflicts_matches_brute_force(seed):
+    rng = random.Random(seed)
+    stays = _random_stays(rng, rng.randrange(1, 120))
+    pairs = sheets._StayIndex(stays).conflicts()
+    expected = {
+        (min(a[2], b[2]), max(a[2], b[2]))
+        for i, a in enumerate(stays)
+        for b in stays[i + 1:]
+        if a[0] < b[1] and b[0] < a[1]
+    }
+    assert len(pairs) == len(set(pairs))
+    assert set(pairs) == expected
+
+
+def test_stay_index_empty():
+    index = sheets._StayIndex([])
+    assert index.overlapping(0, 10) == []
+    assert index.conflicts() == []
+
+
+@pytest.mark.parametrize("backend", ["excel", "sqlite"])
+def test_rows_without_checkout_have_no_departure(backend, request):
+    if backend == "sqlite":
+        request.getfixturevalue("sqlite_backend")
+        sheets.import_excel_to_sqlite(sheets.BOOKINGS_EXCEL_PATH)
+    sheets.append_row_dict({"property_id": "CT-01", "checkin_date": "2031-02-01", "guest_last_name": "Aperto"})
+    sheets.append_row_dict({
+        "property_id": "CT-01", "checkin_date": "2031-02-01", "checkout_date": "2031-02-02", "guest_last_name": "Chiuso",
+    })
+
+    def names(found):
+        return sorted(rec["guest_last_name"] for _, rec in found)
+
+    # la notte presunta conta per presenze e doppie prenotazioni...
+    assert names(sheets.bookings_in_house("2031-02-01", "CT-01")) == ["Aperto", "Chiuso"]
+    rows = {rec["guest_last_name"]: row for row, rec in sheets.bookings_arriving("2031-02-01", None, "CT-01")}
+    assert ("CT-01", rows["Aperto"], rows["Chiuso"]) in sheets.find_double_bookings("CT-01")
+    # ...ma solo chi ha un checkout risulta in partenza
+    assert names(sheets.bookings_departing("2031-02-02", None, "CT-01")) == ["Chiuso"]
+    assert "Aperto" not in names(sheets.bookings_departing("2031-01-01", "2031-12-31"))
+
+
+# ---------------------------------------------------------------------------
+# Transazioni: upsert e autorizzazione
+# ---------------------------------------------------------------------------
+
+def test_upsert_inserts_then_updates_with_one_write_each(monkeypatch):
+    commits = _count_commits(monkeypatch)
+    first = sheets.upsert_booking("2031-04-01", "Nuovo", "Ugo", {
+        "checkin_date": "2031-04-01", "guest_last_name": "Nuovo", "guest_first_name": "Ugo", "notes": "prima",
+    })
+    assert first["action"] == "inserted" and first["row_index"] is not None
+    second = sheets.upsert_booking("2031-04-01", "nuovo", "UGO", {"notes": "seconda"})
+    assert second == {"action": "updated", "row_index": first["row_index"], "data": second["data"]}
+    assert second["data"]["notes"] == "seconda"
+    assert sheets.read_row_by_index(first["row_index"])["notes"] == "seconda"
+    assert commits == [1, 1]
+
+
+def test_authorize_guest(monkeypatch):
+    commits = _count_commits(monkeypatch)
+    result = sheets.authorize_guest("2025-12-10", "Rossi", "Mario", "9876", "Wifi-1")
+    assert result["status"] == "ok"
+    stored = sheets.read_row_by_index(result["row_index"])
+    assert stored["authorized"] == "yes" and stored["checkin_code"] == "9876" and stored["status"] == "ready"
+    assert stored["notes"] == "riga di test"  # senza note nuove restano quelle salvate
+    assert result["data"] == stored
+    assert commits == [1]
+
+    assert sheets.authorize_guest("2025-12-10", "Nessuno", "Ugo", "1", "w")["status"] == "not_found"
+    sheets.append_row_dict({"checkin_date": "2025-12-10", "guest_last_name": "Rossi", "guest_first_name": "Mario"})
+    assert sheets.authorize_guest("2025-12-10", "Rossi", "Mario", "1", "w")["status"] == "ambiguous"
+
+
+def test_concurrent_upserts_of_the_same_guest_insert_once():
+    barrier = threading.Barrier(8)
+    results = []
+
+    def register(i):
+        barrier.wait()
+        results.append(sheets.upsert_booking("2031-06-01", "Gara", "Eva", {
+            "checkin_date": "2031-06-01", "guest_last_name": "Gara", "guest_first_name": "Eva", "notes": str(i),
+        }))
+
+    threads = [threading.Thread(target=register, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(r["action"] for r in results) == ["inserted"] + ["updated"] * 7
+    assert len({r["row_index"] for r in results}) == 1
+    assert sheets.find_booking("2031-06-01", "Gara", "Eva")[2] == 1
+
+
+# ---------------------------------------------------------------------------
+# Operazioni massive
+# ---------------------------------------------------------------------------
+
+def test_bulk_upsert_validates_each_item_and_writes_once(monkeypatch):
+    commits = _count_commits(monkeypatch)
+    results = sheets.bulk_upsert_bookings([
+        {"checkin_date": "2031-08-01", "guest_last_name": "Lotto", "guest_first_name": "Ada", "notes": "uno"},
+        "non un oggetto",
+        {"checkin_date": "non una data", "guest_last_name": "Lotto"},
+        {"checkin_date": "2031-08-01", "guest_last_name": ""},
+        # stesso ospite nella stessa richiesta: aggiorna la riga appena aggiunta
+        {"checkin_date": "01/08/2031", "guest_last_name": "lotto", "guest_first_name": "Ada", "notes": "due"},
+        # cella vuota (CSV): non cancella il valore salvato
+        {"checkin_date": "2025-12-10", "guest_last_name": "Rossi", "guest_first_name": "Mario", "notes": ""},
+    ])
+    assert [r["status"] for r in results] == ["ok", "invalid", "invalid", "invalid", "ok", "ok"]
+    assert [r.get("action") for r in results if r["status"] == "ok"] == ["inserted", "updated", "updated"]
+    assert results[0]["row_index"] == results[4]["row_index"] is not None
+    assert commits == [2]
+
+    _, added, count = sheets.find_booking("2031-08-01", "Lotto", "Ada")
+    assert count == 1 and added["notes"] == "due"
+    assert sheets.find_booking("2025-12-10", "Rossi", "Mario")[1]["notes"] == "riga di test"
+
+    # un secondo blocco vede le righe scritte dal primo
+    again = sheets.bulk_upsert_bookings([{"checkin_date": "2031-08-01", "guest_last_name": "Lotto", "guest_first_name": "Ada"}])
+    assert again[0]["action"] == "updated" and again[0]["row_index"] == results[0]["row_index"]
+
+
+def test_bulk_authorize(monkeypatch):
+    commits = _count_commits(monkeypatch)
+    results = sheets.bulk_authorize_guests([
+        {"arrival_date": "2025-12-10", "last_name": "Rossi", "first_name": "Mario", "checkin_code": "1", "wifi_coupon": "w1"},
+        {"arrival_date": "2025-10-31", "last_name": "Avellino", "first_name": "Nicola", "checkin_code": "2", "wifi_coupon": "w2"},
+        {"arrival_date": "2025-12-10", "last_name": "Nessuno", "first_name": "Ugo", "checkin_code": "3", "wifi_coupon": "w3"},
+        {"arrival_date": "2025-12-10", "last_name": "Rossi"},
+    ])
+    assert [r["status"] for r in results] == ["ok", "ok", "not_found", "invalid"]
+    assert commits == [2]
+    for result, code in zip(results[:2], ("1", "2")):
+        stored = sheets.read_row_by_index(result["row_index"])
+        assert stored["authorized"] == "yes" and stored["checkin_code"] == code
+
+
+# ---------------------------------------------------------------------------
+# Prenotazioni incomplete
+# ---------------------------------------------------------------------------
+
+def _brute_force_incomplete(property_id=None):
+    rows = sheets.list_rows()
+    return [
+        rec for rec in rows
+        if sheets._missing_details(rec) and (not property_id or rec["property_id"] == property_id)
+    ]
+
+
+@pytest.mark.parametrize("backend", ["excel", "sqlite"])
+def test_incomplete_set_follows_writes(backend, request):
+    if backend == "sqlite":
+        request.getfixturevalue("sqlite_backend")
+        sheets.import_excel_to_sqlite(sheets.BOOKINGS_EXCEL_PATH)
+
+    def check():
+        for pid in (None, "CT-01", "XX-99"):
+            expected = _brute_force_incomplete(pid)
+            assert sheets.count_incomplete_bookings(pid) == len(expected)
+            assert sheets.has_incomplete_bookings(pid) == bool(expected)
+            assert sheets.list_incomplete_bookings(pid) == expected
+
+    check()
+    sheets.append_row_dict({"property_id": "XX-99", "checkin_date": "2031-09-01", "guest_last_name": "Senza"})
+    check()
+    row_index = sheets.find_booking("2031-09-01", "Senza")[0]
+    sheets.update_row_dict(row_index, {"guest_first_name": "Ora", "guest_email": "ora@example.com"})
+    check()
+    sheets.update_row_dict(row_index, {"guest_email": ""})
+    check()
+
+    # paginazione in ordine di riga
+    rows = sheets.incomplete_booking_rows()
+    assert sheets.incomplete_booking_rows(offset=1, limit=1) == rows[1:2]
+    assert [idx for idx, _ in rows] == sorted(idx for idx, _ in rows)